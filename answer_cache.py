@@ -0,0 +1,302 @@
+# answer_cache.py
+# /api/ask 的兩層答案快取：
+#   第一層：正規化後的問題文字完全相同。
+#   第二層：問題向量與快取中某個問題的 cosine 相似度高於門檻。
+# 兩層都有 TTL 與 LRU 淘汰；知識庫 (factory_manuals) 版本改變時整個快取失效。
+# 可選擇以 MongoDB 的 Queries 集合作為持久層，讓重啟後與多個 gunicorn worker 之間共用熱門答案。
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = "?？!！。.,，~～ "
+
+
+def normalize_question(question):
+    """全形轉半形、轉小寫、合併空白並去掉結尾標點，讓「忘記密碼？」與「忘記密碼」視為同一題。"""
+    if not question:
+        return ""
+    text = unicodedata.normalize("NFKC", question).lower()
+    text = _WHITESPACE_RE.sub(" ", text).strip()
+    return text.rstrip(_TRAILING_PUNCTUATION)
+
+
+def _unit_vector(vector):
+    arr = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(arr))
+    return arr / norm if norm > 0 else arr
+
+
+class CachedAnswer:
+    __slots__ = ('normalized_question', 'answer', 'source', 'is_internal', 'vector', 'created_at', 'kb_version')
+
+    def __init__(self, normalized_question, answer, source, is_internal, vector, created_at, kb_version):
+        self.normalized_question = normalized_question
+        self.answer = answer
+        self.source = source
+        self.is_internal = is_internal
+        self.vector = vector
+        self.created_at = created_at
+        self.kb_version = kb_version
+
+
+class AnswerCache:
+    """
+    執行緒安全的兩層答案快取。
+
+    kb_version_provider: 回傳知識庫目前版本字串的函式 (可能很慢，例如 scroll 整個 collection)，
+                         由 start_version_refresh() 的背景執行緒每 version_check_interval 秒呼叫一次，
+                         查詢不會呼叫；版本改變時清空快取，持久層中舊版本的記錄也不會再被採用。
+    mongo_collection:    可選，MongoDB Queries 集合；save_qa_to_mongodb 寫入的記錄會帶上
+                         normalized_question / query_vector / kb_version / cacheable 欄位。用於建立索引與預熱。
+    lookup_collection:   可選，第一層未命中時查詢持久層所用的集合 (應來自逾時很短的用戶端，查詢在請求的執行緒上進行)；
+                         未設定時使用 mongo_collection。查詢失敗後 lookup_failure_cooldown 秒內不再查詢持久層。
+    """
+
+    def __init__(self, max_entries=1000, ttl_seconds=86400, similarity_threshold=0.95,
+                 kb_version_provider=None, version_check_interval=60, mongo_collection=None,
+                 lookup_collection=None, lookup_failure_cooldown=30.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.kb_version_provider = kb_version_provider
+        self.version_check_interval = version_check_interval
+        self.mongo_collection = mongo_collection
+        self.lookup_collection = lookup_collection
+        self.lookup_failure_cooldown = lookup_failure_cooldown
+        self._lookup_disabled_until = 0.0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # normalized_question -> CachedAnswer (尾端為最近使用)
+        self._matrix = None            # 第二層使用的向量矩陣 (float32, 已正規化)
+        self._matrix_keys = []
+        self._matrix_dirty = True
+        self._kb_version = None
+
+        self._exact_hits = 0
+        self._semantic_hits = 0
+        self._persistent_hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    # --- 知識庫版本 ---
+    @property
+    def kb_version(self):
+        return self._kb_version
+
+    def start_version_refresh(self):
+        """啟動背景執行緒，立即讀取一次知識庫版本，之後每 version_check_interval 秒檢查一次。"""
+        if self.kb_version_provider is None:
+            return
+        threading.Thread(target=self._version_refresh_loop, name="answer-cache-kb-version", daemon=True).start()
+
+    def _version_refresh_loop(self):
+        while True:
+            self._refresh_kb_version()
+            time.sleep(self.version_check_interval)
+
+    def _refresh_kb_version(self):
+        if self.kb_version_provider is None:
+            return
+        try:
+            version = self.kb_version_provider()
+        except Exception as e:
+            print(f"🟡 無法取得知識庫版本，暫時沿用舊版本: {e}")
+            return
+        if version != self._kb_version:
+            if self._kb_version is not None:
+                print(f"知識庫版本已變更 ({self._kb_version} -> {version})，清空答案快取。")
+                self.clear()
+                self._invalidations += 1
+            else:
+                print(f"✅ 知識庫版本: {version}")
+            self._kb_version = version
+
+    def invalidate(self):
+        """知識庫更新後由外部呼叫，立即清空快取並重新讀取版本。"""
+        self.clear()
+        self._invalidations += 1
+        self._kb_version = None
+        self._refresh_kb_version()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self._matrix_keys = []
+            self._matrix_dirty = True
+
+    # --- 內部輔助函式 ---
+    def _is_fresh(self, entry):
+        return (time.time() - entry.created_at) <= self.ttl_seconds and entry.kb_version == self._kb_version
+
+    def _store(self, entry):
+        # 呼叫端需持有 self._lock
+        key = entry.normalized_question
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._matrix_dirty = True
+
+    def _rebuild_matrix(self):
+        # 呼叫端需持有 self._lock
+        keys = [k for k, e in self._entries.items() if e.vector is not None]
+        self._matrix_keys = keys
+        self._matrix = np.stack([self._entries[k].vector for k in keys]) if keys else None
+        self._matrix_dirty = False
+
+    # --- 查詢 ---
+    def get_exact(self, question):
+        """第一層：以正規化文字查詢，先查記憶體再查 MongoDB。回傳 CachedAnswer 或 None。"""
+        key = normalize_question(question)
+        if not key:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._is_fresh(entry):
+                    self._entries.move_to_end(key)
+                    self._exact_hits += 1
+                    return entry
+                del self._entries[key]
+                self._matrix_dirty = True
+
+        entry = self._load_from_mongodb(key)
+        if entry is not None:
+            with self._lock:
+                self._store(entry)
+                self._persistent_hits += 1
+                self._exact_hits += 1
+        return entry
+
+    def get_similar(self, query_vector):
+        """第二層：以向量找最相近且相似度高於門檻的快取答案。回傳 (CachedAnswer, 相似度) 或 (None, 最高相似度)。"""
+        query = _unit_vector(query_vector)
+        with self._lock:
+            if self._matrix_dirty:
+                self._rebuild_matrix()
+            if self._matrix is None:
+                self._misses += 1
+                return None, 0.0
+            scores = self._matrix @ query
+            order = np.argsort(-scores)
+            best_score = float(scores[order[0]])
+            for idx in order:
+                score = float(scores[idx])
+                if score < self.similarity_threshold:
+                    break
+                key = self._matrix_keys[idx]
+                entry = self._entries.get(key)
+                if entry is None or not self._is_fresh(entry):
+                    continue
+                self._entries.move_to_end(key)
+                self._semantic_hits += 1
+                return entry, score
+            self._misses += 1
+            return None, best_score
+
+    # --- 寫入 ---
+    def put(self, question, query_vector, answer, source, is_internal):
+        key = normalize_question(question)
+        if not key:
+            return
+        vector = _unit_vector(query_vector) if query_vector is not None else None
+        entry = CachedAnswer(key, answer, source, is_internal, vector, time.time(), self._kb_version)
+        with self._lock:
+            self._store(entry)
+
+    def persistent_fields(self, question, query_vector):
+        """save_qa_to_mongodb 需要額外寫入的欄位，讓這筆記錄可被其他 worker 當作快取使用。"""
+        return {
+            'normalized_question': normalize_question(question),
+            'query_vector': [float(x) for x in query_vector] if query_vector is not None else None,
+            'kb_version': self._kb_version,
+            'cacheable': True,
+        }
+
+    # --- MongoDB 持久層 ---
+    def _mongo_filter(self):
+        return {
+            'cacheable': True,
+            'kb_version': self._kb_version,
+            'timestamp': {'$gte': time.time() - self.ttl_seconds},
+        }
+
+    def _entry_from_document(self, doc):
+        vector = doc.get('query_vector')
+        source = doc.get('來源', '')
+        return CachedAnswer(
+            doc['normalized_question'],
+            doc.get('回答', ''),
+            source,
+            source.startswith('內部'),
+            _unit_vector(vector) if vector else None,
+            doc.get('timestamp', time.time()),
+            doc.get('kb_version'),
+        )
+
+    def _load_from_mongodb(self, key):
+        collection = self.lookup_collection if self.lookup_collection is not None else self.mongo_collection
+        if collection is None or self._kb_version is None or time.monotonic() < self._lookup_disabled_until:
+            return None
+        try:
+            query = self._mongo_filter()
+            query['normalized_question'] = key
+            doc = collection.find_one(query, sort=[('timestamp', -1)])
+        except Exception as e:
+            self._lookup_disabled_until = time.monotonic() + self.lookup_failure_cooldown
+            print(f"🟡 從 MongoDB 讀取答案快取失敗，{self.lookup_failure_cooldown:g} 秒內只使用記憶體快取: {e}")
+            return None
+        return self._entry_from_document(doc) if doc else None
+
+    def ensure_indexes(self):
+        if self.mongo_collection is None:
+            return
+        try:
+            self.mongo_collection.create_index([('normalized_question', 1), ('timestamp', -1)])
+        except Exception as e:
+            print(f"🟡 建立答案快取索引失敗 (不影響查詢): {e}")
+
+    def warm_from_mongodb(self, limit=500):
+        """啟動時從 MongoDB 載入最近的可快取記錄，讓第二層 (向量相似) 在重啟後也能立即命中。"""
+        if self.mongo_collection is None:
+            return 0
+        if self._kb_version is None:
+            # 在背景初始化執行緒中呼叫，版本尚未讀取時在此讀取
+            self._refresh_kb_version()
+        try:
+            cursor = self.mongo_collection.find(self._mongo_filter()).sort('timestamp', -1).limit(limit)
+            docs = list(cursor)
+        except Exception as e:
+            print(f"🟡 從 MongoDB 預熱答案快取失敗: {e}")
+            return 0
+        loaded = 0
+        with self._lock:
+            # 由舊到新放入，讓最新的記錄位於 LRU 尾端
+            for doc in reversed(docs):
+                if doc.get('normalized_question') and doc['normalized_question'] not in self._entries:
+                    self._store(self._entry_from_document(doc))
+                    loaded += 1
+        print(f"✅ 已從 MongoDB 預熱 {loaded} 筆答案快取。")
+        return loaded
+
+    def stats(self):
+        with self._lock:
+            lookups = self._exact_hits + self._semantic_hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'kb_version': self._kb_version,
+                'exact_hits': self._exact_hits,
+                'semantic_hits': self._semantic_hits,
+                'persistent_hits': self._persistent_hits,
+                'misses': self._misses,
+                'hit_rate': round((self._exact_hits + self._semantic_hits) / lookups, 4) if lookups else 0.0,
+                'invalidations': self._invalidations,
+            }
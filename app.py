@@ -1,16 +1,42 @@
 import os
+import re
 import time
+import base64
+import hashlib
+from datetime import datetime, timedelta
+import numpy as np
 import pandas as pd
 import pyodbc
 from dotenv import load_dotenv
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, g, jsonify, render_template, request, stream_with_context
 import json
+from urllib.parse import urlencode
 from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
 import uuid
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, models
 import google.generativeai as genai
+import certifi
 import traceback
+import threading
+import atexit
+from sql_pool import SQLConnectionPool
+from answer_cache import AnswerCache, normalize_question
+from embedding_cache import EmbeddingCache, MongoEmbeddingStore
+from qa_writer import BackgroundQAWriter
+from context_budget import ContextBuilder, dense_score, extractive_candidate
+from readiness import BackendReadiness
+from lexical_index import LexicalIndex
+from local_vector_index import LocalVectorIndex
+from log_cursor import decode_log_cursor, encode_log_cursor, keyset_condition
+from log_formatting import format_log_frame, json_with_rows, log_rows_json, parse_log_fields, source_columns
+from batch_qa import BatchSummary, RateLimitGate, chunked, run_bounded
+from metrics import Metrics
+from collection_profiles import search_params
+from single_flight import MongoFlightLease, SingleFlight
+from ttl_cache import TTLCache
+from response_compression import compress_response
+from model_router import (NOT_IT_REFUSAL, ModelRouter, build_classification_prompt, is_truncated,
+                          parse_classification, summarize_usage, usage_from_response)
 
 # # --- 0. 從 .env 檔案載入環境變數 ---
 # if os.environ.get("ENV") != 'production':
@@ -28,307 +54,1561 @@ GCP_SQL_DATABASE = os.environ.get("GCP_SQL_DATABASE")
 GCP_SQL_USERNAME = os.environ.get("GCP_SQL_USERNAME")
 GCP_SQL_PASSWORD = os.environ.get("GCP_SQL_PASSWORD")
 ODBC_DRIVER = os.environ.get("ODBC_DRIVER", '{ODBC Driver 18 for SQL Server}')
+# /api/logs 分頁設定：每頁預設筆數與上限 (避免一次載入整張 log_data 表)
+LOGS_DEFAULT_PAGE_SIZE = int(os.environ.get("LOGS_DEFAULT_PAGE_SIZE", "50"))
+LOGS_MAX_PAGE_SIZE = int(os.environ.get("LOGS_MAX_PAGE_SIZE", "200"))
+LOG_STATUSES = ('未開始', '進行中', '已完成')
+# log_data.log_date 的 SQL Server 型別 (DATETIME / DATETIME2(n) / SMALLDATETIME)，須與資料表相同
+# (見 sql/log_data_indexes.sql)；分頁游標的時間會先 CAST 成此型別再比較
+LOGS_DATE_SQL_TYPE = os.environ.get("LOGS_DATE_SQL_TYPE", "DATETIME").strip()
+# 增量同步與 ETag：log_data 的 rowversion 欄位名稱 (建立方式見 sql/log_data_rowversion.sql)，
+# 水位為該欄位的 MAX() (索引查詢)，異動過的列也直接依此欄位查出；
+# 未設定時不提供增量同步與 ETag，前端每次重新載入目前頁面
+LOGS_ROWVERSION_COLUMN = os.environ.get("LOGS_ROWVERSION_COLUMN", "").strip() or None
+# 一次增量回應最多的列數，超過時要求前端重新載入
+LOGS_DELTA_MAX_ROWS = int(os.environ.get("LOGS_DELTA_MAX_ROWS", "500"))
+# 批次更新 (/api/logs/update/bulk) 一次最多的列數
+LOGS_BULK_UPDATE_MAX_ROWS = int(os.environ.get("LOGS_BULK_UPDATE_MAX_ROWS", "1000"))
+# 彙總 (/api/logs/summary)：行程內快取的秒數 (本 worker 的更新會立即清除，其他 worker 最多延遲這麼久)，
+# 以及依日 / 依小時統計的預設範圍與上限
+LOGS_SUMMARY_TTL_SECONDS = float(os.environ.get("LOGS_SUMMARY_TTL_SECONDS", "15"))
+LOGS_SUMMARY_DAYS = int(os.environ.get("LOGS_SUMMARY_DAYS", "14"))
+LOGS_SUMMARY_MAX_DAYS = int(os.environ.get("LOGS_SUMMARY_MAX_DAYS", "90"))
+LOGS_SUMMARY_HOURS = int(os.environ.get("LOGS_SUMMARY_HOURS", "24"))
+LOGS_SUMMARY_MAX_HOURS = int(os.environ.get("LOGS_SUMMARY_MAX_HOURS", "168"))
+# SQL Server 單一查詢最多 2100 個參數；IN (...) 查詢每次最多帶的參數數
+SQL_MAX_QUERY_PARAMS = 2000
+# SQL 連線池設定：最多同時保留的連線數、等待連線的逾時、連線最長存活時間與閒置多久需要健康檢查
+SQL_POOL_MAX_SIZE = int(os.environ.get("SQL_POOL_MAX_SIZE", "5"))
+SQL_POOL_TIMEOUT = float(os.environ.get("SQL_POOL_TIMEOUT", "30"))
+SQL_POOL_MAX_LIFETIME = float(os.environ.get("SQL_POOL_MAX_LIFETIME", "1800"))
+SQL_POOL_HEALTH_CHECK_IDLE = float(os.environ.get("SQL_POOL_HEALTH_CHECK_IDLE", "30"))
+# 連線重試：有上限的指數退避 (秒)
+SQL_CONNECT_RETRIES = int(os.environ.get("SQL_CONNECT_RETRIES", "5"))
+SQL_CONNECT_BACKOFF_BASE = float(os.environ.get("SQL_CONNECT_BACKOFF_BASE", "0.5"))
+SQL_CONNECT_BACKOFF_MAX = float(os.environ.get("SQL_CONNECT_BACKOFF_MAX", "8"))
 
 # --- 3. 從環境變數讀取 MongoDB 設定 (已修改) ---
 MONGO_CONNECTION_STRING = os.environ.get("MONGO_CONNECTION_STRING")
 MONGO_DATABASE_NAME = os.environ.get("MONGO_DATABASE_NAME", "ITKnowledgeBase")
 MONGO_COLLECTION_NAME = os.environ.get("MONGO_COLLECTION_NAME", "Queries")
-
-# --- 初始化 MongoDB Client (已修改並加入 certifi) ---
-import certifi  # <--- 1. 匯入 certifi
-
-mongo_collection = None
-is_mongodb_configured = bool(MONGO_CONNECTION_STRING)
-if not is_mongodb_configured:
-    print("警告: MongoDB 連接字串 (MONGO_CONNECTION_STRING) 未在 .env 檔案中設定。問答記錄將不會儲存。")
-else:
-    try:
-        print("正在連接到 MongoDB...")
-        
-        # --- 2. 在 MongoClient 中加入 tlsCAFile 參數 ---
-        mongo_client = MongoClient(
-            MONGO_CONNECTION_STRING,
-            tlsCAFile=certifi.where()
-        )
-        # --------------------------------------------------
-
-        # 使用 ping 指令來驗證連線
-        mongo_client.admin.command('ping')
-        db = mongo_client[MONGO_DATABASE_NAME]
-        mongo_collection = db[MONGO_COLLECTION_NAME]
-        print("✅ MongoDB 用戶端初始化成功。")
-    except ConnectionFailure as e:
-        print(f"❌ 初始化 MongoDB 用戶端時發生連線錯誤: {e}")
-        print("   請檢查：")
-        print("   1. 連線字串 (MONGO_CONNECTION_STRING) 是否正確。")
-        print("   2. MongoDB Atlas 的 Network Access 清單是否已加入您伺服器的 IP。")
-        mongo_collection = None
-        is_mongodb_configured = False
-    except Exception as e:
-        print(f"❌ 初始化 MongoDB 用戶端時發生未預期的錯誤: {e}")
-        mongo_collection = None
-        is_mongodb_configured = False
+# 請求路徑上的 MongoDB 操作 (跨 worker 租約等) 使用另一個逾時很短的用戶端 (毫秒)，
+# MongoDB 無法連線時請求很快改走不需要 MongoDB 的路徑，而不是等待驅動程式預設的 30 秒
+MONGO_REQUEST_TIMEOUT_MS = int(os.environ.get("MONGO_REQUEST_TIMEOUT_MS", "500"))
 
 # --- 4. 從環境變數讀取 Qdrant 設定 ---
 QDRANT_URL = os.environ.get("QDRANT_URL", "http://localhost:6333")
 QDRANT_API_KEY = os.environ.get("QDRANT_API_KEY")
 QDRANT_COLLECTION_NAME = "factory_manuals"
+# 查詢參數 (搭配 collection_profiles.py 的設定檔，由 provision_collection.py 建議)：
+# HNSW 搜尋寬度 (0 表示使用集合的 ef_construct)；量化集合先取 limit × oversampling 個候選，再以原始向量重新計分
+QDRANT_HNSW_EF = int(os.environ.get("QDRANT_HNSW_EF", "0"))
+QDRANT_SEARCH_EXACT = os.environ.get("QDRANT_SEARCH_EXACT", "false").lower() == "true"
+QDRANT_QUANTIZATION_RESCORE = os.environ.get("QDRANT_QUANTIZATION_RESCORE", "true").lower() == "true"
+QDRANT_QUANTIZATION_OVERSAMPLING = float(os.environ.get("QDRANT_QUANTIZATION_OVERSAMPLING", "2.0"))
+# 遠端 Qdrant 的傳輸方式：true 時改用 gRPC (需開放 QDRANT_GRPC_PORT)，省去 REST 的 JSON 編碼
+QDRANT_PREFER_GRPC = os.environ.get("QDRANT_PREFER_GRPC", "false").lower() == "true"
+QDRANT_GRPC_PORT = int(os.environ.get("QDRANT_GRPC_PORT", "6334"))
+QDRANT_TIMEOUT = int(os.environ.get("QDRANT_TIMEOUT", "20"))
+# 向量搜尋後端：qdrant (每次查詢呼叫遠端 Qdrant) 或 local (由 Qdrant 匯出到行程內的 NumPy 矩陣，適合小型知識庫)；
+# local 的索引載入完成前仍由遠端 Qdrant 回答
+VECTOR_SEARCH_BACKEND = os.environ.get("VECTOR_SEARCH_BACKEND", "qdrant").lower()
+# local 模式的向量檔 (.npy，以 memory-map 載入，同機的多個 worker 共用)；未設定時只保留在記憶體
+LOCAL_VECTOR_INDEX_PATH = os.environ.get("LOCAL_VECTOR_INDEX_PATH") or None
+# 多久檢查一次知識庫版本，版本改變時重新匯出 (秒)
+LOCAL_VECTOR_INDEX_REFRESH_SECONDS = int(os.environ.get("LOCAL_VECTOR_INDEX_REFRESH_SECONDS", "300"))
+
+# --- 5. 答案快取設定 (/api/ask) ---
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_TTL_SECONDS = int(os.environ.get("ANSWER_CACHE_TTL_SECONDS", "86400"))
+# 第二層 (向量相似) 命中門檻：cosine 相似度需高於此值才視為同一個問題
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", "0.95"))
+ANSWER_CACHE_VERSION_CHECK_SECONDS = int(os.environ.get("ANSWER_CACHE_VERSION_CHECK_SECONDS", "60"))
+# 是否以 MongoDB Queries 集合作為持久層 (跨 worker / 重啟共用)，以及啟動時預熱的筆數
+ANSWER_CACHE_PERSISTENT = os.environ.get("ANSWER_CACHE_PERSISTENT", "true").lower() == "true"
+ANSWER_CACHE_WARM_LIMIT = int(os.environ.get("ANSWER_CACHE_WARM_LIMIT", "500"))
+
+# --- 6. Embedding 快取設定 ---
+EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "5000"))
+# 可選的持久層：將向量以 float32 位元組存到 MongoDB 的獨立集合
+EMBEDDING_CACHE_PERSISTENT = os.environ.get("EMBEDDING_CACHE_PERSISTENT", "false").lower() == "true"
+EMBEDDING_CACHE_COLLECTION = os.environ.get("EMBEDDING_CACHE_COLLECTION", "EmbeddingCache")
+
+# --- 7. 問答記錄背景寫入設定 ---
+QA_WRITER_ENABLED = os.environ.get("QA_WRITER_ENABLED", "true").lower() == "true"
+QA_WRITER_QUEUE_SIZE = int(os.environ.get("QA_WRITER_QUEUE_SIZE", "10000"))
+QA_WRITER_BATCH_SIZE = int(os.environ.get("QA_WRITER_BATCH_SIZE", "100"))
+QA_WRITER_FLUSH_INTERVAL = float(os.environ.get("QA_WRITER_FLUSH_INTERVAL", "1.0"))
+# 佇列已滿或 MongoDB 無法連線時暫存記錄的目錄 (每個行程一個檔案，啟動時接手已結束行程留下的檔案)；
+# 需為重啟後仍保留的位置 (Cloud Run 等容器的 /tmp 重啟即消失，應掛載永久磁碟)，設為空字串則不使用 spool
+QA_WRITER_SPOOL_DIR = os.environ.get(
+    "QA_WRITER_SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "qa_spool")
+).strip() or None
+
+# --- 8. 檢索結果後處理設定 (分數落差截斷 / MMR 去重 / 上下文 token 預算) ---
+RETRIEVAL_SEARCH_LIMIT = int(os.environ.get("RETRIEVAL_SEARCH_LIMIT", "50"))
+RETRIEVAL_MAX_SCORE_GAP = float(os.environ.get("RETRIEVAL_MAX_SCORE_GAP", "0.08"))
+RETRIEVAL_MIN_RELATIVE_SCORE = float(os.environ.get("RETRIEVAL_MIN_RELATIVE_SCORE", "0.8"))
+RETRIEVAL_MMR_LAMBDA = float(os.environ.get("RETRIEVAL_MMR_LAMBDA", "0.7"))
+RETRIEVAL_DUPLICATE_THRESHOLD = float(os.environ.get("RETRIEVAL_DUPLICATE_THRESHOLD", "0.85"))
+RETRIEVAL_MAX_CONTEXT_TOKENS = int(os.environ.get("RETRIEVAL_MAX_CONTEXT_TOKENS", "3000"))
+RETRIEVAL_MAX_CHUNKS = int(os.environ.get("RETRIEVAL_MAX_CHUNKS", "8"))
+
+# --- 9. 背景初始化設定 ---
+# 後端連線驗證失敗時的最長重試間隔 (秒)
+BACKEND_INIT_MAX_RETRY_INTERVAL = float(os.environ.get("BACKEND_INIT_MAX_RETRY_INTERVAL", "30"))
+
+# --- 10. 混合檢索 (BM25 詞彙索引 + 向量) 設定 ---
+LEXICAL_INDEX_ENABLED = os.environ.get("LEXICAL_INDEX_ENABLED", "true").lower() == "true"
+# 融合分數 (只用來排序候選結果，分數門檻仍比較 cosine 分數) 中 BM25 的權重，其餘為向量 cosine 分數
+LEXICAL_WEIGHT = float(os.environ.get("LEXICAL_WEIGHT", "0.3"))
+LEXICAL_SEARCH_LIMIT = int(os.environ.get("LEXICAL_SEARCH_LIMIT", "20"))
+# 只被 BM25 找到的區塊需達到的最低 cosine 分數 (含識別碼的區塊不受限)；預設與向量搜尋的門檻 (SEARCH_SCORE_THRESHOLD) 相同
+LEXICAL_MIN_DENSE_SCORE = float(os.environ.get("LEXICAL_MIN_DENSE_SCORE", "0.4"))
+# 多久檢查一次知識庫版本，版本改變時重建索引 (秒)
+LEXICAL_INDEX_REFRESH_SECONDS = int(os.environ.get("LEXICAL_INDEX_REFRESH_SECONDS", "300"))
+
+# --- 11. 直接擷取 (不呼叫生成模型) 設定 ---
+# 第一名的向量 cosine 分數達到門檻、且領先第二名足夠多時，直接回傳該區塊原文 (與 BM25 融合後也比較 cosine 分數)
+EXTRACTIVE_FAST_PATH_ENABLED = os.environ.get("EXTRACTIVE_FAST_PATH_ENABLED", "true").lower() == "true"
+EXTRACTIVE_MIN_SCORE = float(os.environ.get("EXTRACTIVE_MIN_SCORE", "0.8"))
+EXTRACTIVE_MIN_MARGIN = float(os.environ.get("EXTRACTIVE_MIN_MARGIN", "0.1"))
+
+# --- 12. 批次問答 (/api/ask/batch、batch_ask.py) 設定 ---
+BATCH_MAX_QUESTIONS = int(os.environ.get("BATCH_MAX_QUESTIONS", "1000"))
+# 同時進行的生成請求數 (預設值與上限)
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "16"))
+# Gemini batchEmbedContents 一次最多 100 筆；search_batch 每次送出的查詢數
+BATCH_EMBED_SIZE = 100
+BATCH_SEARCH_SIZE = int(os.environ.get("BATCH_SEARCH_SIZE", "64"))
+
+# --- 13. 指標與抽樣除錯輸出設定 (/metrics) ---
+# 每個請求被抽樣的機率；被抽中的請求才會印出詳細的處理過程與各階段耗時
+DEBUG_LOG_SAMPLE_RATE = float(os.environ.get("DEBUG_LOG_SAMPLE_RATE", "0.01"))
+# 超過此秒數的請求一律印出各階段耗時 (0 表示停用)
+SLOW_REQUEST_SECONDS = float(os.environ.get("SLOW_REQUEST_SECONDS", "5"))
 
+# --- 14. 相同問題的請求合併 (single-flight) 設定 ---
+SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+# 等待進行中的相同問題的最長秒數，超過時自行處理
+SINGLE_FLIGHT_TIMEOUT = float(os.environ.get("SINGLE_FLIGHT_TIMEOUT", "60"))
+# 跨 gunicorn worker 合併：以 MongoDB 集合作為租約 (需要 MongoDB)。每個未命中快取的問題多幾次 MongoDB 往返，
+# 只在多個 worker 且同一問題常同時湧入時才值得開啟
+SINGLE_FLIGHT_SHARED = os.environ.get("SINGLE_FLIGHT_SHARED", "false").lower() == "true"
+SINGLE_FLIGHT_COLLECTION = os.environ.get("SINGLE_FLIGHT_COLLECTION", "InFlightQuestions")
+SINGLE_FLIGHT_POLL_INTERVAL = float(os.environ.get("SINGLE_FLIGHT_POLL_INTERVAL", "0.2"))
+# 租約操作失敗後暫停跨 worker 合併的秒數 (期間只在 worker 內合併)
+SINGLE_FLIGHT_FAILURE_COOLDOWN = float(os.environ.get("SINGLE_FLIGHT_FAILURE_COOLDOWN", "30"))
 
-# --- 初始化 Google Gemini Client ---
+# --- 15. JSON 回應壓縮 (brotli / gzip) 設定 ---
+# 前面的反向代理已經會壓縮時設為 false
+RESPONSE_COMPRESSION_ENABLED = os.environ.get("RESPONSE_COMPRESSION_ENABLED", "true").lower() == "true"
+# 小於此大小 (bytes) 的回應不壓縮
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.environ.get("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+# brotli 品質 (0~11) 與 gzip 等級 (1~9)：越高壓縮率越好但越耗 CPU，預設值偏向速度
+RESPONSE_COMPRESSION_BROTLI_QUALITY = int(os.environ.get("RESPONSE_COMPRESSION_BROTLI_QUALITY", "4"))
+RESPONSE_COMPRESSION_GZIP_LEVEL = int(os.environ.get("RESPONSE_COMPRESSION_GZIP_LEVEL", "6"))
+
+# --- 16. 模型路由與輸出上限設定 ---
+# 便宜的情況 (非 IT 問題的判斷、短的知識庫擷取) 使用的快速模型；留空則一律使用 GEMINI_GENERATIVE_MODEL
+GEMINI_FAST_MODEL_NAME = os.environ.get("GEMINI_FAST_MODEL", "gemini-2.5-flash-lite").strip() or None
+# 知識庫沒有結果時，先由快速模型判斷是否 IT 相關 (不相關時不再呼叫主要模型)。
+# 分類與主要模型是串行的兩次呼叫，IT 問題 (多數) 反而多一次往返，只在非 IT 問題很多時才值得開啟
+MODEL_ROUTER_CLASSIFY_GENERAL = os.environ.get("MODEL_ROUTER_CLASSIFY_GENERAL", "false").lower() == "true"
+# 上下文不超過此 token 數的知識庫擷取交給快速模型
+MODEL_ROUTER_EXTRACT_MAX_CONTEXT_TOKENS = int(os.environ.get("MODEL_ROUTER_EXTRACT_MAX_CONTEXT_TOKENS", "800"))
+# 每次請求的輸出 token 上限 (0 表示不限制)；gemini-2.5 系列的思考 token 也計入上限，主要模型設太小會截斷答案
+GEMINI_FAST_MAX_OUTPUT_TOKENS = int(os.environ.get("GEMINI_FAST_MAX_OUTPUT_TOKENS", "1024"))
+GEMINI_MAX_OUTPUT_TOKENS = int(os.environ.get("GEMINI_MAX_OUTPUT_TOKENS", "0"))
+
+
+# --- 初始化指標 ---
+metrics = Metrics(debug_sample_rate=DEBUG_LOG_SAMPLE_RATE, slow_seconds=SLOW_REQUEST_SECONDS or None)
+metrics.describe('stage_seconds', "各處理階段的耗時 (秒)")
+metrics.describe('request_seconds', "HTTP 請求的總耗時 (秒)")
+metrics.describe('requests_total', "HTTP 請求數")
+metrics.describe('gemini_tokens_total', "Gemini 生成使用的 token 數")
+
+# --- 初始化外部服務用戶端 ---
+# import 時只建立不需要網路往返的物件；連線驗證與需要讀取資料的預熱都在背景執行緒中並行進行，
+# 因此每個 worker 的啟動時間不受後端延遲或逾時影響。各後端的狀態可由 /api/ready 查詢。
+backends = BackendReadiness(max_retry_interval=BACKEND_INIT_MAX_RETRY_INTERVAL)
+
+# Google Gemini：configure 與建立模型物件都不會連線；背景以免費的 get_model 驗證 API 金鑰與模型名稱
 gemini_model = None
+gemini_fast_model = None
 is_gemini_configured = bool(GOOGLE_API_KEY)
 if not is_gemini_configured:
     print("警告: Google AI API 金鑰 (GOOGLE_API_KEY) 未在 .env 檔案中設定。AI 功能將無法使用。")
 else:
     try:
-        print("正在設定 Google Gemini API...")
         genai.configure(api_key=GOOGLE_API_KEY)
         gemini_model = genai.GenerativeModel(GEMINI_GENERATIVE_MODEL_NAME)
-        gemini_model.generate_content("test", generation_config={"max_output_tokens": 5})
-        print(f"✅ Google Gemini 用戶端初始化成功 (生成模型: {GEMINI_GENERATIVE_MODEL_NAME})。")
+        if GEMINI_FAST_MODEL_NAME:
+            gemini_fast_model = genai.GenerativeModel(GEMINI_FAST_MODEL_NAME)
     except Exception as e:
         print(f"❌ 初始化 Google Gemini 時發生嚴重錯誤: {e}")
         gemini_model = None
         is_gemini_configured = False
 
+# 模型路由：快速模型未設定 (或無法使用) 時一律使用主要模型
+model_router = ModelRouter(
+    fast_model_name=GEMINI_FAST_MODEL_NAME if gemini_fast_model is not None else None,
+    classify_general=MODEL_ROUTER_CLASSIFY_GENERAL,
+    extract_max_context_tokens=MODEL_ROUTER_EXTRACT_MAX_CONTEXT_TOKENS,
+    fast_max_output_tokens=GEMINI_FAST_MAX_OUTPUT_TOKENS or None,
+    main_max_output_tokens=GEMINI_MAX_OUTPUT_TOKENS or None,
+)
 
-# --- 初始化 Azure Cosmos DB for MongoDB Client ---
-mongo_collection = None
-is_mongodb_configured = bool(MONGO_CONNECTION_STRING)
-if not is_mongodb_configured:
-    print("警告: MongoDB 連接字串 (MONGO_CONNECTION_STRING) 未在 .env 檔案中設定。問答記錄將不會儲存。")
-else:
-    try:
-        print("正在連接到 Azure Cosmos DB for MongoDB...")
-        mongo_client = MongoClient(MONGO_CONNECTION_STRING)
-        mongo_client.admin.command('ismaster')
-        db = mongo_client[MONGO_DATABASE_NAME]
-        mongo_collection = db[MONGO_COLLECTION_NAME]
-        print("✅ Azure Cosmos DB for MongoDB 用戶端初始化成功。")
-    except Exception as e:
-        print(f"❌ 初始化 Azure Cosmos DB for MongoDB 用戶端時發生錯誤: {e}")
-        mongo_collection = None
-        is_mongodb_configured = False
+def _check_gemini():
+    genai.get_model(GEMINI_GENERATIVE_MODEL_NAME)
+    if model_router.fast_model_name:
+        try:
+            genai.get_model(GEMINI_FAST_MODEL_NAME)
+        except Exception as e:
+            # 主要模型可用但快速模型不行 (通常是名稱錯誤)：停用路由，不影響 AI 功能
+            print(f"🟡 快速模型 '{GEMINI_FAST_MODEL_NAME}' 無法使用，全部改用主要模型: {e}")
+            model_router.fast_model_name = None
 
+backends.register('gemini', _check_gemini, enabled=is_gemini_configured)
 
-# --- 初始化 Qdrant Client (強制使用 REST 模式並支援 API Key) ---
+def qdrant_client_kwargs():
+    """同步與 asyncio 用戶端共用的連線設定。"""
+    return dict(
+        url=QDRANT_URL,
+        api_key=QDRANT_API_KEY,
+        prefer_grpc=QDRANT_PREFER_GRPC,
+        grpc_port=QDRANT_GRPC_PORT,
+        timeout=QDRANT_TIMEOUT
+    )
+
+# Qdrant (預設 REST 模式，QDRANT_PREFER_GRPC 時改用 gRPC，並支援 API Key)：建立用戶端不會連線，背景確認 collection 存在
 qdrant_client = None
 is_qdrant_configured = bool(QDRANT_URL)
 if not is_qdrant_configured:
     print("警告: Qdrant URL (QDRANT_URL) 未在 .env 檔案中設定。內部知識庫功能將無法使用。")
 else:
     try:
-        print(f"正在以 REST (HTTP) 模式連接到 Qdrant 於 {QDRANT_URL}...")
-        if QDRANT_API_KEY:
-            print("   - 使用 API Key 進行連線 (適用於雲端服務)。")
-        else:
-            print("   - 未使用 API Key (適用於本地端服務)。")
-            
-        qdrant_client = QdrantClient(
-            url=QDRANT_URL, 
-            api_key=QDRANT_API_KEY,
-            prefer_grpc=False,
-            timeout=20
-        )
-        qdrant_client.get_collections()
-        print("✅ Qdrant 用戶端初始化成功。")
+        qdrant_client = QdrantClient(**qdrant_client_kwargs())
     except Exception as e:
         print(f"❌ 初始化 Qdrant 用戶端時發生嚴重錯誤: {e}")
         qdrant_client = None
         is_qdrant_configured = False
 
+def _check_qdrant():
+    qdrant_client.get_collection(QDRANT_COLLECTION_NAME)
+
+backends.register('qdrant', _check_qdrant, enabled=is_qdrant_configured)
+
+# MongoDB (Atlas 與 Azure Cosmos DB 共用同一段初始化)：mongodb+srv:// 在建立用戶端時就會查詢 DNS，
+# 因此整個建立與 ping 都放在背景執行緒；完成前 mongo_collection 為 None。
+mongo_client = None
+mongo_collection = None
+is_mongodb_configured = bool(MONGO_CONNECTION_STRING)
+if not is_mongodb_configured:
+    print("警告: MongoDB 連接字串 (MONGO_CONNECTION_STRING) 未在 .env 檔案中設定。問答記錄將不會儲存。")
+
+def mongo_client_kwargs():
+    """使用 TLS 的連線 (Atlas 的 mongodb+srv:// 或 tls=true / ssl=true) 改用 certifi 的 CA 憑證。"""
+    uri = (MONGO_CONNECTION_STRING or "").lower()
+    if uri.startswith("mongodb+srv://") or "tls=true" in uri or "ssl=true" in uri:
+        return {'tlsCAFile': certifi.where()}
+    return {}
+
+mongo_request_client = None
+
+def get_mongo_request_client():
+    """請求路徑使用的 MongoDB 用戶端 (連線、伺服器選擇與讀寫都以 MONGO_REQUEST_TIMEOUT_MS 為上限)。"""
+    global mongo_request_client
+    if mongo_request_client is None:
+        mongo_request_client = MongoClient(
+            MONGO_CONNECTION_STRING,
+            serverSelectionTimeoutMS=MONGO_REQUEST_TIMEOUT_MS,
+            connectTimeoutMS=MONGO_REQUEST_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_REQUEST_TIMEOUT_MS,
+            **mongo_client_kwargs()
+        )
+    return mongo_request_client
+
+def _connect_mongodb():
+    global mongo_client, mongo_collection
+    client = mongo_client or MongoClient(MONGO_CONNECTION_STRING, **mongo_client_kwargs())
+    mongo_client = client
+    client.admin.command('ping')
+    mongo_collection = client[MONGO_DATABASE_NAME][MONGO_COLLECTION_NAME]
+
+backends.register('mongodb', _connect_mongodb, enabled=is_mongodb_configured)
+
+# --- 初始化問答記錄背景寫入器 ---
+# 在 MongoDB 就緒前送出的記錄會先進 spool，連線完成後自動補寫
+qa_writer = None
+if QA_WRITER_ENABLED and is_mongodb_configured:
+    qa_writer = BackgroundQAWriter(
+        None,
+        max_queue=QA_WRITER_QUEUE_SIZE,
+        batch_size=QA_WRITER_BATCH_SIZE,
+        flush_interval=QA_WRITER_FLUSH_INTERVAL,
+        spool_dir=QA_WRITER_SPOOL_DIR,
+        on_batch_written=lambda seconds, count: metrics.record_stage('mongo_batch_write', seconds),
+    )
+    atexit.register(qa_writer.close)
+    print(f"✅ 問答記錄改由背景寫入 (批次 {QA_WRITER_BATCH_SIZE} 筆 / {QA_WRITER_FLUSH_INTERVAL} 秒)。")
+
+# --- 初始化答案快取 ---
+def get_kb_version():
+    """
+    知識庫版本指紋：ingest_knowledge_base.py 以內容雜湊產生 point ID，
+    因此所有 point ID 的雜湊即代表目前的知識庫內容 (新增、修改、刪除或 alias 切換都會改變)。
+    """
+    digest = hashlib.sha256()
+    ids = []
+    offset = None
+    while True:
+        points, offset = qdrant_client.scroll(
+            collection_name=QDRANT_COLLECTION_NAME,
+            limit=1000,
+            offset=offset,
+            with_payload=False,
+            with_vectors=False,
+        )
+        ids.extend(str(point.id) for point in points)
+        if offset is None:
+            break
+    for point_id in sorted(ids):
+        digest.update(point_id.encode('ascii'))
+    return f"{len(ids)}:{digest.hexdigest()[:16]}"
+
+answer_cache = None
+if ANSWER_CACHE_ENABLED:
+    answer_cache = AnswerCache(
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+        ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+        similarity_threshold=ANSWER_CACHE_SIMILARITY,
+        kb_version_provider=get_kb_version if qdrant_client is not None else None,
+        version_check_interval=ANSWER_CACHE_VERSION_CHECK_SECONDS,
+    )
+    print(f"✅ 答案快取已啟用 (上限 {ANSWER_CACHE_MAX_ENTRIES} 筆，TTL {ANSWER_CACHE_TTL_SECONDS} 秒)。")
+
+# --- 初始化 Embedding 快取 ---
+def _gemini_embed(model, texts, task_type):
+    result = genai.embed_content(model=model, content=texts, task_type=task_type)
+    return result['embedding']
+
+embedding_cache = None
+if EMBEDDING_CACHE_ENABLED:
+    embedding_cache = EmbeddingCache(_gemini_embed, max_entries=EMBEDDING_CACHE_MAX_ENTRIES)
+    persistent_label = 'MongoDB' if EMBEDDING_CACHE_PERSISTENT and is_mongodb_configured else '無'
+    print(f"✅ Embedding 快取已啟用 (上限 {EMBEDDING_CACHE_MAX_ENTRIES} 筆，持久層: {persistent_label})。")
+
+# --- 初始化相同問題的請求合併 ---
+# 同一個 worker 內以 SingleFlight 合併；跨 worker 時 leader 再以 MongoDB 租約協調 (MongoDB 就緒前只在 worker 內合併)
+single_flight = None
+flight_lease = None
+if SINGLE_FLIGHT_ENABLED:
+    single_flight = SingleFlight(timeout=SINGLE_FLIGHT_TIMEOUT)
+    if SINGLE_FLIGHT_SHARED and is_mongodb_configured:
+        flight_lease = MongoFlightLease(
+            lease_seconds=SINGLE_FLIGHT_TIMEOUT,
+            poll_interval=SINGLE_FLIGHT_POLL_INTERVAL,
+            timeout=SINGLE_FLIGHT_TIMEOUT,
+            failure_cooldown=SINGLE_FLIGHT_FAILURE_COOLDOWN,
+        )
+    print(f"✅ 相同問題的請求合併已啟用 (跨 worker: {'MongoDB' if flight_lease is not None else '無'})。")
+
+# --- 後端就緒後的預熱步驟 (在各自的背景初始化執行緒中執行) ---
+def _attach_mongodb():
+    if qa_writer is not None:
+        qa_writer.collection = mongo_collection
+    if answer_cache is not None and ANSWER_CACHE_PERSISTENT:
+        answer_cache.mongo_collection = mongo_collection
+        answer_cache.lookup_collection = get_mongo_request_client()[MONGO_DATABASE_NAME][MONGO_COLLECTION_NAME]
+        answer_cache.ensure_indexes()
+        answer_cache.warm_from_mongodb(ANSWER_CACHE_WARM_LIMIT)
+    if embedding_cache is not None and EMBEDDING_CACHE_PERSISTENT:
+        embedding_cache.persistent_store = MongoEmbeddingStore(mongo_client[MONGO_DATABASE_NAME][EMBEDDING_CACHE_COLLECTION])
+    if flight_lease is not None:
+        flight_lease.collection = get_mongo_request_client()[MONGO_DATABASE_NAME][SINGLE_FLIGHT_COLLECTION]
+        flight_lease.ensure_indexes()
+
+# --- 初始化 BM25 詞彙索引 (由 Qdrant 的 payload 建立，知識庫版本改變時重建) ---
+lexical_index = None
+if LEXICAL_INDEX_ENABLED and is_qdrant_configured:
+    lexical_index = LexicalIndex(
+        weight=LEXICAL_WEIGHT,
+        limit=LEXICAL_SEARCH_LIMIT,
+        min_dense_score=LEXICAL_MIN_DENSE_SCORE,
+    )
+
+def refresh_lexical_index(force=False):
+    """知識庫版本與索引不同 (或 force) 時重建；回傳是否重建。"""
+    if lexical_index is None:
+        return False
+    version = get_kb_version()
+    if not force and version == lexical_index.version:
+        return False
+    count = lexical_index.load_from_qdrant(qdrant_client, QDRANT_COLLECTION_NAME, version)
+    print(f"✅ BM25 詞彙索引已建立 ({count} 個區塊，知識庫版本 {version})。")
+    return True
+
+def _lexical_index_refresh_loop():
+    while True:
+        try:
+            refresh_lexical_index()
+        except Exception as e:
+            print(f"🟡 重建 BM25 詞彙索引失敗，沿用目前的索引: {e}")
+        time.sleep(LEXICAL_INDEX_REFRESH_SECONDS)
+
+def _start_lexical_index():
+    if lexical_index is not None:
+        threading.Thread(target=_lexical_index_refresh_loop, name="lexical-index", daemon=True).start()
+
+# --- 初始化本機向量索引 (VECTOR_SEARCH_BACKEND=local：由 Qdrant 匯出，知識庫版本改變時重新匯出) ---
+local_vector_index = None
+if VECTOR_SEARCH_BACKEND == 'local' and is_qdrant_configured:
+    local_vector_index = LocalVectorIndex(path=LOCAL_VECTOR_INDEX_PATH)
+elif VECTOR_SEARCH_BACKEND not in ('qdrant', 'local'):
+    print(f"警告: 未知的 VECTOR_SEARCH_BACKEND '{VECTOR_SEARCH_BACKEND}'，改用遠端 Qdrant。")
+
+def refresh_local_vector_index(force=False):
+    """知識庫版本與索引不同 (或 force) 時重新載入 (優先使用相同版本的向量檔)；回傳是否重新載入。"""
+    if local_vector_index is None:
+        return False
+    version = get_kb_version()
+    if not force and version == local_vector_index.version:
+        return False
+    count = None if force else local_vector_index.load_file(version)
+    if count is not None:
+        print(f"✅ 本機向量索引已由 {LOCAL_VECTOR_INDEX_PATH} 載入 ({count} 個區塊，知識庫版本 {version})。")
+        return True
+    count = local_vector_index.load_from_qdrant(qdrant_client, QDRANT_COLLECTION_NAME, version)
+    print(f"✅ 本機向量索引已由 Qdrant 匯出 ({count} 個區塊，知識庫版本 {version})。")
+    return True
+
+def _local_vector_index_refresh_loop():
+    while True:
+        try:
+            refresh_local_vector_index()
+        except Exception as e:
+            print(f"🟡 重新載入本機向量索引失敗，沿用目前的索引: {e}")
+        time.sleep(LOCAL_VECTOR_INDEX_REFRESH_SECONDS)
+
+def _start_local_vector_index():
+    if local_vector_index is not None:
+        threading.Thread(target=_local_vector_index_refresh_loop, name="local-vector-index", daemon=True).start()
+
+def _start_kb_version_refresh():
+    # get_kb_version 會 scroll 整個 collection，只在背景執行緒定期呼叫，不在請求路徑上
+    if answer_cache is not None:
+        answer_cache.start_version_refresh()
+
+backends.on_ready('mongodb', _attach_mongodb)
+backends.on_ready('qdrant', _start_kb_version_refresh)
+backends.on_ready('qdrant', _start_lexical_index)
+backends.on_ready('qdrant', _start_local_vector_index)
+backends.start()
+
+@metrics.timed('embed')
+def embed_texts(texts, task_type="RETRIEVAL_QUERY"):
+    """將多段文字轉為 float32 向量；有快取時只對未命中的文字呼叫 Gemini。"""
+    if embedding_cache is None:
+        return [np.asarray(v, dtype=np.float32) for v in _gemini_embed(GEMINI_EMBEDDING_MODEL_NAME, texts, task_type)]
+    return embedding_cache.embed(GEMINI_EMBEDDING_MODEL_NAME, texts, task_type)
+
 # --- 建立 Flask 應用程式 ---
 app = Flask(__name__)
 
-# --- 資料庫連線輔助函式 (已修改註解) ---
-def establish_db_connection_with_retry(connection_string, retries=5, delay=10):
-    last_exception = None
-    for i in range(retries):
-        try:
-            print(f"資料庫連線嘗試: 第 {i + 1} 次...")
-            connection = pyodbc.connect(connection_string, timeout=20)
-            print("✅ 資料庫連線成功！")
-            return connection
-        except pyodbc.Error as ex:
-            last_exception = ex
-            # GCP SQL Server 通常沒有 Azure 的 "Serverless 喚醒" 狀態，
-            # 但保留重試機制可以處理一般的網路暫時性問題。
-            sqlstate = ex.args[0]
-            if sqlstate in ('08001', 'HYT00'): # 連線錯誤或超時
-                print(f"資料庫連線錯誤或超時 ({sqlstate})，將在 {delay} 秒後重試...")
-                time.sleep(delay)
-            else:
-                print(f"發生非預期的資料庫錯誤 ({sqlstate})，將不會重試。")
-                raise ex
-    print("❌ 所有重試均失敗，無法連線至資料庫。")
-    raise last_exception
-
-# --- 功能函式 1: 從 GCP SQL Server 抓取記錄 (已修改) ---
-def fetch_log_data_from_gcp_sql():
-    if not all([GCP_SQL_SERVER, GCP_SQL_DATABASE, GCP_SQL_USERNAME, GCP_SQL_PASSWORD]):
+# --- 請求計時：各階段耗時記錄在目前請求的 trace，結束時一併計入 /metrics ---
+@app.before_request
+def begin_request_metrics():
+    g.metrics_handle = metrics.begin_request(request.url_rule.rule if request.url_rule else 'unmatched')
+
+@app.after_request
+def end_request_metrics(response):
+    handle = g.pop('metrics_handle', None)
+    if handle is not None:
+        status = response.status_code
+        # 串流回應 (SSE、NDJSON) 在內容全部送出、連線關閉時才結束計時
+        response.call_on_close(lambda: metrics.end_request(handle, status))
+    return response
+
+# after_request 依註冊的相反順序執行：壓縮在 end_request_metrics 之前，耗時計入同一個請求
+@app.after_request
+def compress_json_response(response):
+    if not RESPONSE_COMPRESSION_ENABLED:
+        return response
+    with metrics.timer('compress'):
+        return compress_response(
+            response, request.accept_encodings,
+            min_bytes=RESPONSE_COMPRESSION_MIN_BYTES,
+            brotli_quality=RESPONSE_COMPRESSION_BROTLI_QUALITY,
+            gzip_level=RESPONSE_COMPRESSION_GZIP_LEVEL,
+        )
+
+# --- 資料庫連線輔助函式 (改用連線池) ---
+def is_gcp_sql_configured():
+    return all([GCP_SQL_SERVER, GCP_SQL_DATABASE, GCP_SQL_USERNAME, GCP_SQL_PASSWORD])
+
+def build_gcp_sql_connection_string():
+    return f'DRIVER={ODBC_DRIVER};SERVER={GCP_SQL_SERVER};DATABASE={GCP_SQL_DATABASE};UID={GCP_SQL_USERNAME};PWD={GCP_SQL_PASSWORD};Encrypt=yes;TrustServerCertificate=yes;'
+
+sql_pool = None
+_sql_pool_lock = threading.Lock()
+
+def get_sql_pool():
+    """取得 (必要時建立) 全域共用的 SQL Server 連線池。"""
+    global sql_pool
+    if sql_pool is None:
+        with _sql_pool_lock:
+            if sql_pool is None:
+                connection_string = build_gcp_sql_connection_string()
+                sql_pool = SQLConnectionPool(
+                    lambda: pyodbc.connect(connection_string, timeout=20),
+                    max_size=SQL_POOL_MAX_SIZE,
+                    timeout=SQL_POOL_TIMEOUT,
+                    max_lifetime=SQL_POOL_MAX_LIFETIME,
+                    health_check_idle=SQL_POOL_HEALTH_CHECK_IDLE,
+                    retries=SQL_CONNECT_RETRIES,
+                    base_delay=SQL_CONNECT_BACKOFF_BASE,
+                    max_delay=SQL_CONNECT_BACKOFF_MAX,
+                    on_acquire=lambda seconds: metrics.record_stage('sql_connect', seconds),
+                )
+                print(f"✅ SQL Server 連線池已建立 (上限 {SQL_POOL_MAX_SIZE} 條連線)。")
+    return sql_pool
+
+def build_log_filter_conditions(status=None, date_from=None, date_to=None, ticket=None):
+    """篩選條件的 SQL 片段與參數 (分頁查詢與增量查詢共用)。"""
+    conditions = []
+    params = []
+    if status == '未開始':
+        # format_status 會把 NULL 或其他未知狀態都顯示為「未開始」，篩選時保持一致
+        conditions.append("(status IS NULL OR status NOT IN (?, ?))")
+        params.extend(['進行中', '已完成'])
+    elif status:
+        conditions.append("status = ?")
+        params.append(status)
+    if date_from:
+        conditions.append("log_date >= ?")
+        params.append(datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        conditions.append("log_date < ?")
+        params.append(datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    if ticket:
+        escaped = ticket.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_').replace('[', '\\[')
+        conditions.append("ticket_number LIKE ? ESCAPE '\\'")
+        params.append(f"%{escaped}%")
+    return conditions, params
+
+def build_log_query(page_size, cursor=None, status=None, date_from=None, date_to=None, ticket=None, fields=None):
+    """
+    組出帶有篩選條件與 keyset 分頁的 SQL 與參數。
+    多抓一筆 (page_size + 1) 用來判斷是否還有下一頁；只查詢 fields 需要的欄位 (log_data 的內容通常最大)。
+    """
+    conditions, params = build_log_filter_conditions(status, date_from, date_to, ticket)
+    if cursor:
+        condition, cursor_params = keyset_condition(cursor, LOGS_DATE_SQL_TYPE)
+        conditions.append(condition)
+        params.extend(cursor_params)
+
+    where_clause = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+    query = (
+        f"SELECT TOP (?) {', '.join(source_columns(fields))} FROM log_data "
+        f"{where_clause}ORDER BY log_date DESC, log_id DESC;"
+    )
+    return query, [page_size + 1] + params
+
+# --- 增量同步：水位 (watermark) 與異動查詢 ---
+def encode_log_watermark(watermark):
+    payload = json.dumps(watermark, sort_keys=True)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def decode_log_watermark(token):
+    try:
+        watermark = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+        if not isinstance(watermark, dict):
+            raise ValueError(token)
+        return watermark
+    except Exception as e:
+        raise ValueError(f"無效的同步水位: {token}") from e
+
+def _rowversion_column():
+    if not re.fullmatch(r"\w+", LOGS_ROWVERSION_COLUMN):
+        raise ValueError(f"無效的 LOGS_ROWVERSION_COLUMN: {LOGS_ROWVERSION_COLUMN}")
+    return LOGS_ROWVERSION_COLUMN
+
+def fetch_log_watermark():
+    """
+    讀取 log_data 目前的水位 {'v': 最大 rowversion}，回傳 (watermark dict, error_message)。
+    rowversion 欄位有索引，MAX() 只讀取索引的最後一筆，成本與資料表大小無關。
+    """
+    if not is_gcp_sql_configured():
+        return None, "❌ **設定錯誤**\n\n資料庫連線資訊未在 `.env` 檔案中完整設定。"
+    try:
+        with get_sql_pool().connection() as conn, metrics.timer('sql_query'):
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT CONVERT(BIGINT, MAX({_rowversion_column()})) FROM log_data;")
+            row = cursor.fetchone()
+            cursor.close()
+        return {'v': row[0]}, None
+    except Exception as e:
+        return None, f"❌ **資料庫或資料處理錯誤**\n\n詳細資訊: `{e}`"
+
+def build_log_changes_query(since, status=None, date_from=None, date_to=None, ticket=None, fields=None):
+    """
+    查出 since 之後新增或修改的列 (rowversion 大於水位)，並以 matches_filter 標示是否符合目前的篩選條件，
+    讓前端能把不再符合條件的列移除。多抓一筆用來判斷是否超過 LOGS_DELTA_MAX_ROWS。
+    """
+    conditions, filter_params = build_log_filter_conditions(status, date_from, date_to, ticket)
+    matches = f"CASE WHEN {' AND '.join(conditions)} THEN 1 ELSE 0 END" if conditions else "1"
+    change_condition = f"{_rowversion_column()} > CONVERT(BINARY(8), CAST(? AS BIGINT))"
+    change_param = since.get('v') or 0
+    query = (
+        f"SELECT TOP (?) {', '.join(source_columns(fields))}, {matches} AS matches_filter "
+        f"FROM log_data WHERE {change_condition} ORDER BY log_date DESC, log_id DESC;"
+    )
+    return query, [LOGS_DELTA_MAX_ROWS + 1] + filter_params + [change_param]
+
+def fetch_log_changes_from_gcp_sql(since, status=None, date_from=None, date_to=None, ticket=None, fields=None):
+    """回傳 (df, 是否需要前端重新載入, error_message)。"""
+    query, params = build_log_changes_query(since, status, date_from, date_to, ticket, fields)
+    try:
+        with get_sql_pool().connection() as conn, metrics.timer('sql_query'):
+            df = pd.read_sql(query, conn, params=params)
+        if len(df) > LOGS_DELTA_MAX_ROWS:
+            return None, True, None
+        df['matches_filter'] = df['matches_filter'].astype(bool)
+        return df, False, None
+    except Exception as e:
+        return None, False, f"❌ **資料庫或資料處理錯誤**\n\n詳細資訊: `{e}`"
+
+def log_etag(watermark, args):
+    """
+    目前頁面的內容只取決於資料表水位與篩選 / 分頁 / 欄位參數，兩者相同時內容必然相同。
+    since 與 sync 不列入：前端以上一個回應 (完整或增量) 的 ETag 發出下一次增量請求時，資料沒變即得到 304。
+    """
+    params = sorted((key, value) for key, value in args.items(multi=True) if key not in ('since', 'sync'))
+    raw = json.dumps(watermark, sort_keys=True) + "\x00" + urlencode(params)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+# --- 功能函式 1: 從 GCP SQL Server 抓取記錄 (已修改為分頁查詢) ---
+def fetch_log_data_from_gcp_sql(page_size=LOGS_DEFAULT_PAGE_SIZE, cursor=None, status=None,
+                                date_from=None, date_to=None, ticket=None, fields=None):
+    """
+    依篩選條件抓取一頁記錄，回傳 (df, next_cursor, error_message)。
+    篩選與分頁都在 SQL 端完成，回應成本只與 page_size 有關。
+    """
+    if not is_gcp_sql_configured():
         error_message = "❌ **設定錯誤**\n\n資料庫連線資訊未在 `.env` 檔案中完整設定。"
-        return None, error_message
-    connection_string = f'DRIVER={ODBC_DRIVER};SERVER={GCP_SQL_SERVER};DATABASE={GCP_SQL_DATABASE};UID={GCP_SQL_USERNAME};PWD={GCP_SQL_PASSWORD};Encrypt=yes;TrustServerCertificate=yes;'
-    query = "SELECT log_id, log_date, log_data, ticket_number, status FROM log_data ORDER BY log_date DESC;"
-    conn = None
+        return None, None, error_message
+    query, params = build_log_query(page_size, cursor, status, date_from, date_to, ticket, fields)
     try:
-        conn = establish_db_connection_with_retry(connection_string)
-        df = pd.read_sql(query, conn)
-        return df, None
+        with get_sql_pool().connection() as conn, metrics.timer('sql_query'):
+            df = pd.read_sql(query, conn, params=params)
+        next_cursor = None
+        if len(df) > page_size:
+            df = df.iloc[:page_size].copy()
+            last_row = df.iloc[-1]
+            next_cursor = encode_log_cursor(last_row['log_date'], last_row['log_id'])
+        return df, next_cursor, None
     except Exception as e:
         error_message = f"❌ **資料庫或資料處理錯誤**\n\n詳細資訊: `{e}`"
-        return None, error_message
-    finally:
-        if conn:
-            conn.close()
-            print("資料庫連線已關閉。")
+        return None, None, error_message
+
+def fetch_log_entry_from_gcp_sql(log_id):
+    """讀取單筆記錄的所有欄位 (表格只載入預覽，展開某一列時才讀取完整的 log_data)，回傳 (df, error_message)。"""
+    if not is_gcp_sql_configured():
+        return None, "❌ **設定錯誤**\n\n資料庫連線資訊未在 `.env` 檔案中完整設定。"
+    query = f"SELECT {', '.join(source_columns(None))} FROM log_data WHERE log_id = ?;"
+    try:
+        with get_sql_pool().connection() as conn, metrics.timer('sql_query'):
+            df = pd.read_sql(query, conn, params=[log_id])
+        return df, None
+    except Exception as e:
+        return None, f"❌ **資料庫或資料處理錯誤**\n\n詳細資訊: `{e}`"
 
 # --- 更新功能函式: 更新資料庫 (已修改) ---
 def update_log_details_in_gcp_sql(log_id, ticket_number, status):
-    if not all([GCP_SQL_SERVER, GCP_SQL_DATABASE, GCP_SQL_USERNAME, GCP_SQL_PASSWORD]):
+    if not is_gcp_sql_configured():
         return False, "❌ **設定錯誤**\n\n資料庫連線資訊未在 `.env` 檔案中完整設定。"
     if not ticket_number or not ticket_number.strip():
         return False, "處理單號不可為空。"
-    connection_string = f'DRIVER={ODBC_DRIVER};SERVER={GCP_SQL_SERVER};DATABASE={GCP_SQL_DATABASE};UID={GCP_SQL_USERNAME};PWD={GCP_SQL_PASSWORD};Encrypt=yes;TrustServerCertificate=yes;'
     query = "UPDATE log_data SET ticket_number = ?, status = ? WHERE log_id = ?;"
-    conn = None
     try:
-        conn = establish_db_connection_with_retry(connection_string)
-        cursor = conn.cursor()
-        cursor.execute(query, ticket_number, status, log_id)
-        conn.commit()
-        if cursor.rowcount == 0:
+        with get_sql_pool().connection() as conn, metrics.timer('sql_query'):
+            cursor = conn.cursor()
+            cursor.execute(query, ticket_number, status, log_id)
+            conn.commit()
+            rowcount = cursor.rowcount
+            cursor.close()
+        log_summary_cache.invalidate()
+        if rowcount == 0:
             return False, f"找不到 log_id 為 {log_id} 的記錄，或資料無變更。"
-        print(f"✅ 成功更新 log_id {log_id} 的處理單號為 {ticket_number}，狀態為 {status}")
+        metrics.debug(f"✅ 成功更新 log_id {log_id} 的處理單號為 {ticket_number}，狀態為 {status}")
         return True, None
     except Exception as e:
         error_message = f"❌ **資料庫更新錯誤**\n\n詳細錯誤: `{e}`"
         return False, error_message
-    finally:
-        if conn:
-            conn.close()
-            print("資料庫連線已關閉。")
+
+def parse_bulk_log_updates(data):
+    """
+    /api/logs/update/bulk 的 body，兩種格式：
+      {"updates": [{"log_id": 1, "ticket_number": "INC0012345", "status": "進行中"}, ...]}
+      {"log_ids": [1, 2, 3], "ticket_number": "INC0012345", "status": "進行中"}   (同一個單號與狀態套用到多筆)
+    回傳 (updates, error_message)；updates 為 {'log_id', 'ticket_number', 'status'} 的 list。
+    """
+    if not isinstance(data, dict):
+        return None, "請求無效，缺少 updates 或 log_ids。"
+    if 'updates' in data:
+        updates = data['updates']
+        if not isinstance(updates, list) or not all(isinstance(update, dict) for update in updates):
+            return None, "updates 必須是物件陣列。"
+    elif 'log_ids' in data:
+        if not isinstance(data['log_ids'], list):
+            return None, "log_ids 必須是陣列。"
+        updates = [{'log_id': log_id, 'ticket_number': data.get('ticket_number'), 'status': data.get('status')}
+                   for log_id in data['log_ids']]
+    else:
+        return None, "請求無效，缺少 updates 或 log_ids。"
+    if not updates:
+        return None, "沒有任何要更新的記錄。"
+    if len(updates) > LOGS_BULK_UPDATE_MAX_ROWS:
+        return None, f"一次最多更新 {LOGS_BULK_UPDATE_MAX_ROWS} 筆。"
+    return updates, None
+
+def validate_log_update(update, seen_ids):
+    """單筆更新的檢查；有問題時回傳錯誤訊息。"""
+    log_id = update.get('log_id')
+    if not isinstance(log_id, int) or isinstance(log_id, bool):
+        return "log_id 必須是整數。"
+    if log_id in seen_ids:
+        return f"log_id {log_id} 在同一批更新中重複出現。"
+    ticket_number = update.get('ticket_number')
+    if not isinstance(ticket_number, str) or not ticket_number.strip():
+        return "處理單號不可為空。"
+    if update.get('status') not in LOG_STATUSES:
+        return f"status 必須是 {'、'.join(LOG_STATUSES)} 之一。"
+    return None
+
+def bulk_update_log_details_in_gcp_sql(updates):
+    """
+    在同一個交易中套用多筆更新：先以 IN (...) 查出存在的 log_id，再以 fast_executemany 一次送出所有 UPDATE。
+    任何一步失敗時整批 rollback。回傳 (每筆的結果 list, error_message)；結果與 updates 同順序。
+    """
+    if not is_gcp_sql_configured():
+        return None, "❌ **設定錯誤**\n\n資料庫連線資訊未在 `.env` 檔案中完整設定。"
+    results = []
+    valid = []
+    seen_ids = set()
+    for update in updates:
+        error = validate_log_update(update, seen_ids)
+        results.append({'log_id': update.get('log_id'), 'ok': False, 'error': error})
+        if error is None:
+            seen_ids.add(update['log_id'])
+            valid.append((results[-1], update))
+    if not valid:
+        return results, None
+
+    try:
+        with get_sql_pool().connection() as conn, metrics.timer('sql_query'):
+            cursor = conn.cursor()
+            existing = set()
+            log_ids = [update['log_id'] for _, update in valid]
+            for start in range(0, len(log_ids), SQL_MAX_QUERY_PARAMS):
+                ids = log_ids[start:start + SQL_MAX_QUERY_PARAMS]
+                placeholders = ", ".join("?" * len(ids))
+                cursor.execute(f"SELECT log_id FROM log_data WHERE log_id IN ({placeholders});", ids)
+                existing.update(row[0] for row in cursor.fetchall())
+            rows = [(update['ticket_number'].strip(), update['status'], update['log_id'])
+                    for _, update in valid if update['log_id'] in existing]
+            if rows:
+                # 參數以陣列一次送出，N 筆更新只需要一次往返
+                cursor.fast_executemany = True
+                cursor.executemany("UPDATE log_data SET ticket_number = ?, status = ? WHERE log_id = ?;", rows)
+            conn.commit()
+            cursor.close()
+    except Exception as e:
+        return None, f"❌ **資料庫更新錯誤**\n\n詳細錯誤: `{e}`"
+
+    for result, update in valid:
+        if update['log_id'] in existing:
+            result['ok'] = True
+        else:
+            result['error'] = f"找不到 log_id 為 {update['log_id']} 的記錄。"
+    if rows:
+        log_summary_cache.invalidate()
+    metrics.debug(f"✅ 批次更新 {len(rows)}/{len(updates)} 筆 log_data")
+    return results, None
+
+# --- 日誌彙總 (儀表板標頭：依狀態 / 依日 / 依小時的筆數與未完成的積壓) ---
+# 彙總都在 SQL 端以 GROUP BY 計算，每組只回傳一列；搭配的索引見 sql/log_data_indexes.sql。
+# 結果在行程內快取 LOGS_SUMMARY_TTL_SECONDS 秒，本 worker 更新 log_data 時立即清除。
+log_summary_cache = TTLCache(ttl_seconds=LOGS_SUMMARY_TTL_SECONDS)
+# 未完成的記錄依等待時間分組的界線 (小時)
+LOG_BACKLOG_AGE_HOURS = (24, 72, 168)
+
+def summary_status(status):
+    """與 format_status 相同：NULL 或其他未知狀態都算「未開始」。"""
+    return status if status in ('進行中', '已完成') else '未開始'
+
+def build_log_status_summary_query(now):
+    """依狀態的筆數，同時算出未指派單號、最舊一筆與各等待時間以上的筆數 (用來組成未完成的積壓)。"""
+    age_columns = "".join(
+        f", SUM(CASE WHEN log_date < ? THEN 1 ELSE 0 END) AS older_{hours}h" for hours in LOG_BACKLOG_AGE_HOURS
+    )
+    query = (
+        "SELECT status, COUNT(*) AS total, "
+        "SUM(CASE WHEN ticket_number IS NULL OR ticket_number = '' THEN 1 ELSE 0 END) AS unassigned, "
+        f"MIN(log_date) AS oldest{age_columns} FROM log_data GROUP BY status;"
+    )
+    return query, [now - timedelta(hours=hours) for hours in LOG_BACKLOG_AGE_HOURS]
+
+def build_log_bucket_summary_query(unit):
+    """依日 (unit='day') 或依小時 (unit='hour') 與狀態分組的筆數；參數為起始時間。"""
+    bucket = "CAST(log_date AS DATE)" if unit == 'day' else "DATEADD(hour, DATEDIFF(hour, 0, log_date), 0)"
+    return (
+        f"SELECT {bucket} AS bucket, status, COUNT(*) AS total FROM log_data "
+        f"WHERE log_date >= ? GROUP BY {bucket}, status;"
+    )
+
+def empty_status_counts():
+    return {status: 0 for status in LOG_STATUSES}
+
+def summarize_buckets(rows, start, count, step, label_format):
+    """把 (bucket, status, total) 列整理成連續的時間序列，沒有資料的區間補 0。"""
+    counts = {}
+    for bucket, status, total in rows:
+        label = pd.Timestamp(bucket).strftime(label_format)
+        counts.setdefault(label, empty_status_counts())[summary_status(status)] += total
+    series = []
+    for i in range(count):
+        label = (start + step * i).strftime(label_format)
+        by_status = counts.get(label, empty_status_counts())
+        series.append({'bucket': label, 'total': sum(by_status.values()), 'by_status': by_status})
+    return series
+
+def fetch_log_summary_from_gcp_sql(days=LOGS_SUMMARY_DAYS, hours=LOGS_SUMMARY_HOURS):
+    """回傳 (summary dict, error_message)；只查詢彙總結果，不讀取任何資料列的內容。"""
+    if not is_gcp_sql_configured():
+        return None, "❌ **設定錯誤**\n\n資料庫連線資訊未在 `.env` 檔案中完整設定。"
+    now = datetime.now()
+    day_start = datetime.combine(now.date() - timedelta(days=days - 1), datetime.min.time())
+    hour_start = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours - 1)
+    status_query, status_params = build_log_status_summary_query(now)
+    try:
+        with get_sql_pool().connection() as conn, metrics.timer('sql_query'):
+            cursor = conn.cursor()
+            cursor.execute(status_query, status_params)
+            status_rows = cursor.fetchall()
+            cursor.execute(build_log_bucket_summary_query('day'), day_start)
+            day_rows = cursor.fetchall()
+            cursor.execute(build_log_bucket_summary_query('hour'), hour_start)
+            hour_rows = cursor.fetchall()
+            cursor.close()
+    except Exception as e:
+        return None, f"❌ **資料庫或資料處理錯誤**\n\n詳細資訊: `{e}`"
+
+    by_status = empty_status_counts()
+    backlog = {'open': 0, 'unassigned': 0, 'oldest_open': None,
+               'older_than_hours': {str(hours): 0 for hours in LOG_BACKLOG_AGE_HOURS}}
+    for status, total, unassigned, oldest, *older in status_rows:
+        status = summary_status(status)
+        by_status[status] += total
+        if status == '已完成':
+            continue
+        backlog['open'] += total
+        backlog['unassigned'] += unassigned or 0
+        if oldest is not None:
+            oldest = pd.Timestamp(oldest).to_pydatetime()
+            if backlog['oldest_open'] is None or oldest < backlog['oldest_open']:
+                backlog['oldest_open'] = oldest
+        for age_hours, count in zip(LOG_BACKLOG_AGE_HOURS, older):
+            backlog['older_than_hours'][str(age_hours)] += count or 0
+    if backlog['oldest_open'] is not None:
+        backlog['oldest_open'] = backlog['oldest_open'].isoformat(timespec='seconds')
+
+    return {
+        'total': sum(by_status.values()),
+        'by_status': by_status,
+        'backlog': backlog,
+        'by_day': summarize_buckets(day_rows, day_start, days, timedelta(days=1), '%Y-%m-%d'),
+        'by_hour': summarize_buckets(hour_rows, hour_start, hours, timedelta(hours=1), '%Y-%m-%dT%H:00'),
+        'generated_at': now.isoformat(timespec='seconds'),
+    }, None
+
+class LogSummaryError(Exception):
+    """彙總查詢失敗 (錯誤訊息為回應內容)；以例外離開 TTLCache 的 loader，失敗的結果就不會被快取。"""
+
+def get_log_summary(days=LOGS_SUMMARY_DAYS, hours=LOGS_SUMMARY_HOURS):
+    """回傳 (summary, 是否來自快取, error_message)；查詢失敗時不快取。"""
+    def load():
+        summary, error_msg = fetch_log_summary_from_gcp_sql(days, hours)
+        if error_msg:
+            raise LogSummaryError(error_msg)
+        return summary
+    try:
+        summary, cached = log_summary_cache.get_or_load((days, hours), load)
+    except LogSummaryError as e:
+        return None, False, str(e)
+    return summary, cached, None
 
 # --- 儲存問答記錄到 MongoDB ---
-def save_qa_to_mongodb(question, answer, source):
-    if not is_mongodb_configured or mongo_collection is None:
-        print("MongoDB 未設定或初始化失敗，跳過儲存。")
+def build_qa_record(question, answer, source, extra_fields=None):
+    item = {
+        'id': str(uuid.uuid4()),
+        '問題': question,
+        '回答': answer,
+        '來源': source,
+        'timestamp': time.time()
+    }
+    if extra_fields:
+        item.update(extra_fields)
+    return item
+
+@metrics.timed('mongo_save')
+def save_qa_to_mongodb(question, answer, source, extra_fields=None):
+    # 背景寫入器在 MongoDB 就緒前會先把記錄寫入 spool，因此只有直接寫入時才需要等 mongo_collection
+    if not is_mongodb_configured or (qa_writer is None and mongo_collection is None):
+        metrics.debug("MongoDB 未設定或初始化失敗，跳過儲存。")
         return
     try:
-        item = {
-            'id': str(uuid.uuid4()),
-            '問題': question,
-            '回答': answer,
-            '來源': source,
-            'timestamp': time.time()
-        }
+        item = build_qa_record(question, answer, source, extra_fields)
+        if qa_writer is not None:
+            # 只放進佇列，實際寫入由背景執行緒批次處理，不影響回應時間
+            qa_writer.submit(item)
+            return
         result = mongo_collection.insert_one(item)
-        print(f"✅ 成功將問答記錄儲存到 MongoDB (Document _id: {result.inserted_id})")
+        metrics.debug(f"✅ 成功將問答記錄儲存到 MongoDB (Document _id: {result.inserted_id})")
     except Exception as e:
         print(f"❌ 儲存到 MongoDB 時發生錯誤: {e}")
 
 
+# --- 答案快取輔助函式 ---
+KB_ANSWER_PREFIX = "✅ 從內部知識庫找到解答：\n\n"
+
+def format_cached_answer(cached):
+    return f"{KB_ANSWER_PREFIX}{cached.answer}" if cached.is_internal else cached.answer
+
+def serve_cached_answer(question, cached, level):
+    """回傳快取命中的答案，並照常留下問答記錄 (標記為快取命中，不再作為快取來源)。"""
+    metrics.debug(f"✅ 答案快取命中 ({level})，略過 Embedding / 搜尋 / 生成。")
+    save_qa_to_mongodb(question, cached.answer, cached.source, extra_fields={'cache_hit': level})
+    return format_cached_answer(cached)
+
+def remember_answer(question, query_vector, final_answer, source, is_internal):
+    """將新產生的答案放入快取，並回傳 MongoDB 記錄需要附加的快取欄位。"""
+    if answer_cache is None:
+        return None
+    answer_cache.put(question, query_vector, final_answer, source, is_internal)
+    return answer_cache.persistent_fields(question, query_vector) if ANSWER_CACHE_PERSISTENT else None
+
+context_builder = ContextBuilder(
+    max_score_gap=RETRIEVAL_MAX_SCORE_GAP,
+    min_relative_score=RETRIEVAL_MIN_RELATIVE_SCORE,
+    mmr_lambda=RETRIEVAL_MMR_LAMBDA,
+    duplicate_threshold=RETRIEVAL_DUPLICATE_THRESHOLD,
+    max_context_tokens=RETRIEVAL_MAX_CONTEXT_TOKENS,
+    max_chunks=RETRIEVAL_MAX_CHUNKS,
+)
+
 # --- IT 知識庫功能函式 (已修正) ---
-def it_knowledge_base_qa(question):
-    """
-    使用 Qdrant 和 Gemini 進行 RAG (Retrieval-Augmented Generation) 來回答問題。
-    """
+# 【核心修改】稍微降低相似度門檻，給予相關結果一點容錯空間
+SEARCH_SCORE_THRESHOLD = 0.4
+QDRANT_SEARCH_PARAMS = search_params(
+    models,
+    hnsw_ef=QDRANT_HNSW_EF,
+    exact=QDRANT_SEARCH_EXACT,
+    rescore=QDRANT_QUANTIZATION_RESCORE,
+    oversampling=QDRANT_QUANTIZATION_OVERSAMPLING,
+)
+
+def build_general_it_prompt(question):
+    return f"""
+        你的任務是判斷一個問題是否與「IT技術」相關，並根據判斷結果行動。
+        1.  **分析問題**：請先分析使用者的問題。
+        2.  **判斷類型**：這個問題是否屬於 IT 技術領域（例如：電腦軟硬體、網路、系統、程式開發等）？
+        3.  **執行動作**：
+            * **如果「是」IT 相關問題**：請扮演一位非常專業的 IT 技術支援專家，提供詳細、準確且易於理解的解決方案。
+            * **如果「不是」IT 相關問題**：請直接、完整地回覆以下這句話，不要有任何修改或增加：「{NOT_IT_REFUSAL}」
+        
+        使用者的問題是："{question}"
+        請嚴格依照以上規則執行。
+        """
+
+def build_kb_extract_prompt(question, context_from_qdrant):
+    return f"""
+        你是一個精確的「資料檢索與呈現」助理。
+        你的唯一任務是從下方提供的「參考資料」中，找出與「使用者的問題」最相關的完整區塊，並將該區塊「一字不漏」地呈現出來。
+
+        「使用者的問題」是："{question}"
+
+        --- 參考資料 ---
+        {context_from_qdrant}
+        --- 參考資料結束 ---
+
+        請嚴格遵守以下規則：
+        1.  **找出最相關的區塊**：在「參考資料」中定位到與「使用者的問題」最匹配的段落或條目。
+        2.  **完整複製內容**：將你找到的那個完整區塊，從頭到尾，一字不漏地複製出來作為你的答案。不要進行任何摘要、改寫或省略任何細節。
+        3.  **保持原始格式**：盡可能保持原始文字的換行和結構。
+        4.  **找不到就說找不到**：如果「參考資料」中沒有任何內容與「使用者的問題」相關，請只回覆「根據我手邊的工廠手冊資料，找不到相關的處理方式。」。
+        """
+
+def check_qa_ready(question):
+    """檢查 AI 設定與問題內容；可以繼續處理時回傳 None，否則回傳要直接回覆的訊息。"""
     if not is_gemini_configured or not gemini_model or not qdrant_client:
         return "❌ AI 功能或 Qdrant 知識庫未啟用。請檢查程式啟動時的憑證設定與錯誤訊息。"
-
     if not question:
         return "請輸入您的IT問題。"
+    return None
 
-    # 【核心修改】稍微降低相似度門檻，給予相關結果一點容錯空間
-    SEARCH_SCORE_THRESHOLD = 0.4
+def new_answer_plan(query_vector=None):
+    return {'answer': None, 'prompt': None, 'source': None, 'is_internal': False, 'query_vector': query_vector,
+            'retrieval': None, 'direct_answer': None, 'fast_path': None, 'route': None, 'usage': [],
+            'truncated': False}
 
-    try:
-        # --- 步驟 1: 將問題轉換為 Embedding ---
-        print(f"為問題產生 Embedding (使用 Gemini): '{question[:30]}...'")
-        result = genai.embed_content(
-            model=GEMINI_EMBEDDING_MODEL_NAME,
-            content=question,
-            task_type="RETRIEVAL_QUERY"
+# 各種回答方式的次數：cache_exact / cache_semantic / identifier / extractive 為略過生成的快速路徑，
+# coalesced 為共用同時進行中的相同問題的結果，generated 為呼叫 Gemini 生成
+answer_path_counts = {}
+answer_path_lock = threading.Lock()
+
+def count_answer_path(plan):
+    path = plan['fast_path'] or 'generated'
+    with answer_path_lock:
+        answer_path_counts[path] = answer_path_counts.get(path, 0) + 1
+
+def answer_path_stats():
+    with answer_path_lock:
+        counts = dict(answer_path_counts)
+    total = sum(counts.values())
+    skipped = total - counts.get('generated', 0)
+    return {'counts': counts, 'total': total, 'llm_skipped_rate': round(skipped / total, 4) if total else 0.0}
+
+def select_extractive_hit(search_results):
+    """
+    第一名的 cosine 分數 >= EXTRACTIVE_MIN_SCORE 且領先第二名 >= EXTRACTIVE_MIN_MARGIN 時回傳該結果，否則回傳 None
+    (與 BM25 融合後的結果也以 cosine 分數比較)。
+    """
+    if not EXTRACTIVE_FAST_PATH_ENABLED:
+        return None
+    return extractive_candidate(search_results, EXTRACTIVE_MIN_SCORE, EXTRACTIVE_MIN_MARGIN)
+
+def plan_from_identifier_match(question):
+    """
+    問題中的錯誤碼等識別碼只對應到知識庫中一個區塊時，回傳直接使用該區塊的 plan
+    (direct_answer 為區塊原文，不需要 Embedding、搜尋與生成)；否則回傳 None。
+    """
+    if lexical_index is None:
+        return None
+    payload = lexical_index.match_identifier(question)
+    if payload is None:
+        return None
+    metrics.debug(f"✅ 識別碼完全相符，直接回傳知識庫區塊: '{payload.get('title', '')[:30]}'")
+    plan = new_answer_plan()
+    plan['source'] = f"內部 (Qdrant: {QDRANT_COLLECTION_NAME}，識別碼比對)"
+    plan['is_internal'] = True
+    plan['direct_answer'] = payload.get('text', '')
+    plan['fast_path'] = 'identifier'
+    return plan
+
+def prepare_fast_path(question):
+    """不需要 Embedding 就能回答時 (完全相同的快取問題、識別碼命中) 回傳已有答案的 plan，否則回傳 None。"""
+    # --- 步驟 0: 答案快取第一層 (正規化後完全相同的問題) ---
+    if answer_cache is not None:
+        cached = answer_cache.get_exact(question)
+        if cached is not None:
+            plan = new_answer_plan()
+            plan['answer'] = serve_cached_answer(question, cached, 'exact')
+            plan['fast_path'] = 'cache_exact'
+            count_answer_path(plan)
+            return plan
+
+    # --- 步驟 0.5: 錯誤碼等識別碼完全相符時，直接回傳該區塊 ---
+    direct_plan = plan_from_identifier_match(question)
+    if direct_plan is not None:
+        direct_plan['answer'] = complete_answer(question, direct_plan, direct_plan['direct_answer'])
+        return direct_plan
+    return None
+
+def prepare_similar_cached(question, query_vector):
+    """答案快取第二層 (向量相近的問題)：命中時回傳已有答案的 plan，否則回傳 None。"""
+    if answer_cache is None:
+        return None
+    cached, similarity = answer_cache.get_similar(query_vector)
+    if cached is None:
+        return None
+    metrics.debug(f"   - 與快取問題 '{cached.normalized_question[:30]}' 的相似度: {similarity:.4f}")
+    plan = new_answer_plan(query_vector)
+    plan['answer'] = serve_cached_answer(question, cached, 'semantic')
+    plan['fast_path'] = 'cache_semantic'
+    count_answer_path(plan)
+    return plan
+
+def prepare_answer(question):
+    """
+    執行生成前的所有步驟 (快取、Embedding、搜尋、組 prompt)。
+    回傳 dict：answer 不為 None 時代表已可直接回覆 (例如快取命中)，
+    否則呼叫端需用 prompt 呼叫 Gemini，再交給 complete_answer() 收尾。
+    """
+    plan = prepare_fast_path(question)
+    if plan is not None:
+        return plan
+    return prepare_retrieved_answer(question)
+
+def prepare_retrieved_answer(question):
+    """prepare_answer 中需要 Embedding 的部分：快取第二層、向量搜尋與組 prompt。"""
+    # --- 步驟 1: 將問題轉換為 Embedding ---
+    metrics.debug(f"為問題產生 Embedding (使用 Gemini): '{question[:30]}...'")
+    query_vector = embed_texts([question], task_type="RETRIEVAL_QUERY")[0]
+    metrics.debug("✅ Gemini Embedding 產生成功。")
+
+    plan = prepare_similar_cached(question, query_vector)
+    if plan is not None:
+        return plan
+
+    # --- 步驟 2: 在 Qdrant (或本機向量索引) 中進行向量搜尋 ---
+    metrics.debug(f"在 Qdrant collection '{QDRANT_COLLECTION_NAME}' 中搜尋...")
+    with metrics.timer('qdrant_search'):
+        search_results = search_knowledge_base(query_vector)
+    plan = plan_from_search_results(question, query_vector, search_results)
+    if plan['direct_answer'] is not None:
+        plan['answer'] = complete_answer(question, plan, plan['direct_answer'])
+    return plan
+
+def local_index_ready():
+    return local_vector_index is not None and local_vector_index.ready
+
+def search_knowledge_base(query_vector):
+    """本機向量索引已載入時在行程內搜尋，否則呼叫遠端 Qdrant (條件與 build_search_kwargs 相同)。"""
+    if local_index_ready():
+        return local_vector_index.search(query_vector, RETRIEVAL_SEARCH_LIMIT, SEARCH_SCORE_THRESHOLD)
+    return qdrant_client.search(**build_search_kwargs(query_vector))
+
+def search_knowledge_base_batch(query_vectors):
+    """search_knowledge_base 的批次版本：本機索引以一次矩陣乘法計分，遠端則使用 search_batch。"""
+    if local_index_ready():
+        return local_vector_index.search_batch(query_vectors, RETRIEVAL_SEARCH_LIMIT, SEARCH_SCORE_THRESHOLD)
+    return qdrant_client.search_batch(
+        collection_name=QDRANT_COLLECTION_NAME,
+        requests=[build_search_request(query_vector) for query_vector in query_vectors],
+    )
+
+def build_search_kwargs(query_vector):
+    return dict(
+        collection_name=QDRANT_COLLECTION_NAME,
+        query_vector=query_vector.tolist(),
+        limit=RETRIEVAL_SEARCH_LIMIT,
+        with_payload=True,
+        score_threshold=SEARCH_SCORE_THRESHOLD,
+        search_params=QDRANT_SEARCH_PARAMS
+    )
+
+def build_search_request(query_vector):
+    """與 build_search_kwargs 相同條件的 search_batch 查詢。"""
+    kwargs = build_search_kwargs(query_vector)
+    return models.SearchRequest(
+        vector=kwargs['query_vector'],
+        limit=kwargs['limit'],
+        with_payload=kwargs['with_payload'],
+        score_threshold=kwargs['score_threshold'],
+        params=kwargs['search_params'],
+    )
+
+@metrics.timed('prompt_build')
+def plan_from_search_results(question, query_vector, search_results):
+    """依搜尋結果決定來源與 prompt (同步與 asyncio 路徑共用)。"""
+    plan = new_answer_plan(query_vector)
+    metrics.debug(f"✅ Qdrant 搜尋完成，找到 {len(search_results)} 個相關結果。")
+    if lexical_index is not None:
+        # 與 BM25 結果融合：補上向量搜尋漏掉的精確字詞 (錯誤碼、產品名稱) 命中
+        search_results = lexical_index.fuse(question, query_vector, search_results)
+        metrics.debug(f"   - 與 BM25 融合後共 {len(search_results)} 個候選結果。")
+
+    # --- 步驟 3: 根據搜尋結果決定後續動作 ---
+    top_hit = select_extractive_hit(search_results)
+    if not search_results:
+        metrics.debug("在內部知識庫中找不到答案（分數低於門檻），轉向通用 AI。")
+        plan['source'] = "外部 (Gemini)"
+        plan['prompt'] = build_general_it_prompt(question)
+    elif top_hit is not None:
+        # 唯一且高信心的結果：直接回傳原文，不必請 Gemini 一字不漏地複製
+        metrics.debug(f"✅ 最相關的結果 cosine 分數 {dense_score(top_hit):.4f} 明顯領先，直接回傳該區塊 (略過生成)。")
+        plan['source'] = f"內部 (Qdrant: {QDRANT_COLLECTION_NAME}，直接擷取)"
+        plan['is_internal'] = True
+        plan['direct_answer'] = top_hit.payload.get('text', '')
+        plan['fast_path'] = 'extractive'
+    else:
+        metrics.debug("在內部知識庫中找到相關資料，正在生成摘要性回答...")
+        plan['source'] = f"內部 (Qdrant: {QDRANT_COLLECTION_NAME})"
+        plan['is_internal'] = True
+
+        # 截斷分數落差過大的結果、去除重複區塊，並依 token 預算組成上下文
+        packed, report = context_builder.build(search_results)
+        plan['retrieval'] = report
+        metrics.debug(
+            f"   - 上下文保留 {report['retained']}/{report['candidates']} 筆 "
+            f"(分數截斷 {report['dropped_score_gap']}、重複 {report['dropped_duplicate']}、"
+            f"超出預算 {report['dropped_budget']})，約 {report['context_tokens']} tokens。"
         )
-        query_vector = result['embedding']
-        print("✅ Gemini Embedding 產生成功。")
+        # 【核心修改】加入日誌，顯示保留結果的分數，方便未來微調
+        for hit, _ in packed:
+            metrics.debug(f"   - 分數: {hit.score:.4f}, 內容: '{hit.payload.get('text', '')[:50]}...'")
 
-        # --- 步驟 2: 在 Qdrant 中進行向量搜尋 ---
-        print(f"在 Qdrant collection '{QDRANT_COLLECTION_NAME}' 中搜尋...")
-        search_results = qdrant_client.search(
-            collection_name=QDRANT_COLLECTION_NAME,
-            query_vector=query_vector,
-            limit=50,
-            with_payload=True,
-            score_threshold=SEARCH_SCORE_THRESHOLD
+        context_from_qdrant = "\n---\n".join([
+            f"來源文件 {i+1}:\n{text}"
+            for i, (_, text) in enumerate(packed)
+        ])
+        plan['prompt'] = build_kb_extract_prompt(question, context_from_qdrant)
+    return plan
+
+def complete_answer(question, plan, final_answer):
+    """生成完成後：寫入快取與 MongoDB，並加上內部知識庫的前綴 (因輸出上限被截斷的答案不寫入快取)。"""
+    count_answer_path(plan)
+    cache_fields = None
+    if not plan['truncated']:
+        cache_fields = remember_answer(
+            question, plan['query_vector'], final_answer, plan['source'], plan['is_internal']
         )
-        print(f"✅ Qdrant 搜尋完成，找到 {len(search_results)} 個相關結果。")
-        
-        # 【核心修改】加入日誌，顯示找到的結果分數，方便未來微調
-        if search_results:
-            print("--- 找到的結果分數 (高於門檻) ---")
-            for hit in search_results:
-                print(f"   - 分數: {hit.score:.4f}, 內容: '{hit.payload.get('text', '')[:50]}...'")
-            print("---------------------------------")
-
-
-        # --- 步驟 3: 根據搜尋結果決定後續動作 ---
-        if not search_results:
-            print("在內部知識庫中找不到答案（分數低於門檻），轉向通用 AI。")
-            source = "外部 (Gemini)"
-            prompt = f"""
-            你的任務是判斷一個問題是否與「IT技術」相關，並根據判斷結果行動。
-            1.  **分析問題**：請先分析使用者的問題。
-            2.  **判斷類型**：這個問題是否屬於 IT 技術領域（例如：電腦軟硬體、網路、系統、程式開發等）？
-            3.  **執行動作**：
-                * **如果「是」IT 相關問題**：請扮演一位非常專業的 IT 技術支援專家，提供詳細、準確且易於理解的解決方案。
-                * **如果「不是」IT 相關問題**：請直接、完整地回覆以下這句話，不要有任何修改或增加：「抱歉，我只回答 IT 技術相關的問題。」
-            
-            使用者的問題是："{question}"
-            請嚴格依照以上規則執行。
-            """
-            response = gemini_model.generate_content(prompt)
-            final_answer = response.text
-            save_qa_to_mongodb(question, final_answer, source)
-            return final_answer
-        else:
-            print("在內部知識庫中找到相關資料，正在生成摘要性回答...")
-            source = f"內部 (Qdrant: {QDRANT_COLLECTION_NAME})"
-            
-            context_from_qdrant = "\n---\n".join([
-                f"來源文件 {i+1}:\n{hit.payload.get('text', '錯誤：找不到文字內容')}"
-                for i, hit in enumerate(search_results)
-            ])
-
-            print(f"\n--- 傳送給 Gemini 的上下文 ---\n{context_from_qdrant}\n--------------------------\n")
-
-            prompt = f"""
-            你是一個精確的「資料檢索與呈現」助理。
-            你的唯一任務是從下方提供的「參考資料」中，找出與「使用者的問題」最相關的完整區塊，並將該區塊「一字不漏」地呈現出來。
-
-            「使用者的問題」是："{question}"
-
-            --- 參考資料 ---
-            {context_from_qdrant}
-            --- 參考資料結束 ---
-
-            請嚴格遵守以下規則：
-            1.  **找出最相關的區塊**：在「參考資料」中定位到與「使用者的問題」最匹配的段落或條目。
-            2.  **完整複製內容**：將你找到的那個完整區塊，從頭到尾，一字不漏地複製出來作為你的答案。不要進行任何摘要、改寫或省略任何細節。
-            3.  **保持原始格式**：盡可能保持原始文字的換行和結構。
-            4.  **找不到就說找不到**：如果「參考資料」中沒有任何內容與「使用者的問題」相關，請只回覆「根據我手邊的工廠手冊資料，找不到相關的處理方式。」。
-            """
-            response = gemini_model.generate_content(prompt)
-            final_answer = response.text
-            save_qa_to_mongodb(question, final_answer, source)
-            return f"✅ 從內部知識庫找到解答：\n\n{final_answer}"
+    save_qa_to_mongodb(question, final_answer, plan['source'], extra_fields=answer_record_fields(plan, cache_fields))
+    return frame_answer(plan, final_answer)
+
+def answer_record_fields(plan, cache_fields):
+    """
+    MongoDB 問答記錄的額外欄位：快取欄位、檢索後處理的保留 / 捨棄數量、是否走了略過生成的快速路徑，
+    以及生成使用的模型路由與各次 Gemini 呼叫的 token 用量。
+    """
+    fields = dict(cache_fields or {})
+    fields['fast_path'] = plan['fast_path']
+    if plan['retrieval'] is not None:
+        fields['retrieval'] = plan['retrieval']
+    if plan['route'] is not None:
+        fields['model_route'] = plan['route']
+    if plan['usage']:
+        fields['usage'] = summarize_usage(plan['usage'])
+    if plan['truncated']:
+        fields['truncated'] = True
+    return fields or None
+
+def frame_answer(plan, final_answer):
+    return f"{KB_ANSWER_PREFIX}{final_answer}" if plan['is_internal'] else final_answer
+
+def record_token_usage(response, plan=None, model_name=GEMINI_GENERATIVE_MODEL_NAME, route='main'):
+    """token 用量計入 /metrics，並附加到 plan['usage'] (隨問答記錄寫入 MongoDB)。"""
+    usage = usage_from_response(response, model_name, route)
+    if usage is None:
+        return
+    metrics.inc('gemini_tokens_total', usage['prompt_tokens'], kind='prompt', model=model_name)
+    metrics.inc('gemini_tokens_total', usage['output_tokens'], kind='output', model=model_name)
+    if plan is not None:
+        plan['usage'].append(usage)
+
+def generation_config(plan, route):
+    max_output_tokens = model_router.max_output_tokens(route, plan)
+    return {'max_output_tokens': max_output_tokens} if max_output_tokens else None
+
+def route_target(route):
+    """路由對應的 (模型, 模型名稱)。"""
+    if route in ('classify', 'extract_fast'):
+        return gemini_fast_model, GEMINI_FAST_MODEL_NAME
+    return gemini_model, GEMINI_GENERATIVE_MODEL_NAME
+
+def finish_route(plan, route, text, fallback=False):
+    plan['route'] = route
+    model_router.count(route, fallback)
+    return text
+
+def call_model(plan, route, prompt):
+    model, model_name = route_target(route)
+    with metrics.timer('generate'):
+        response = model.generate_content(prompt, generation_config=generation_config(plan, route))
+    record_token_usage(response, plan, model_name, route)
+    if route != 'classify':
+        plan['truncated'] = is_truncated(response)
+    return response
+
+def classify_question(question, plan):
+    """快速模型判斷是否 IT 相關：回傳 True / False，失敗或無法判斷時回傳 None。"""
+    try:
+        return parse_classification(call_model(plan, 'classify', build_classification_prompt(question)).text)
+    except Exception as e:
+        print(f"🟡 快速模型分類失敗，改用主要模型: {e}")
+        return None
+
+def select_route(question, plan):
+    """生成前的路由：回傳 'extract_fast'、'refusal_fast' (判斷為非 IT 問題，不需要再生成) 或 'main'。"""
+    route = model_router.route(plan)
+    if route == 'classify':
+        return 'refusal_fast' if classify_question(question, plan) is False else 'main'
+    return route
+
+def generate_answer(question, plan):
+    """依模型路由呼叫 Gemini 生成完整答案 (非串流)，記錄耗時與 token 用量；快速模型失敗或被截斷時改用主要模型。"""
+    route = select_route(question, plan)
+    if route == 'refusal_fast':
+        return finish_route(plan, route, NOT_IT_REFUSAL)
+    if route == 'extract_fast':
+        try:
+            response = call_model(plan, route, plan['prompt'])
+            if not is_truncated(response):
+                return finish_route(plan, route, response.text)
+            print("🟡 快速模型的輸出達到上限，改用主要模型。")
+        except Exception as e:
+            print(f"🟡 快速模型生成失敗，改用主要模型: {e}")
+        return finish_route(plan, 'main', call_model(plan, 'main', plan['prompt']).text, fallback=True)
+    return finish_route(plan, 'main', call_model(plan, 'main', plan['prompt']).text)
+
+def stream_route(plan, route, parts):
+    """串流呼叫路由對應的模型，產生 delta 事件 (文字同時附加到 parts)；結束後記錄耗時、token 用量與是否被截斷。"""
+    model, model_name = route_target(route)
+    started = time.perf_counter()
+    response = model.generate_content(plan['prompt'], stream=True, generation_config=generation_config(plan, route))
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            # 沒有文字內容的片段 (例如只帶有 finish_reason)，略過
+            continue
+        if text:
+            if not parts:
+                metrics.record_stage('generate_first_token', time.perf_counter() - started)
+            parts.append(text)
+            yield 'delta', {'text': text}
+    metrics.record_stage('generate', time.perf_counter() - started)
+    record_token_usage(response, plan, model_name, route)
+    plan['truncated'] = is_truncated(response)
+
+def stream_generation(plan, route, parts):
+    """
+    generate_answer 的串流版本。extract_fast 在送出任何文字前失敗 (或沒有文字就被截斷) 時改用主要模型；
+    已送出的文字無法收回，之後才被截斷的答案只標記 plan['truncated'] (照常回覆，但不寫入答案快取)。
+    """
+    fallback = False
+    try:
+        yield from stream_route(plan, route, parts)
+        retry = route == 'extract_fast' and plan['truncated'] and not parts
+    except Exception as e:
+        if route != 'extract_fast' or parts:
+            raise
+        print(f"🟡 快速模型生成失敗，改用主要模型: {e}")
+        retry = True
+    if retry:
+        route, fallback = 'main', True
+        yield from stream_route(plan, route, parts)
+    finish_route(plan, route, None, fallback)
+
+def generate_full_answer(question):
+    """快取第一層與識別碼都未命中時的完整流程 (Embedding → 搜尋 → 生成)；回傳 {'answer', 'source'}。"""
+    plan = prepare_retrieved_answer(question)
+    if plan['answer'] is None:
+        plan['answer'] = complete_answer(question, plan, generate_answer(question, plan))
+    return {'answer': plan['answer'], 'source': plan['source']}
+
+def answer_question(question):
+    """
+    回傳 ({'answer', 'source'}, 是否共用其他 worker 的結果)。
+    快取第一層與識別碼命中時直接回答；否則跨 worker 的租約只讓一個 worker 執行完整流程。
+    """
+    plan = prepare_fast_path(question)
+    if plan is not None:
+        return {'answer': plan['answer'], 'source': plan['source']}, False
+    if flight_lease is None:
+        return generate_full_answer(question), False
+    return flight_lease.run(normalize_question(question), lambda: generate_full_answer(question))
+
+def serve_shared_answer(question, result):
+    """共用其他請求的結果：照常留下問答記錄 (標記為合併，不作為快取來源)。"""
+    metrics.debug("✅ 相同的問題正在處理中，已共用其結果。")
+    plan = new_answer_plan()
+    plan['fast_path'] = 'coalesced'
+    count_answer_path(plan)
+    save_qa_to_mongodb(question, result['answer'], result['source'] or '', extra_fields={'coalesced': True})
+
+def it_knowledge_base_qa(question):
+    """
+    使用 Qdrant 和 Gemini 進行 RAG (Retrieval-Augmented Generation) 來回答問題。
+    """
+    not_ready_message = check_qa_ready(question)
+    if not_ready_message:
+        return not_ready_message
+
+    try:
+        if single_flight is None:
+            return answer_question(question)[0]['answer']
+        # 同時問同一個問題的請求共用同一次處理的結果
+        (result, shared), shared_locally = single_flight.do(
+            normalize_question(question), lambda: answer_question(question)
+        )
+        if shared or shared_locally:
+            serve_shared_answer(question, result)
+        return result['answer']
 
     except Exception as e:
         print(f"❌ 在與 AI 或資料庫溝通時發生錯誤:")
         traceback.print_exc() # 印出更詳細的錯誤堆疊
         return f"❌ 處理您的問題時發生錯誤: {e}"
 
+def stream_it_knowledge_base_qa(question):
+    """
+    it_knowledge_base_qa 的串流版本，產生 (事件名稱, 資料) 組合：
+    meta (來源) → delta (逐段文字) → done (完整答案) 或 error。
+    問答記錄在串流完整結束後才寫入 MongoDB。
+    """
+    not_ready_message = check_qa_ready(question)
+    if not_ready_message:
+        yield 'done', {'answer': not_ready_message}
+        return
+
+    try:
+        plan = prepare_answer(question)
+        if plan['answer'] is not None:
+            yield 'meta', {'cached': plan['fast_path'].startswith('cache'), 'fast_path': plan['fast_path']}
+            yield 'delta', {'text': plan['answer']}
+            yield 'done', {'answer': plan['answer']}
+            return
+
+        yield 'meta', {'cached': False, 'source': plan['source'], 'retrieval': plan['retrieval']}
+        if plan['is_internal']:
+            yield 'delta', {'text': KB_ANSWER_PREFIX}
+
+        route = select_route(question, plan)
+        if route == 'refusal_fast':
+            text = finish_route(plan, route, NOT_IT_REFUSAL)
+            yield 'delta', {'text': text}
+            yield 'done', {'answer': complete_answer(question, plan, text)}
+            return
+
+        parts = []
+        yield from stream_generation(plan, route, parts)
+
+        yield 'done', {'answer': complete_answer(question, plan, "".join(parts))}
+
+    except Exception as e:
+        print(f"❌ 在與 AI 或資料庫溝通時發生錯誤:")
+        traceback.print_exc()
+        yield 'error', {'answer': f"❌ 處理您的問題時發生錯誤: {e}"}
+
+
+# --- 批次問答 (大量歷史問題的評估與答案快取預熱) ---
+def batch_result(index, question, started, plan=None, answer=None, path=None, error=None, search_results=None):
+    scores = [hit.score for hit in search_results] if search_results else []
+    if path is None and plan is not None:
+        path = plan['fast_path'] or 'generated'
+    return {
+        'index': index,
+        'question': question,
+        'answer': answer,
+        'source': plan['source'] if plan else None,
+        'path': path,
+        'top_score': round(max(scores), 4) if scores else None,
+        'hits': len(scores) if search_results is not None else None,
+        'retrieval': plan['retrieval'] if plan else None,
+        'model_route': plan['route'] if plan else None,
+        'error': error,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+def batch_it_knowledge_base_qa(questions, concurrency=BATCH_CONCURRENCY, generate=True, gate=None):
+    """
+    it_knowledge_base_qa 的批次版本，依完成順序產生每個問題的結果 dict (以 index 對應原本的位置)：
+      1. 快取完全相符、識別碼命中的問題立即回傳。
+      2. 其餘問題的 Embedding 每 BATCH_EMBED_SIZE 筆合併成一次 embed_content 呼叫，
+         搜尋每 BATCH_SEARCH_SIZE 筆合併成一次 search_batch。
+      3. 需要生成的問題以最多 concurrency 條執行緒並行呼叫 Gemini；遇到速率限制時全部一起暫停後重試。
+    generate=False 時只做 Embedding 與搜尋 (不讀寫答案快取、不生成、不寫入問答記錄)，用來評估分數門檻。
+    正規化後相同的問題只處理一次，其餘的直接沿用結果 (duplicate_of 為第一次出現的 index)。
+    """
+    first_index = {}
+    duplicates = {}
+    unique = []
+    for index, question in enumerate(questions):
+        key = normalize_question(question)
+        if key in first_index:
+            duplicates.setdefault(first_index[key], []).append(index)
+            continue
+        first_index[key] = index
+        unique.append((index, question))
+
+    for result in _batch_answer(unique, concurrency, generate, gate or RateLimitGate()):
+        yield result
+        for index in duplicates.get(result['index'], ()):
+            yield dict(result, index=index, question=questions[index], duplicate_of=result['index'])
+
+def _batch_answer(items, concurrency, generate, gate):
+    started = time.perf_counter()
+    pending = []
+    for index, question in items:
+        not_ready_message = check_qa_ready(question)
+        if not_ready_message:
+            yield batch_result(index, question, started, answer=not_ready_message, path='rejected')
+            continue
+        if generate:
+            try:
+                plan = prepare_fast_path(question)
+            except Exception as e:
+                yield batch_result(index, question, started, path='error', error=str(e))
+                continue
+            if plan is not None:
+                yield batch_result(index, question, started, plan=plan, answer=plan['answer'])
+                continue
+        pending.append((index, question))
+
+    # --- 批次 Embedding ---
+    embedded = []
+    for batch in chunked(pending, BATCH_EMBED_SIZE):
+        try:
+            vectors = gate.call(embed_texts, [question for _, question in batch], task_type="RETRIEVAL_QUERY")
+        except Exception as e:
+            print(f"❌ 批次 Embedding 失敗 ({len(batch)} 個問題): {e}")
+            for index, question in batch:
+                yield batch_result(index, question, started, path='error', error=str(e))
+            continue
+        for (index, question), query_vector in zip(batch, vectors):
+            if generate:
+                plan = prepare_similar_cached(question, query_vector)
+                if plan is not None:
+                    yield batch_result(index, question, started, plan=plan, answer=plan['answer'])
+                    continue
+            embedded.append((index, question, query_vector))
+    print(f"✅ 批次 Embedding 完成: {len(embedded)} 個問題需要搜尋。")
+
+    # --- 批次搜尋 ---
+    to_generate = []
+    for batch in chunked(embedded, BATCH_SEARCH_SIZE):
+        try:
+            with metrics.timer('qdrant_search'):
+                batch_results = gate.call(
+                    search_knowledge_base_batch,
+                    [query_vector for _, _, query_vector in batch],
+                )
+        except Exception as e:
+            print(f"❌ 批次搜尋失敗 ({len(batch)} 個問題): {e}")
+            for index, question, _ in batch:
+                yield batch_result(index, question, started, path='error', error=str(e))
+            continue
+        for (index, question, query_vector), search_results in zip(batch, batch_results):
+            plan = plan_from_search_results(question, query_vector, search_results)
+            if not generate:
+                yield batch_result(index, question, started, plan=plan, path=plan['fast_path'] or 'needs_generation',
+                                   search_results=search_results)
+            elif plan['direct_answer'] is not None:
+                answer = complete_answer(question, plan, plan['direct_answer'])
+                yield batch_result(index, question, started, plan=plan, answer=answer, search_results=search_results)
+            else:
+                to_generate.append((index, question, plan, search_results))
+
+    # --- 有上限的並行生成 ---
+    def generate_one(item):
+        _, question, plan, _ = item
+        return complete_answer(question, plan, gate.call(generate_answer, question, plan))
+
+    for (index, question, plan, search_results), answer, error in run_bounded(to_generate, generate_one, concurrency):
+        if error is not None:
+            print(f"❌ 生成第 {index} 個問題的答案時發生錯誤: {error}")
+        yield batch_result(
+            index, question, started, plan=plan, answer=answer,
+            error=str(error) if error is not None else None, search_results=search_results,
+        )
+
 
 # --- Flask 路由 (API Endpoints) ---
 @app.route('/')
@@ -336,34 +1616,166 @@ def index():
     is_ai_fully_configured = is_gemini_configured and is_qdrant_configured
     return render_template('index.html', is_ai_configured=is_ai_fully_configured)
 
+def parse_log_query_args(args):
+    """解析 /api/logs 的查詢參數，回傳 (篩選條件 dict, 錯誤訊息)。"""
+    try:
+        page_size = int(args.get('page_size', LOGS_DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return None, "page_size 必須為整數。"
+    page_size = max(1, min(page_size, LOGS_MAX_PAGE_SIZE))
+
+    status = args.get('status') or None
+    if status and status not in LOG_STATUSES:
+        return None, f"無效的狀態: {status}"
+
+    # 舊版參數 date 代表單日，等同 date_from = date_to
+    date_from_str = args.get('date_from') or args.get('date') or None
+    date_to_str = args.get('date_to') or args.get('date') or None
+    try:
+        date_from = datetime.strptime(date_from_str, '%Y-%m-%d').date() if date_from_str else None
+        date_to = datetime.strptime(date_to_str, '%Y-%m-%d').date() if date_to_str else None
+    except ValueError:
+        return None, "日期格式必須為 YYYY-MM-DD。"
+
+    cursor = None
+    if args.get('cursor'):
+        try:
+            cursor = decode_log_cursor(args['cursor'])
+        except ValueError as e:
+            return None, str(e)
+
+    ticket = (args.get('ticket') or '').strip() or None
+    try:
+        fields = parse_log_fields(args.get('fields'))
+    except ValueError as e:
+        return None, str(e)
+    return {
+        'page_size': page_size,
+        'cursor': cursor,
+        'status': status,
+        'date_from': date_from,
+        'date_to': date_to,
+        'ticket': ticket,
+        'fields': fields,
+    }, None
+
+@metrics.timed('format')
+def format_log_rows(df, fields=None):
+    """
+    將查詢結果轉成前端顯示用的欄位 (狀態圖示、時間字串、內容預覽)，回傳已序列化的 JSON 陣列 (bytes)。
+    fields 為要輸出的欄位 (None 表示全部)。
+    """
+    if df is None or df.empty:
+        return b"[]"
+    return log_rows_json(format_log_frame(df, fields), fields)
+
+def build_log_changes_payload(since, watermark, filters):
+    """增量同步的回應內容；resync 為 True 時前端應重新載入目前頁面。"""
+    payload = {"logs": b"[]", "delta": True, "resync": False}
+    if set(since) != set(watermark):
+        # 舊版 (log_id + CHECKSUM) 的水位
+        payload["resync"] = True
+        return payload, None
+    if since == watermark:
+        return payload, None
+    changes_df, too_many, error_msg = fetch_log_changes_from_gcp_sql(
+        since, filters['status'], filters['date_from'], filters['date_to'], filters['ticket'], filters['fields']
+    )
+    if error_msg:
+        return None, error_msg
+    if too_many:
+        payload["resync"] = True
+    elif not changes_df.empty:
+        payload["logs"] = format_log_rows(changes_df, filters['fields'])
+    return payload, None
+
 @app.route('/api/logs', methods=['GET'])
 def get_logs():
-    # 已修改呼叫的函式名稱
-    full_df, error_msg = fetch_log_data_from_gcp_sql()
+    """
+    分頁查詢日誌；帶 since (前一次回應的 watermark) 時只回傳之後異動的列，由前端合併到目前的表格。
+    fields (逗號分隔) 只回傳指定的欄位，例如表格只需要 log_preview，完整的 log_data 由 /api/logs/<log_id> 另外讀取。
+    只有需要同步的請求 (sync=1、since 或 If-None-Match) 才讀取水位並帶 ETag：
+    資料表水位與查詢參數 (不含 since / sync) 都沒變時，If-None-Match 相符即回傳 304，不再查詢資料列。
+    限制：rowversion 只記錄新增與修改，增量回應不會包含已刪除的列；前端需定期重新載入整頁
+    (見 templates/index.html 的 LOGS_FULL_RELOAD_MS 與 sql/log_data_rowversion.sql)。
+    """
+    filters, error_msg = parse_log_query_args(request.args)
+    if error_msg:
+        return jsonify({"error": error_msg}), 400
+    since = None
+    if request.args.get('since'):
+        try:
+            since = decode_log_watermark(request.args['since'])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    watermark = etag = None
+    wants_sync = since is not None or bool(request.if_none_match) or request.args.get('sync') == '1'
+    if wants_sync and LOGS_ROWVERSION_COLUMN:
+        watermark, error_msg = fetch_log_watermark()
+        if error_msg:
+            return jsonify({"error": error_msg}), 500
+        etag = log_etag(watermark, request.args)
+    # 壓縮過的回應帶的是弱 ETag (見 compress_json_response)，比對時一律使用弱比對
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        if since is not None and watermark is None:
+            # 未設定 rowversion 欄位時無法提供增量同步
+            payload = {"logs": b"[]", "delta": True, "resync": True}
+        elif since is not None:
+            payload, error_msg = build_log_changes_payload(since, watermark, filters)
+            if error_msg:
+                return jsonify({"error": error_msg}), 500
+        else:
+            full_df, next_cursor, error_msg = fetch_log_data_from_gcp_sql(**filters)
+            if error_msg:
+                return jsonify({"error": error_msg}), 500
+            payload = {
+                "logs": format_log_rows(full_df, filters['fields']),
+                "next_cursor": next_cursor,
+                "has_more": next_cursor is not None,
+                "page_size": filters['page_size'],
+            }
+        payload["watermark"] = encode_log_watermark(watermark) if watermark is not None else None
+        # logs 已由 format_log_rows 直接從欄位序列化，這裡只把其餘欄位接上去
+        response = Response(json_with_rows(payload.pop("logs"), **payload), mimetype='application/json')
+    if etag is not None:
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/logs/<int:log_id>', methods=['GET'])
+def get_log_entry(log_id):
+    """單筆記錄的所有欄位 (包含完整的 log_data)，前端展開某一列時才呼叫。"""
+    df, error_msg = fetch_log_entry_from_gcp_sql(log_id)
     if error_msg:
         return jsonify({"error": error_msg}), 500
-    if full_df is None or full_df.empty:
-        return jsonify([])
-
-    def format_status(status):
-        if status == '進行中': return f"⏳ 進行中"
-        elif status == '已完成': return f"✅ 已完成"
-        return f"🔴 未開始"
-
-    def format_log_content(log_string):
-        if not isinstance(log_string, str): return ""
-        last_bracket_pos = log_string.rfind('] ')
-        content_to_display = log_string[last_bracket_pos + 2:].strip() if last_bracket_pos != -1 else log_string
-        return content_to_display[:80] + '...' if len(content_to_display) > 80 else content_to_display
-
-    full_df['status_display'] = full_df['status'].apply(format_status)
-    full_df['log_date'] = pd.to_datetime(full_df['log_date'], errors='coerce').dt.strftime('%Y-%m-%d %H:%M:%S')
-    full_df['log_date'] = full_df['log_date'].fillna('')
-    full_df['log_preview'] = full_df['log_data'].apply(format_log_content)
-    full_df['ticket_number'] = full_df['ticket_number'].fillna('').astype(str)
-    logs_list = full_df.to_dict(orient='records')
-    
-    return jsonify(logs_list)
+    if df.empty:
+        return jsonify({"error": f"找不到 log_id 為 {log_id} 的記錄。"}), 404
+    rows_json = format_log_rows(df)
+    # rows_json 為只有一個物件的陣列，去掉外層的 [ ]
+    return Response(rows_json[1:-1], mimetype='application/json')
+
+@app.route('/api/logs/summary', methods=['GET'])
+def get_logs_summary():
+    """
+    儀表板標頭用的彙總：依狀態的筆數、未完成的積壓 (未指派單號、最舊一筆、等待時間分布)，
+    以及最近 days 天 / hours 小時依狀態的筆數。cached 表示結果來自行程內的短期快取。
+    """
+    try:
+        days = int(request.args.get('days', LOGS_SUMMARY_DAYS))
+        hours = int(request.args.get('hours', LOGS_SUMMARY_HOURS))
+    except ValueError:
+        return jsonify({"error": "days 與 hours 必須為整數。"}), 400
+    days = max(1, min(days, LOGS_SUMMARY_MAX_DAYS))
+    hours = max(1, min(hours, LOGS_SUMMARY_MAX_HOURS))
+    summary, cached, error_msg = get_log_summary(days, hours)
+    if error_msg:
+        return jsonify({"error": error_msg}), 500
+    response = jsonify({**summary, "cached": cached})
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/api/ask', methods=['POST'])
 def ask_question():
@@ -379,6 +1791,64 @@ def ask_question():
     
     return jsonify({"answer": answer})
 
+@app.route('/api/ask/stream', methods=['POST'])
+def ask_question_stream():
+    """以 Server-Sent Events 逐段回傳答案，首個位元組的時間只取決於模型的第一個 token。"""
+    if not (is_gemini_configured and is_qdrant_configured):
+        return jsonify({"answer": "❌ AI 或知識庫功能未啟用。請檢查伺服器端的環境變數設定。"}), 400
+
+    data = request.get_json()
+    if not data or 'question' not in data:
+        return jsonify({"answer": "錯誤：請求中未包含問題。"}), 400
+
+    question = data['question']
+
+    def event_stream():
+        for event, payload in stream_it_knowledge_base_qa(question):
+            yield f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.route('/api/ask/batch', methods=['POST'])
+def ask_question_batch():
+    """
+    批次問答：body 為 {"questions": [...], "concurrency": 4, "generate": true}。
+    以 NDJSON 逐行回傳每個問題的結果 (依完成順序，index 為在 questions 中的位置)，最後一行為 {"summary": {...}}。
+    """
+    if not (is_gemini_configured and is_qdrant_configured):
+        return jsonify({"error": "❌ AI 或知識庫功能未啟用。請檢查伺服器端的環境變數設定。"}), 400
+
+    data = request.get_json(silent=True)
+    questions = data.get('questions') if isinstance(data, dict) else None
+    if not isinstance(questions, list) or not all(isinstance(q, str) for q in questions):
+        return jsonify({"error": "請求無效，questions 必須是字串陣列。"}), 400
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return jsonify({"error": f"一次最多 {BATCH_MAX_QUESTIONS} 個問題。"}), 400
+    try:
+        concurrency = int(data.get('concurrency', BATCH_CONCURRENCY))
+    except (TypeError, ValueError):
+        return jsonify({"error": "concurrency 必須是整數。"}), 400
+    concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+    generate = bool(data.get('generate', True))
+
+    def line_stream():
+        gate = RateLimitGate()
+        summary = BatchSummary()
+        for result in batch_it_knowledge_base_qa(questions, concurrency, generate, gate):
+            summary.add(result)
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+        yield json.dumps({"summary": summary.as_dict(gate)}, ensure_ascii=False) + "\n"
+
+    return Response(
+        stream_with_context(line_stream()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
 @app.route('/api/logs/update', methods=['POST'])
 def update_log_ticket():
     data = request.get_json()
@@ -397,6 +1867,126 @@ def update_log_ticket():
     else:
         return jsonify({"error": message}), 500
 
+@app.route('/api/logs/update/bulk', methods=['POST'])
+def bulk_update_log_tickets():
+    """
+    一次套用多筆 (log_id, ticket_number, status) 更新 (同一個交易)，回傳每一筆的結果：
+    {"updated": 2, "failed": 1, "results": [{"log_id": 1, "ok": true, "error": null}, ...]}
+    """
+    updates, error_msg = parse_bulk_log_updates(request.get_json(silent=True))
+    if error_msg:
+        return jsonify({"error": error_msg}), 400
+    results, error_msg = bulk_update_log_details_in_gcp_sql(updates)
+    if error_msg:
+        return jsonify({"error": error_msg}), 500
+    updated = sum(1 for result in results if result['ok'])
+    return jsonify({"updated": updated, "failed": len(results) - updated, "results": results})
+
+@app.route('/api/cache/answers', methods=['GET'])
+def get_answer_cache_stats():
+    if answer_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **answer_cache.stats()})
+
+@app.route('/api/cache/answers/invalidate', methods=['POST'])
+def invalidate_answer_cache():
+    if lexical_index is not None:
+        # 知識庫已更新：BM25 索引也在背景重新建立
+        threading.Thread(target=refresh_lexical_index, kwargs={'force': True}, daemon=True).start()
+    if answer_cache is None:
+        return jsonify({"enabled": False})
+    answer_cache.invalidate()
+    return jsonify({"message": "答案快取已清空。", "kb_version": answer_cache.kb_version})
+
+@app.route('/api/cache/embeddings', methods=['GET'])
+def get_embedding_cache_stats():
+    if embedding_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **embedding_cache.stats()})
+
+@app.route('/api/ready', methods=['GET'])
+def get_readiness():
+    """各後端 (Gemini / Qdrant / MongoDB) 的初始化狀態；全部就緒 (或未啟用) 時回傳 200，否則 503。"""
+    snapshot = backends.snapshot()
+    return jsonify(snapshot), (200 if snapshot['ready'] else 503)
+
+@app.route('/api/retrieval/stats', methods=['GET'])
+def get_retrieval_stats():
+    stats = context_builder.stats()
+    stats['lexical_index'] = lexical_index.stats() if lexical_index is not None else {'enabled': False}
+    stats['vector_search'] = {
+        'backend': 'local' if local_index_ready() else 'qdrant',
+        'transport': 'grpc' if QDRANT_PREFER_GRPC else 'rest',
+        'local_index': local_vector_index.stats() if local_vector_index is not None else {'enabled': False},
+    }
+    stats['answer_paths'] = answer_path_stats()
+    stats['model_router'] = model_router.stats()
+    return jsonify(stats)
+
+@app.route('/api/db/qa-writer', methods=['GET'])
+def get_qa_writer_stats():
+    if qa_writer is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **qa_writer.stats()})
+
+def collect_metrics():
+    """/metrics 輸出時才讀取的數值：快取命中率、回答方式、背景寫入佇列、連線池與後端狀態。"""
+    samples = []
+    if answer_cache is not None:
+        stats = answer_cache.stats()
+        samples.append(('answer_cache_hit_ratio', 'gauge', {}, stats['hit_rate']))
+        samples.append(('answer_cache_entries', 'gauge', {}, stats['entries']))
+        for result in ('exact_hits', 'semantic_hits', 'misses'):
+            samples.append(('answer_cache_lookups_total', 'counter', {'result': result}, stats[result]))
+    if embedding_cache is not None:
+        stats = embedding_cache.stats()
+        samples.append(('embedding_cache_hit_ratio', 'gauge', {}, stats['hit_rate']))
+        samples.append(('embedding_cache_entries', 'gauge', {}, stats['entries']))
+        for result in ('memory_hits', 'persistent_hits', 'misses'):
+            samples.append(('embedding_cache_lookups_total', 'counter', {'result': result}, stats[result]))
+    for path, count in answer_path_stats()['counts'].items():
+        samples.append(('answer_path_total', 'counter', {'path': path}, count))
+    if local_vector_index is not None:
+        stats = local_vector_index.stats()
+        samples.append(('local_vector_index_points', 'gauge', {}, stats['points']))
+        samples.append(('local_vector_index_searches_total', 'counter', {}, stats['searches']))
+    router_stats = model_router.stats()
+    for route, count in router_stats['routes'].items():
+        samples.append(('model_route_total', 'counter', {'route': route}, count))
+    samples.append(('model_route_fallbacks_total', 'counter', {}, router_stats['fallbacks']))
+    for scope, flight in (('worker', single_flight), ('shared', flight_lease)):
+        if flight is not None:
+            for result, count in flight.stats().items():
+                samples.append(('single_flight_total', 'counter', {'scope': scope, 'result': result}, count))
+    stats = log_summary_cache.stats()
+    for result in ('hits', 'misses'):
+        samples.append(('log_summary_cache_lookups_total', 'counter', {'result': result}, stats[result]))
+    if qa_writer is not None:
+        stats = qa_writer.stats()
+        samples.append(('qa_writer_queued', 'gauge', {}, stats['queued']))
+        samples.append(('qa_writer_written_total', 'counter', {}, stats['written']))
+    if sql_pool is not None:
+        stats = sql_pool.stats()
+        samples.append(('sql_pool_in_use', 'gauge', {}, stats['in_use']))
+        samples.append(('sql_pool_size', 'gauge', {}, stats['size']))
+        samples.append(('sql_pool_waits_total', 'counter', {}, stats['waits']))
+    for name, backend in backends.snapshot()['backends'].items():
+        samples.append(('backend_ready', 'gauge', {'backend': name}, 1 if backend['state'] == 'ready' else 0))
+    return samples
+
+metrics.register_collector(collect_metrics)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 格式的指標 (每個 worker 各自累計)。"""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/db/pool', methods=['GET'])
+def get_sql_pool_stats():
+    if sql_pool is None:
+        return jsonify({"initialized": False})
+    return jsonify({"initialized": True, **sql_pool.stats()})
+
 # --- 啟動 Flask 應用程式 ---
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
@@ -0,0 +1,385 @@
+# asgi_app.py
+# /api/ask 的 asyncio 服務模式：Embedding → 搜尋 → 生成 全程使用非同步用戶端
+# (Gemini *_async、AsyncQdrantClient、PyMongo AsyncMongoClient)，
+# 單一行程即可同時處理數百個進行中的問題，不需要每個請求佔用一條執行緒。
+# 其他路由 (/api/logs 等) 仍由原本的 Flask app 透過 WSGI 轉接處理。
+#
+# 啟動方式:
+#   uvicorn asgi_app:app --host 0.0.0.0 --port 8080
+# 或在 Docker 中設定 SERVER_MODE=async。
+import asyncio
+import contextlib
+import json
+import os
+import time
+import traceback
+
+import google.generativeai as genai
+import numpy as np
+from a2wsgi import WSGIMiddleware
+from pymongo import AsyncMongoClient
+from qdrant_client import AsyncQdrantClient
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as sync_app
+from single_flight import AsyncSingleFlight
+
+# 同時進行中的問題上限 (超過時在事件迴圈中排隊，而不是佔用執行緒)
+ASK_ASYNC_MAX_INFLIGHT = int(os.environ.get("ASK_ASYNC_MAX_INFLIGHT", "500"))
+
+async_qdrant_client = None
+async_mongo_client = None
+async_mongo_collection = None
+_inflight = asyncio.Semaphore(ASK_ASYNC_MAX_INFLIGHT)
+# 同一個事件迴圈內同時問同一個問題的請求共用同一次處理的結果 (跨 worker 的合併只在同步模式提供)
+single_flight = AsyncSingleFlight(timeout=sync_app.SINGLE_FLIGHT_TIMEOUT) if sync_app.SINGLE_FLIGHT_ENABLED else None
+if single_flight is not None:
+    sync_app.metrics.register_collector(lambda: [
+        ('single_flight_total', 'counter', {'scope': 'event_loop', 'result': result}, count)
+        for result, count in single_flight.stats().items()
+    ])
+
+
+# --- 非同步 I/O 輔助函式 ---
+async def gemini_embed_async(model, texts, task_type):
+    result = await genai.embed_content_async(model=model, content=texts, task_type=task_type)
+    return result['embedding']
+
+
+async def embed_query_async(question):
+    with sync_app.metrics.timer('embed'):
+        return await _embed_query_async(question)
+
+
+async def _embed_query_async(question):
+    if sync_app.embedding_cache is None:
+        vectors = await gemini_embed_async(sync_app.GEMINI_EMBEDDING_MODEL_NAME, [question], "RETRIEVAL_QUERY")
+        return np.asarray(vectors[0], dtype=np.float32)
+    vectors = await sync_app.embedding_cache.embed_async(
+        sync_app.GEMINI_EMBEDDING_MODEL_NAME, [question], "RETRIEVAL_QUERY", gemini_embed_async
+    )
+    return vectors[0]
+
+
+async def save_qa_async(question, answer, source, extra_fields=None):
+    with sync_app.metrics.timer('mongo_save'):
+        await _save_qa_async(question, answer, source, extra_fields)
+
+
+async def _save_qa_async(question, answer, source, extra_fields=None):
+    if sync_app.qa_writer is not None:
+        # 背景寫入器啟用時只需放進佇列，不必等待 MongoDB
+        sync_app.save_qa_to_mongodb(question, answer, source, extra_fields)
+        return
+    if async_mongo_collection is None:
+        sync_app.metrics.debug("MongoDB 未設定或初始化失敗，跳過儲存。")
+        return
+    try:
+        result = await async_mongo_collection.insert_one(
+            sync_app.build_qa_record(question, answer, source, extra_fields)
+        )
+        sync_app.metrics.debug(f"✅ 成功將問答記錄儲存到 MongoDB (Document _id: {result.inserted_id})")
+    except Exception as e:
+        print(f"❌ 儲存到 MongoDB 時發生錯誤: {e}")
+
+
+async def get_exact_cached_async(question):
+    cache = sync_app.answer_cache
+    if cache is None:
+        return None
+    # 記憶體查詢很快 (知識庫版本由背景執行緒更新，查詢不會觸發)；
+    # 有 MongoDB 持久層時可能需要網路往返 (逾時很短)，放到執行緒避免阻塞事件迴圈
+    if cache.mongo_collection is None and cache.lookup_collection is None:
+        return cache.get_exact(question)
+    return await asyncio.to_thread(cache.get_exact, question)
+
+
+async def serve_cached_answer_async(question, cached, level):
+    sync_app.metrics.debug(f"✅ 答案快取命中 ({level})，略過 Embedding / 搜尋 / 生成。")
+    await save_qa_async(question, cached.answer, cached.source, extra_fields={'cache_hit': level})
+    return sync_app.format_cached_answer(cached)
+
+
+# --- 非同步問答流程 (與 app.prepare_answer / complete_answer 相同的步驟) ---
+async def prepare_answer_async(question):
+    plan = sync_app.new_answer_plan()
+
+    cached = await get_exact_cached_async(question)
+    if cached is not None:
+        plan['answer'] = await serve_cached_answer_async(question, cached, 'exact')
+        plan['fast_path'] = 'cache_exact'
+        sync_app.count_answer_path(plan)
+        return plan
+
+    direct_plan = sync_app.plan_from_identifier_match(question)
+    if direct_plan is not None:
+        direct_plan['answer'] = await complete_answer_async(question, direct_plan, direct_plan['direct_answer'])
+        return direct_plan
+
+    query_vector = await embed_query_async(question)
+    plan['query_vector'] = query_vector
+
+    if sync_app.answer_cache is not None:
+        cached, similarity = sync_app.answer_cache.get_similar(query_vector)
+        if cached is not None:
+            sync_app.metrics.debug(f"   - 與快取問題 '{cached.normalized_question[:30]}' 的相似度: {similarity:.4f}")
+            plan['answer'] = await serve_cached_answer_async(question, cached, 'semantic')
+            plan['fast_path'] = 'cache_semantic'
+            sync_app.count_answer_path(plan)
+            return plan
+
+    with sync_app.metrics.timer('qdrant_search'):
+        if sync_app.local_index_ready():
+            # 行程內的矩陣乘法只需幾十微秒，直接在事件迴圈中執行
+            search_results = sync_app.search_knowledge_base(query_vector)
+        else:
+            search_results = await async_qdrant_client.search(**sync_app.build_search_kwargs(query_vector))
+    plan = sync_app.plan_from_search_results(question, query_vector, search_results)
+    if plan['direct_answer'] is not None:
+        plan['answer'] = await complete_answer_async(question, plan, plan['direct_answer'])
+    return plan
+
+
+async def complete_answer_async(question, plan, final_answer):
+    sync_app.count_answer_path(plan)
+    cache_fields = None
+    if not plan['truncated']:
+        cache_fields = sync_app.remember_answer(
+            question, plan['query_vector'], final_answer, plan['source'], plan['is_internal']
+        )
+    await save_qa_async(
+        question, final_answer, plan['source'], extra_fields=sync_app.answer_record_fields(plan, cache_fields)
+    )
+    return sync_app.frame_answer(plan, final_answer)
+
+
+async def call_model_async(plan, route, prompt):
+    model, model_name = sync_app.route_target(route)
+    with sync_app.metrics.timer('generate'):
+        response = await model.generate_content_async(
+            prompt, generation_config=sync_app.generation_config(plan, route)
+        )
+    sync_app.record_token_usage(response, plan, model_name, route)
+    if route != 'classify':
+        plan['truncated'] = sync_app.is_truncated(response)
+    return response
+
+
+async def select_route_async(question, plan):
+    """與 app.select_route 相同的路由 (分類以 generate_content_async 呼叫)。"""
+    route = sync_app.model_router.route(plan)
+    if route != 'classify':
+        return route
+    try:
+        response = await call_model_async(plan, 'classify', sync_app.build_classification_prompt(question))
+        is_it = sync_app.parse_classification(response.text)
+    except Exception as e:
+        print(f"🟡 快速模型分類失敗，改用主要模型: {e}")
+        is_it = None
+    return 'refusal_fast' if is_it is False else 'main'
+
+
+async def generate_answer_async(question, plan):
+    """與 app.generate_answer 相同：快速模型失敗或被截斷時改用主要模型。"""
+    route = await select_route_async(question, plan)
+    if route == 'refusal_fast':
+        return sync_app.finish_route(plan, route, sync_app.NOT_IT_REFUSAL)
+    if route == 'extract_fast':
+        try:
+            response = await call_model_async(plan, route, plan['prompt'])
+            if not sync_app.is_truncated(response):
+                return sync_app.finish_route(plan, route, response.text)
+            print("🟡 快速模型的輸出達到上限，改用主要模型。")
+        except Exception as e:
+            print(f"🟡 快速模型生成失敗，改用主要模型: {e}")
+        response = await call_model_async(plan, 'main', plan['prompt'])
+        return sync_app.finish_route(plan, 'main', response.text, fallback=True)
+    response = await call_model_async(plan, 'main', plan['prompt'])
+    return sync_app.finish_route(plan, 'main', response.text)
+
+
+async def stream_route_async(plan, route, parts):
+    """與 app.stream_route 相同 (以 generate_content_async 串流)。"""
+    model, model_name = sync_app.route_target(route)
+    started = time.perf_counter()
+    response = await model.generate_content_async(
+        plan['prompt'], stream=True, generation_config=sync_app.generation_config(plan, route)
+    )
+    async for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            continue
+        if text:
+            if not parts:
+                sync_app.metrics.record_stage('generate_first_token', time.perf_counter() - started)
+            parts.append(text)
+            yield 'delta', {'text': text}
+    sync_app.metrics.record_stage('generate', time.perf_counter() - started)
+    sync_app.record_token_usage(response, plan, model_name, route)
+    plan['truncated'] = sync_app.is_truncated(response)
+
+
+async def stream_generation_async(plan, route, parts):
+    """與 app.stream_generation 相同：快速模型在送出任何文字前失敗時改用主要模型。"""
+    fallback = False
+    try:
+        async for event in stream_route_async(plan, route, parts):
+            yield event
+        retry = route == 'extract_fast' and plan['truncated'] and not parts
+    except Exception as e:
+        if route != 'extract_fast' or parts:
+            raise
+        print(f"🟡 快速模型生成失敗，改用主要模型: {e}")
+        retry = True
+    if retry:
+        route, fallback = 'main', True
+        async for event in stream_route_async(plan, route, parts):
+            yield event
+    sync_app.finish_route(plan, route, None, fallback)
+
+
+async def answer_question_async(question):
+    """回傳 {'answer', 'source'}。"""
+    plan = await prepare_answer_async(question)
+    if plan['answer'] is None:
+        plan['answer'] = await complete_answer_async(question, plan, await generate_answer_async(question, plan))
+    return {'answer': plan['answer'], 'source': plan['source']}
+
+
+async def serve_shared_answer_async(question, result):
+    sync_app.metrics.debug("✅ 相同的問題正在處理中，已共用其結果。")
+    plan = sync_app.new_answer_plan()
+    plan['fast_path'] = 'coalesced'
+    sync_app.count_answer_path(plan)
+    await save_qa_async(question, result['answer'], result['source'] or '', extra_fields={'coalesced': True})
+
+
+async def async_it_knowledge_base_qa(question):
+    not_ready_message = sync_app.check_qa_ready(question)
+    if not_ready_message:
+        return not_ready_message
+    try:
+        if single_flight is None:
+            return (await answer_question_async(question))['answer']
+        result, shared = await single_flight.do(
+            sync_app.normalize_question(question), lambda: answer_question_async(question)
+        )
+        if shared:
+            await serve_shared_answer_async(question, result)
+        return result['answer']
+    except Exception as e:
+        print(f"❌ 在與 AI 或資料庫溝通時發生錯誤:")
+        traceback.print_exc()
+        return f"❌ 處理您的問題時發生錯誤: {e}"
+
+
+async def async_stream_it_knowledge_base_qa(question):
+    not_ready_message = sync_app.check_qa_ready(question)
+    if not_ready_message:
+        yield 'done', {'answer': not_ready_message}
+        return
+    try:
+        plan = await prepare_answer_async(question)
+        if plan['answer'] is not None:
+            yield 'meta', {'cached': plan['fast_path'].startswith('cache'), 'fast_path': plan['fast_path']}
+            yield 'delta', {'text': plan['answer']}
+            yield 'done', {'answer': plan['answer']}
+            return
+
+        yield 'meta', {'cached': False, 'source': plan['source'], 'retrieval': plan['retrieval']}
+        if plan['is_internal']:
+            yield 'delta', {'text': sync_app.KB_ANSWER_PREFIX}
+
+        route = await select_route_async(question, plan)
+        if route == 'refusal_fast':
+            text = sync_app.finish_route(plan, route, sync_app.NOT_IT_REFUSAL)
+            yield 'delta', {'text': text}
+            yield 'done', {'answer': await complete_answer_async(question, plan, text)}
+            return
+
+        parts = []
+        async for event in stream_generation_async(plan, route, parts):
+            yield event
+
+        yield 'done', {'answer': await complete_answer_async(question, plan, "".join(parts))}
+    except Exception as e:
+        print(f"❌ 在與 AI 或資料庫溝通時發生錯誤:")
+        traceback.print_exc()
+        yield 'error', {'answer': f"❌ 處理您的問題時發生錯誤: {e}"}
+
+
+# --- 路由 ---
+async def _read_question(request):
+    if not (sync_app.is_gemini_configured and sync_app.is_qdrant_configured):
+        return None, JSONResponse({"answer": "❌ AI 或知識庫功能未啟用。請檢查伺服器端的環境變數設定。"}, status_code=400)
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not data or 'question' not in data:
+        return None, JSONResponse({"answer": "錯誤：請求中未包含問題。"}, status_code=400)
+    return data['question'], None
+
+
+async def ask_question(request):
+    handle = sync_app.metrics.begin_request('/api/ask')
+    question, error_response = await _read_question(request)
+    if error_response is not None:
+        sync_app.metrics.end_request(handle, error_response.status_code)
+        return error_response
+    async with _inflight:
+        answer = await async_it_knowledge_base_qa(question)
+    sync_app.metrics.end_request(handle, 200)
+    return JSONResponse({"answer": answer})
+
+
+async def ask_question_stream(request):
+    question, error_response = await _read_question(request)
+    if error_response is not None:
+        return error_response
+
+    async def event_stream():
+        # 串流在另一個 task 中執行，請求的計時從這裡開始到最後一個事件送出為止
+        handle = sync_app.metrics.begin_request('/api/ask/stream')
+        try:
+            async with _inflight:
+                async for event, payload in async_stream_it_knowledge_base_qa(question):
+                    yield f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        finally:
+            sync_app.metrics.end_request(handle, 200)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    global async_qdrant_client, async_mongo_client, async_mongo_collection
+    if sync_app.is_qdrant_configured:
+        async_qdrant_client = AsyncQdrantClient(**sync_app.qdrant_client_kwargs())
+        print("✅ AsyncQdrantClient 初始化成功。")
+    if sync_app.is_mongodb_configured:
+        async_mongo_client = AsyncMongoClient(sync_app.MONGO_CONNECTION_STRING, **sync_app.mongo_client_kwargs())
+        async_mongo_collection = async_mongo_client[sync_app.MONGO_DATABASE_NAME][sync_app.MONGO_COLLECTION_NAME]
+        print("✅ AsyncMongoClient 初始化成功。")
+    yield
+    if async_qdrant_client is not None:
+        await async_qdrant_client.close()
+    if async_mongo_client is not None:
+        await async_mongo_client.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/api/ask', ask_question, methods=['POST']),
+        Route('/api/ask/stream', ask_question_stream, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(sync_app.app)),
+    ],
+    lifespan=lifespan,
+)
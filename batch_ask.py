@@ -0,0 +1,79 @@
+# batch_ask.py
+# 以批次方式回答大量歷史問題 (評估分數門檻、預熱答案快取)，流程與 /api/ask/batch 相同：
+# Embedding 合併成批次呼叫、Qdrant 以 search_batch 搜尋、生成以有上限的並行進行。
+# 每個問題完成時立即寫出一行 JSON (依完成順序，以 index 對應輸入中的位置)。
+#
+# 用法:
+#   python batch_ask.py questions.txt                        # 每行一個問題；結果寫到 questions.txt.results.jsonl
+#   python batch_ask.py history.jsonl --concurrency 8        # JSONL，每行需有 question 欄位
+#   python batch_ask.py questions.txt --no-generate          # 只做 Embedding 與搜尋，輸出分數供調整門檻
+import argparse
+import json
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+
+def load_questions(path):
+    """.jsonl 檔每行讀取 question 欄位，其他檔案每個非空行為一個問題。"""
+    questions = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            questions.append(json.loads(line)['question'] if path.endswith('.jsonl') else line)
+    return questions
+
+
+def wait_for_backends(sync_app, timeout):
+    for name in ('gemini', 'qdrant'):
+        if not sync_app.backends.wait(name, timeout):
+            raise SystemExit(f"❌ {name} 在 {timeout} 秒內未就緒: {sync_app.backends.snapshot()['backends'].get(name)}")
+    # 識別碼直接回答需要 BM25 索引；給它一點時間建好，建不好也照常繼續
+    if sync_app.lexical_index is not None:
+        deadline = time.monotonic() + timeout
+        while not sync_app.lexical_index.ready and time.monotonic() < deadline:
+            time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批次回答大量問題 (評估門檻 / 預熱答案快取)。")
+    parser.add_argument("input", help="問題檔案：每行一個問題，或 .jsonl (每行需有 question 欄位)")
+    parser.add_argument("--output", help="結果檔案 (預設: <input>.results.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=None, help="同時進行的生成請求數")
+    parser.add_argument("--no-generate", action="store_true", help="只做 Embedding 與搜尋，不生成也不寫入快取與問答記錄")
+    parser.add_argument("--limit", type=int, default=None, help="只處理前 N 個問題")
+    parser.add_argument("--ready-timeout", type=float, default=60, help="等待後端就緒的秒數")
+    args = parser.parse_args()
+
+    questions = load_questions(args.input)[:args.limit]
+    output_path = args.output or f"{args.input}.results.jsonl"
+    print(f"✅ 已讀取 {len(questions)} 個問題 (來源: {args.input})。")
+    if not questions:
+        return
+
+    load_dotenv()
+    import app as sync_app
+    from batch_qa import BatchSummary, RateLimitGate
+
+    wait_for_backends(sync_app, args.ready_timeout)
+    concurrency = args.concurrency or sync_app.BATCH_CONCURRENCY
+    gate = RateLimitGate()
+    summary = BatchSummary()
+    with open(output_path, 'w', encoding='utf-8') as out:
+        for result in sync_app.batch_it_knowledge_base_qa(questions, concurrency, not args.no_generate, gate):
+            summary.add(result)
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            print(f"   - [{summary.total}/{len(questions)}] #{result['index']} {result['path']}"
+                  f"{' ❌ ' + result['error'] if result['error'] else ''}", file=sys.stderr)
+
+    print(f"\n🎉 完成！結果已寫入 {os.path.abspath(output_path)}")
+    print(json.dumps(summary.as_dict(gate), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# batch_qa.py
+# 批次問答 (/api/ask/batch 與 batch_ask.py) 用的共用工具：
+#   - RateLimitGate：遇到速率限制時，所有工作執行緒一起暫停 (而不是各自重試、繼續打滿配額)，並以指數退避重試。
+#   - run_bounded：以固定數量的執行緒處理工作，依完成順序逐筆產生結果。
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from rate_limit import is_rate_limited
+
+
+def chunked(items, size):
+    return [items[i:i + size] for i in range(0, len(items), max(1, size))]
+
+
+class RateLimitGate:
+    """
+    執行緒安全；call(fn, *args) 執行 fn，遇到速率限制時設定共用的暫停時間再重試。
+    任一執行緒被限流後，其他執行緒在下一次呼叫前也會等到暫停結束，避免整批請求持續被拒絕。
+    """
+
+    def __init__(self, max_retries=6, base_delay=1.0, max_delay=30.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self._rate_limited = 0
+        self._retries = 0
+
+    def _wait_if_paused(self):
+        with self._lock:
+            delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def call(self, fn, *args, **kwargs):
+        for attempt in range(self.max_retries):
+            self._wait_if_paused()
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limited(e) or attempt == self.max_retries - 1:
+                    raise
+                delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+                delay = random.uniform(delay / 2, delay)
+                with self._lock:
+                    self._rate_limited += 1
+                    self._retries += 1
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                print(f"🟡 遭到速率限制或暫時性錯誤 ({type(e).__name__})，暫停 {delay:.1f} 秒後重試...")
+
+    def stats(self):
+        with self._lock:
+            return {'rate_limited': self._rate_limited, 'retries': self._retries}
+
+
+def run_bounded(items, fn, concurrency):
+    """最多 concurrency 個 fn(item) 同時執行；依完成順序產生 (item, 結果, 例外)。"""
+    items = list(items)
+    if not items:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(items)))) as executor:
+        pending = {executor.submit(fn, item): item for item in items}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                error = future.exception()
+                yield item, (None if error is not None else future.result()), error
+
+
+class BatchSummary:
+    """累計一批問題的結果：各種回答方式的數量、錯誤數與總耗時。"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total = 0
+        self.errors = 0
+        self.paths = {}
+
+    def add(self, result):
+        self.total += 1
+        if result.get('error'):
+            self.errors += 1
+        path = result.get('path') or 'unknown'
+        self.paths[path] = self.paths.get(path, 0) + 1
+
+    def as_dict(self, gate=None):
+        elapsed = time.perf_counter() - self.started
+        summary = {
+            'total': self.total,
+            'errors': self.errors,
+            'paths': dict(self.paths),
+            'seconds': round(elapsed, 3),
+            'questions_per_second': round(self.total / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+        if gate is not None:
+            summary.update(gate.stats())
+        return summary
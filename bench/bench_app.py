@@ -0,0 +1,276 @@
+# bench/bench_app.py
+# 離線基準測試：所有外部服務都以本機替身取代 (不需要 API 金鑰或任何伺服器)，
+# 以指定的並行數驅動 /api/ask、/api/logs、/api/logs/summary、/api/logs/update、/api/logs/update/bulk，
+# 輸出各情境的吞吐量與 p50 / p95 / p99 延遲。
+#   - Gemini:     bench/fakes.py 的固定延遲 Embedding / 生成
+#   - Qdrant:     qdrant-client 的 :memory: 本機模式，載入 ITKM.txt 的條目
+#   - SQL Server: SQLite 檔案 (pyodbc 風格的替身，log_data 預設 10,000 列)
+#   - MongoDB:    mongomock
+# 伺服器與預設部署相同 (單一 worker、單一執行緒)，在獨立的子行程中執行。
+#
+# 用法 (需先 pip install -r bench/requirements.txt):
+#   python bench/bench_app.py
+#   python bench/bench_app.py --scenarios ask,logs --requests 500 --concurrency 32 --generate-latency 1
+#   python bench/bench_app.py --scenarios ask --vector-backend local                    # 行程內向量索引
+#   python bench/bench_app.py --json bench.json --max-p95 ask=2,logs=0.3,update=0.3   # CI：超過門檻時以狀態 1 結束
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest_ask import percentile, wait_for_port
+
+SCENARIOS = ('ask', 'logs', 'summary', 'update', 'bulk_update')
+
+# 讓 app.py 認為所有後端都已設定；實際的用戶端在 install_fakes() 中替換
+BENCH_ENV = {
+    "GOOGLE_API_KEY": "bench",
+    "QDRANT_URL": "http://bench-qdrant",
+    "MONGO_CONNECTION_STRING": "mongodb://bench-mongo",
+    "GCP_SQL_SERVER": "bench",
+    "GCP_SQL_DATABASE": "bench",
+    "GCP_SQL_USERNAME": "bench",
+    "GCP_SQL_PASSWORD": "bench",
+    "DEBUG_LOG_SAMPLE_RATE": "0",
+    "SLOW_REQUEST_SECONDS": "0",
+    "LOGS_ROWVERSION_COLUMN": "row_version",
+    "QA_WRITER_SPOOL_DIR": os.path.join(tempfile.gettempdir(), "bench_qa_spool"),
+}
+
+LOG_QUERY_VARIANTS = (
+    {},
+    {'status': '進行中'},
+    {'status': '未開始'},
+    {'ticket': 'INC00'},
+    {'date_from': '2025-03-01', 'date_to': '2025-03-31'},
+    {'page_size': '200'},
+    # 表格實際送出的請求：只取需要的欄位
+    {'page_size': '200', 'fields': 'log_id,log_date,ticket_number,status,status_display,log_preview', 'sync': '1'},
+)
+LOG_UPDATE_STATUSES = ('未開始', '進行中', '已完成')
+
+
+# --- 伺服器端 (子行程) ---
+def install_fakes(latency, log_rows):
+    """在 import app 之前替換各後端的用戶端；回傳 app 模組。"""
+    import google.generativeai as genai
+    import mongomock
+    import pymongo
+    import pyodbc
+    import qdrant_client
+
+    import fakes
+    from ingest_knowledge_base import load_chunks
+
+    fakes.FakeGenai(latency).install(genai)
+    qdrant = fakes.InMemoryQdrantClient(latency, load_chunks(os.path.join(ROOT, "ITKM.txt")))
+    qdrant_client.QdrantClient = lambda *args, **kwargs: qdrant
+    pymongo.MongoClient = mongomock.MongoClient
+    pyodbc.connect = fakes.FakeSQLServer(latency, rows=log_rows).connect
+
+    import app as sync_app
+    return sync_app
+
+
+def serve(port, latency, log_rows, threaded):
+    os.environ.update(BENCH_ENV)
+    sync_app = install_fakes(latency, log_rows)
+    # 等所有後端與 BM25 索引就緒後才開始監聽，第一個請求不會被初始化拖慢
+    for name in ('gemini', 'qdrant', 'mongodb'):
+        sync_app.backends.wait(name, 60)
+    deadline = time.monotonic() + 60
+    while sync_app.lexical_index is not None and not sync_app.lexical_index.ready and time.monotonic() < deadline:
+        time.sleep(0.1)
+    while (sync_app.local_vector_index is not None and not sync_app.local_vector_index.ready
+           and time.monotonic() < deadline):
+        time.sleep(0.1)
+
+    from werkzeug.serving import run_simple
+    run_simple('127.0.0.1', port, sync_app.app, threaded=threaded, use_reloader=False)
+
+
+# --- 用戶端 ---
+def build_requests(scenario, count, seed, log_rows, ask_repeat, bulk_size):
+    """預先產生 (method, path, body) 的 list；相同 seed 產生相同的請求序列。"""
+    rng = random.Random(seed)
+    if scenario == 'ask':
+        from ingest_knowledge_base import load_chunks
+        titles = [chunk['title'] for chunk in load_chunks(os.path.join(ROOT, "ITKM.txt"))]
+        repeated = [f"{rng.choice(titles)} 怎麼處理？" for _ in range(10)]
+        requests = []
+        for i in range(count):
+            # ask_repeat 的比例從固定的 10 題中挑選 (會命中答案快取)，其餘每題都不同
+            question = rng.choice(repeated) if rng.random() < ask_repeat else f"{rng.choice(titles)} (bench #{i})"
+            requests.append(('POST', '/api/ask', {'question': question}))
+        return requests
+    if scenario == 'logs':
+        return [
+            ('GET', '/api/logs?' + urllib.parse.urlencode(LOG_QUERY_VARIANTS[i % len(LOG_QUERY_VARIANTS)]), None)
+            for i in range(count)
+        ]
+    if scenario == 'summary':
+        # 儀表板標頭每次載入 / 更新後的請求 (預設範圍，會命中行程內的彙總快取)
+        return [('GET', '/api/logs/summary', None) for _ in range(count)]
+    if scenario == 'bulk_update':
+        # 把同一個單號指派給 bulk_size 筆日誌 (事故分派的情境)
+        return [
+            ('POST', '/api/logs/update/bulk', {
+                'log_ids': rng.sample(range(1, log_rows + 1), bulk_size),
+                'ticket_number': f"BULK{i:06d}",
+                'status': rng.choice(LOG_UPDATE_STATUSES),
+            })
+            for i in range(count)
+        ]
+    return [
+        ('POST', '/api/logs/update', {
+            'log_id': rng.randint(1, log_rows),
+            'ticket_number': f"BENCH{i:06d}",
+            'status': rng.choice(LOG_UPDATE_STATUSES),
+        })
+        for i in range(count)
+    ]
+
+
+def send(port, method, path, body, timeout):
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    req = urllib.request.Request(
+        f"http://127.0.0.1:{port}{path}", data=data, method=method, headers={'Content-Type': 'application/json'}
+    )
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            ok = resp.status == 200
+    except urllib.error.HTTPError as e:
+        e.read()
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def run_scenario(port, requests, concurrency, timeout):
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(send, port, method, path, body, timeout) for method, path, body in requests]
+        for future in futures:
+            try:
+                latency, ok = future.result()
+                latencies.append(latency)
+                errors += 0 if ok else 1
+            except Exception:
+                errors += 1
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': len(requests),
+        'errors': errors,
+        'concurrency': concurrency,
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'p50': round(percentile(latencies, 50), 4),
+        'p95': round(percentile(latencies, 95), 4),
+        'p99': round(percentile(latencies, 99), 4),
+    }
+
+
+def parse_thresholds(text):
+    """'ask=2,logs=0.3' -> {'ask': 2.0, 'logs': 0.3}"""
+    thresholds = {}
+    for item in filter(None, (text or '').split(',')):
+        name, _, value = item.partition('=')
+        thresholds[name.strip()] = float(value)
+    return thresholds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以本機替身離線測量 /api/ask、/api/logs、/api/logs/update 的延遲與吞吐量。")
+    parser.add_argument('--serve', action='store_true', help="只啟動使用替身後端的伺服器 (供其他工具壓測)")
+    parser.add_argument('--port', type=int, default=8095)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200, help="每個情境的請求數")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--log-rows', type=int, default=10000)
+    parser.add_argument('--bulk-size', type=int, default=50, help="bulk_update 情境每個請求更新的列數")
+    parser.add_argument('--ask-repeat', type=float, default=0.0, help="重複問題的比例 (0~1)，用來測量快取命中的情境")
+    parser.add_argument('--threaded', action='store_true', help="伺服器每個請求一條執行緒 (預設與部署相同為單一執行緒)")
+    parser.add_argument('--embed-latency', type=float, default=0.05)
+    parser.add_argument('--search-latency', type=float, default=0.01)
+    parser.add_argument('--generate-latency', type=float, default=0.5)
+    parser.add_argument('--sql-latency', type=float, default=0.005)
+    parser.add_argument('--vector-backend', choices=('qdrant', 'local'), default='qdrant',
+                        help="向量搜尋後端 (local: 行程內的 NumPy 索引，不套用 --search-latency)")
+    parser.add_argument('--json', help="將結果寫成 JSON 檔")
+    parser.add_argument('--max-p95', help="各情境的 p95 上限 (秒)，例如 ask=2,logs=0.3；超過時以狀態 1 結束")
+    args = parser.parse_args()
+
+    import fakes
+    latency = fakes.FakeLatency(args.embed_latency, args.search_latency, args.generate_latency, args.sql_latency)
+    if args.serve:
+        serve(args.port, latency, args.log_rows, args.threaded)
+        return
+
+    scenarios = [name for name in args.scenarios.split(',') if name]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知的情境: {', '.join(sorted(unknown))}")
+
+    cmd = [sys.executable, os.path.abspath(__file__), '--serve', '--port', str(args.port),
+           '--log-rows', str(args.log_rows),
+           '--embed-latency', str(args.embed_latency), '--search-latency', str(args.search_latency),
+           '--generate-latency', str(args.generate_latency), '--sql-latency', str(args.sql_latency)]
+    if args.threaded:
+        cmd.append('--threaded')
+    env = dict(os.environ, **BENCH_ENV, VECTOR_SEARCH_BACKEND=args.vector_backend)
+    server = subprocess.Popen(cmd, env=env, cwd=ROOT,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    results = {}
+    try:
+        wait_for_port(args.port, timeout=120)
+        print(f"模擬延遲: embed {args.embed_latency}s、search {args.search_latency}s、"
+              f"generate {args.generate_latency}s、SQL {args.sql_latency}s；log_data {args.log_rows} 列；"
+              f"向量搜尋: {args.vector_backend}。")
+        print(f"每個情境 {args.requests} 個請求，同時 {args.concurrency} 個連線。\n")
+        print(f"{'情境':<12}{'吞吐量 (req/s)':>16}{'p50 (s)':>10}{'p95 (s)':>10}{'p99 (s)':>10}{'錯誤':>6}")
+        for i, scenario in enumerate(scenarios):
+            requests = build_requests(scenario, args.requests, args.seed + i, args.log_rows, args.ask_repeat,
+                                      args.bulk_size)
+            result = run_scenario(args.port, requests, args.concurrency, args.timeout)
+            results[scenario] = result
+            print(f"{scenario:<12}{result['throughput_rps']:>16.2f}{result['p50']:>10.3f}{result['p95']:>10.3f}"
+                  f"{result['p99']:>10.3f}{result['errors']:>6}")
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'config': vars(args), 'results': results}, f, ensure_ascii=False, indent=2)
+
+    failed = False
+    for scenario, limit in parse_thresholds(args.max_p95).items():
+        result = results.get(scenario)
+        if result is None:
+            continue
+        if result['p95'] > limit or result['errors']:
+            print(f"❌ {scenario}: p95 {result['p95']:.3f}s (上限 {limit}s)，錯誤 {result['errors']} 筆")
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
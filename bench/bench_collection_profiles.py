@@ -0,0 +1,165 @@
+# bench/bench_collection_profiles.py
+# 比較 collection_profiles.py 各設定檔的召回率與查詢延遲：
+# 每個設定檔建立一個暫時的集合，寫入相同的向量，以不同的 hnsw_ef 查詢，
+# 與 NumPy 精確計算 (brute force cosine) 的前 k 名比對得到 recall@k。
+# 量化、on_disk 與 HNSW 參數只在 Qdrant 伺服器上生效 (本機 :memory: 模式一律精確搜尋，只能用來檢查流程)。
+#
+# 用法:
+#   python bench/bench_collection_profiles.py                                   # 合成向量 20,000 筆
+#   python bench/bench_collection_profiles.py --source-collection factory_manuals --queries 300
+#   python bench/bench_collection_profiles.py --profiles default,scalar --hnsw-ef 32,64,128 --json profiles.json
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import collection_profiles
+from loadtest_ask import percentile
+
+UPSERT_BATCH_SIZE = 256
+# 讓小資料量也會建立 HNSW 索引 (Qdrant 預設超過約 20 MB 才建索引)
+INDEXING_THRESHOLD_KB = 1000
+
+
+def normalize(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def synthetic_vectors(count, dimension, seed):
+    """以 count // 50 個中心加上雜訊產生的向量 (模擬 Embedding 的群聚分布)。"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, count // 50), dimension)).astype(np.float32)
+    assignments = rng.integers(0, len(centers), count)
+    return normalize(centers[assignments] + 0.6 * rng.standard_normal((count, dimension)).astype(np.float32))
+
+
+def fetch_collection_vectors(client, collection_name, limit):
+    vectors = []
+    offset = None
+    while len(vectors) < limit:
+        points, offset = client.scroll(collection_name=collection_name, limit=min(1000, limit - len(vectors)),
+                                       offset=offset, with_payload=False, with_vectors=True)
+        vectors.extend(point.vector for point in points)
+        if offset is None:
+            break
+    return normalize(np.asarray(vectors, dtype=np.float32))
+
+
+def make_queries(vectors, count, seed):
+    """從資料中抽樣再加上少量雜訊，模擬「與某個條目相近但不完全相同」的問題。"""
+    rng = np.random.default_rng(seed + 1)
+    picked = vectors[rng.integers(0, len(vectors), count)]
+    return normalize(picked + 0.05 * rng.standard_normal(picked.shape).astype(np.float32))
+
+
+def exact_top_k(vectors, queries, k):
+    scores = queries @ vectors.T
+    top = np.argpartition(-scores, kth=min(k, vectors.shape[0] - 1), axis=1)[:, :k]
+    return [set(row.tolist()) for row in top]
+
+
+def load_collection(client, models, name, profile_name, vectors):
+    if client.collection_exists(name):
+        client.delete_collection(name)
+    client.create_collection(
+        collection_name=name,
+        optimizers_config=models.OptimizersConfigDiff(indexing_threshold=INDEXING_THRESHOLD_KB),
+        **collection_profiles.collection_config(models, profile_name, dimension=vectors.shape[1]),
+    )
+    for start in range(0, len(vectors), UPSERT_BATCH_SIZE):
+        batch = vectors[start:start + UPSERT_BATCH_SIZE]
+        client.upsert(collection_name=name, wait=False, points=models.Batch(
+            ids=list(range(start, start + len(batch))), vectors=batch.tolist()
+        ))
+
+
+def wait_until_indexed(client, name, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        info = client.get_collection(name)
+        if str(info.status).lower().endswith('green') and (info.points_count or 0) > 0:
+            return True
+        time.sleep(0.5)
+    return False
+
+
+def measure(client, name, queries, truth, k, params):
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        results = client.search(collection_name=name, query_vector=query.tolist(), limit=k, search_params=params)
+        latencies.append(time.perf_counter() - started)
+        hits += len(expected & {point.id for point in results})
+    latencies.sort()
+    return {
+        'recall': round(hits / (len(queries) * k), 4),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Qdrant 集合設定檔的召回率 / 延遲基準測試。")
+    parser.add_argument('--url', default=os.getenv("QDRANT_URL", "http://localhost:6333"),
+                        help="Qdrant 位址 (:memory: 只檢查流程，不反映量化與 HNSW)")
+    parser.add_argument('--api-key', default=os.getenv("QDRANT_API_KEY") or None)
+    parser.add_argument('--profiles', default=','.join(collection_profiles.COLLECTION_PROFILES))
+    parser.add_argument('--hnsw-ef', default="16,32,64,128,256", help="要測試的 hnsw_ef (逗號分隔)")
+    parser.add_argument('--vectors', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=10, help="recall@k 的 k")
+    parser.add_argument('--source-collection', help="改用既有集合中的向量 (例如 factory_manuals)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--index-timeout', type=float, default=600)
+    parser.add_argument('--keep', action='store_true', help="保留測試用的集合")
+    parser.add_argument('--json', help="將結果寫成 JSON 檔")
+    args = parser.parse_args()
+
+    from qdrant_client import QdrantClient, models
+    client = QdrantClient(location=args.url) if args.url == ':memory:' else \
+        QdrantClient(url=args.url, api_key=args.api_key, prefer_grpc=False, timeout=120)
+
+    if args.source_collection:
+        vectors = fetch_collection_vectors(client, args.source_collection, args.vectors)
+    else:
+        vectors = synthetic_vectors(args.vectors, collection_profiles.VECTOR_DIMENSION, args.seed)
+    queries = make_queries(vectors, args.queries, args.seed)
+    truth = exact_top_k(vectors, queries, args.limit)
+    ef_values = [int(value) for value in args.hnsw_ef.split(',') if value]
+    print(f"向量 {len(vectors)} 筆 ({vectors.shape[1]} 維)，查詢 {len(queries)} 筆，recall@{args.limit}。\n")
+    print(f"{'設定檔':<12}{'hnsw_ef':>8}{'recall':>9}{'p50 (ms)':>10}{'p95 (ms)':>10}{'向量 RAM (MB)':>15}")
+
+    results = []
+    for profile_name in [name for name in args.profiles.split(',') if name]:
+        profile = collection_profiles.get_profile(profile_name)
+        name = f"bench_profile_{profile_name}"
+        load_collection(client, models, name, profile_name, vectors)
+        if not wait_until_indexed(client, name, args.index_timeout):
+            print(f"🟡 {profile_name}: {args.index_timeout} 秒內未完成索引，結果可能包含未索引的區段。")
+        ram_mb = collection_profiles.estimate_ram_bytes(profile_name, len(vectors), vectors.shape[1]) / 1024 / 1024
+
+        runs = [('exact', collection_profiles.search_params(models, exact=True))] if profile_name == 'default' else []
+        runs += [(ef, collection_profiles.search_params(models, hnsw_ef=ef, oversampling=profile['search']['oversampling']))
+                 for ef in ef_values]
+        for ef, params in runs:
+            result = measure(client, name, queries, truth, args.limit, params)
+            result.update(profile=profile_name, hnsw_ef=ef, ram_mb=round(ram_mb, 1))
+            results.append(result)
+            print(f"{profile_name:<12}{str(ef):>8}{result['recall']:>9.3f}{result['p50_ms']:>10.2f}"
+                  f"{result['p95_ms']:>10.2f}{ram_mb:>15.1f}")
+        if not args.keep:
+            client.delete_collection(name)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'config': vars(args), 'results': results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# bench/bench_log_formatting.py
+# 比較 /api/logs 回應的兩種產生方式 (不含 SQL 查詢)：
+#   legacy:     逐列 Series.apply 格式化 → df.to_dict(orient='records') → json.dumps (與 jsonify 相同的工作)
+#   vectorized: log_formatting.format_log_frame → log_rows_json (orjson，直接讀取各欄位)
+# 以合成的資料表測量，並確認兩者產生的 JSON 內容相同。
+#
+# 用法:
+#   python bench/bench_log_formatting.py                 # 預設 1,000,000 列
+#   python bench/bench_log_formatting.py --rows 200000 --repeat 3
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import log_formatting
+
+SAMPLE_MESSAGES = [
+    "[Mon Jan 01 10:00:00 2025] [error] [client 10.0.0.{i}] File does not exist: /var/www/html/favicon.ico",
+    "[Tue Feb 11 08:12:45 2025] [error] [client 10.0.1.{i}] PHP Fatal error:  Allowed memory size of 134217728 bytes exhausted (tried to allocate 20480 bytes) in /var/www/html/index.php on line {i}",
+    "[warn] short message {i}",
+    "message without brackets {i}",
+    "[notice]   padded content {i}   ",
+]
+
+
+def make_frame(rows, seed=0):
+    """產生與 fetch_log_data_from_gcp_sql 相同欄位的資料表；每次以相同 seed 產生相同的內容。"""
+    rng = np.random.default_rng(seed)
+    kinds = rng.integers(0, len(SAMPLE_MESSAGES) + 1, rows)
+    log_data = [
+        None if kind == len(SAMPLE_MESSAGES) else SAMPLE_MESSAGES[kind].format(i=i)
+        for i, kind in enumerate(kinds)
+    ]
+    statuses = np.array([None, '未開始', '進行中', '已完成'], dtype=object)[rng.integers(0, 4, rows)]
+    tickets = np.array([None, 'INC0012345', 'INC0067890', ''], dtype=object)[rng.integers(0, 4, rows)]
+    log_date = pd.Timestamp('2025-01-01') + pd.to_timedelta(rng.integers(0, 365 * 86400, rows), unit='s')
+    log_date = pd.Series(log_date).where(rng.random(rows) > 0.01)
+    return pd.DataFrame({
+        'log_id': np.arange(rows, 0, -1, dtype=np.int64),
+        'log_date': log_date,
+        'log_data': log_data,
+        'ticket_number': tickets,
+        'status': statuses,
+    })
+
+
+def legacy_format(df):
+    """user-015 之前 app.format_log_rows 的實作。"""
+    def format_status(status):
+        if status == '進行中': return f"⏳ 進行中"
+        elif status == '已完成': return f"✅ 已完成"
+        return f"🔴 未開始"
+
+    def format_log_content(log_string):
+        if not isinstance(log_string, str): return ""
+        last_bracket_pos = log_string.rfind('] ')
+        content_to_display = log_string[last_bracket_pos + 2:].strip() if last_bracket_pos != -1 else log_string
+        return content_to_display[:80] + '...' if len(content_to_display) > 80 else content_to_display
+
+    df['status_display'] = df['status'].apply(format_status)
+    df['log_date'] = pd.to_datetime(df['log_date'], errors='coerce').dt.strftime('%Y-%m-%d %H:%M:%S')
+    df['log_date'] = df['log_date'].fillna('')
+    df['log_preview'] = df['log_data'].apply(format_log_content)
+    df['ticket_number'] = df['ticket_number'].fillna('').astype(str)
+    return df
+
+
+def legacy_serialize(df):
+    return json.dumps({"logs": df.to_dict(orient='records')}, ensure_ascii=False)
+
+
+def vectorized_serialize(df):
+    return log_formatting.json_with_rows(log_formatting.log_rows_json(df))
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def run(rows, repeat):
+    timings = {'legacy': {'format': [], 'serialize': []}, 'vectorized': {'format': [], 'serialize': []}}
+    outputs = {}
+    for _ in range(repeat):
+        for name, format_fn, serialize_fn in (
+            ('legacy', legacy_format, legacy_serialize),
+            ('vectorized', log_formatting.format_log_frame, vectorized_serialize),
+        ):
+            df = make_frame(rows)
+            df, format_seconds = timed(format_fn, df)
+            body, serialize_seconds = timed(serialize_fn, df)
+            timings[name]['format'].append(format_seconds)
+            timings[name]['serialize'].append(serialize_seconds)
+            outputs[name] = body
+    return timings, outputs
+
+
+def same_rows(legacy_body, vectorized_body):
+    legacy_rows = json.loads(legacy_body)['logs']
+    vectorized_rows = json.loads(vectorized_body)['logs']
+    if len(legacy_rows) != len(vectorized_rows):
+        return False
+    for legacy_row, vectorized_row in zip(legacy_rows, vectorized_rows):
+        # legacy 的 NaN (log_data 為 NULL) 在 json.dumps 中輸出為 NaN，新版輸出 null
+        legacy_row = {k: (None if isinstance(v, float) and v != v else v) for k, v in legacy_row.items()}
+        if legacy_row != vectorized_row:
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/api/logs 格式化與 JSON 序列化的微基準測試。")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"pandas {pd.__version__}，字串欄位型別: {make_frame(10)['log_data'].dtype}")
+    print(f"共 {args.rows:,} 列，重複 {args.repeat} 次 (取最小值)。\n")
+    timings, outputs = run(args.rows, args.repeat)
+    print(f"{'方式':<12}{'格式化 (s)':>12}{'序列化 (s)':>12}{'合計 (s)':>10}")
+    totals = {}
+    for name, result in timings.items():
+        format_seconds = min(result['format'])
+        serialize_seconds = min(result['serialize'])
+        totals[name] = format_seconds + serialize_seconds
+        print(f"{name:<12}{format_seconds:>12.3f}{serialize_seconds:>12.3f}{totals[name]:>10.3f}")
+    print(f"\n加速: {totals['legacy'] / totals['vectorized']:.2f}x")
+    print(f"輸出內容一致: {same_rows(outputs['legacy'], outputs['vectorized'])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+# bench/fakes.py
+# 壓力測試用的假後端：以固定延遲模擬 Gemini Embedding / 生成與 Qdrant 搜尋，
+# 同時提供同步與 asyncio 版本，讓同步與非同步服務模式可以在相同條件下比較。
+# 另外提供離線基準測試 (bench_app.py) 用的本機替身：
+#   - InMemoryQdrantClient: qdrant-client 的 :memory: 本機模式，載入 ITKM.txt 的條目，搜尋前加上固定延遲。
+#   - FakeSQLServer:        以 SQLite 檔案模擬 log_data，提供 pyodbc 風格的連線 (改寫 app.py 用到的 SQL Server 語法)。
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+
+VECTOR_DIMENSION = 768
+
+
+def fake_vector(text):
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:4], 'little')
+    return np.random.default_rng(seed).random(VECTOR_DIMENSION, dtype=np.float32).tolist()
+
+
+class FakeLatency:
+    def __init__(self, embed=0.1, search=0.03, generate=1.0, sql=0.005):
+        self.embed = embed
+        self.search = search
+        self.generate = generate
+        self.sql = sql
+
+
+class FakeGenai:
+    """取代 google.generativeai 模組中的 embed_content / embed_content_async。"""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def _result(self, content):
+        if isinstance(content, list):
+            return {'embedding': [fake_vector(text) for text in content]}
+        return {'embedding': fake_vector(content)}
+
+    def embed_content(self, model, content, task_type=None, **kwargs):
+        time.sleep(self.latency.embed)
+        return self._result(content)
+
+    async def embed_content_async(self, model, content, task_type=None, **kwargs):
+        await asyncio.sleep(self.latency.embed)
+        return self._result(content)
+
+    def install(self, genai):
+        """替換 genai 模組中 app.py 用到的函式 (需在 import app 之前呼叫)。"""
+        genai.configure = lambda **kwargs: None
+        genai.get_model = lambda name: SimpleNamespace(name=name)
+        genai.GenerativeModel = lambda name, **kwargs: FakeGenerativeModel(self.latency)
+        genai.embed_content = self.embed_content
+        genai.embed_content_async = self.embed_content_async
+
+
+class FakeGenerativeModel:
+    def __init__(self, latency, answer="這是壓力測試用的固定回答。"):
+        self.latency = latency
+        self.answer = answer
+
+    def _response(self):
+        return SimpleNamespace(text=self.answer, usage_metadata=None)
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        time.sleep(self.latency.generate)
+        return iter([self._response()]) if stream else self._response()
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        await asyncio.sleep(self.latency.generate)
+        if not stream:
+            return self._response()
+
+        async def chunks():
+            yield self._response()
+        return chunks()
+
+
+def _fake_hits(limit):
+    return [
+        SimpleNamespace(id=i, score=0.9 - i * 0.01, payload={'text': f"#fake entry {i}\n建議 重新啟動服務。"})
+        for i in range(min(limit, 3))
+    ]
+
+
+class FakeQdrantClient:
+    def __init__(self, latency, *args, **kwargs):
+        self.latency = latency
+
+    def search(self, collection_name, query_vector, limit=10, **kwargs):
+        time.sleep(self.latency.search)
+        return _fake_hits(limit)
+
+    def get_collections(self):
+        return SimpleNamespace(collections=[])
+
+
+class FakeAsyncQdrantClient:
+    def __init__(self, latency, *args, **kwargs):
+        self.latency = latency
+
+    async def search(self, collection_name, query_vector, limit=10, **kwargs):
+        await asyncio.sleep(self.latency.search)
+        return _fake_hits(limit)
+
+    async def close(self):
+        pass
+
+
+# --- 離線基準測試用的本機替身 ---
+def InMemoryQdrantClient(latency, chunks, collection_name='factory_manuals'):
+    """
+    qdrant-client 的 :memory: 本機模式 (真正的搜尋、scroll 與 payload)，每次搜尋前加上 latency.search 的延遲。
+    chunks 為 ingest_knowledge_base.load_chunks() 的結果。
+    """
+    from qdrant_client import QdrantClient, models
+    from ingest_knowledge_base import build_points
+
+    class _Client(QdrantClient):
+        def search(self, *args, **kwargs):
+            time.sleep(latency.search)
+            return super().search(*args, **kwargs)
+
+        def search_batch(self, *args, **kwargs):
+            time.sleep(latency.search)
+            return super().search_batch(*args, **kwargs)
+
+    client = _Client(":memory:")
+    client.create_collection(
+        collection_name=collection_name,
+        vectors_config=models.VectorParams(size=VECTOR_DIMENSION, distance=models.Distance.COSINE),
+    )
+    points = build_points(models, chunks, [fake_vector(chunk['text']) for chunk in chunks])
+    client.upsert(collection_name=collection_name, points=points)
+    return client
+
+
+LOG_STATUS_VALUES = (None, '未開始', '進行中', '已完成')
+_TOP_RE = re.compile(r"SELECT TOP \(\?\)", re.IGNORECASE)
+# /api/logs/summary 的日期分組 -> SQLite 的日期函式
+_DATE_REWRITES = (
+    (re.compile(r"CAST\((\w+) AS DATE\)", re.IGNORECASE), r"date(\1)"),
+    (re.compile(r"DATEADD\(hour, DATEDIFF\(hour, 0, (\w+)\), 0\)", re.IGNORECASE), r"strftime('%Y-%m-%d %H:00:00', \1)"),
+)
+# 分頁游標的 CAST(? AS DATETIME)：SQLite 的 CAST 會把時間字串轉成數字，直接比較參數
+_CURSOR_REWRITES = (
+    (re.compile(r"CAST\(\? AS (?:SMALL)?DATETIME2?(?:\(\d\))?\)", re.IGNORECASE), "?"),
+)
+# rowversion (BINARY(8)) <-> BIGINT 的轉換；SQLite 的 row_version 直接是整數
+_ROWVERSION_REWRITES = (
+    (re.compile(r"CONVERT\(BIGINT, (MAX\(\w+\))\)", re.IGNORECASE), r"\1"),
+    (re.compile(r"CONVERT\(BINARY\(8\), CAST\(\? AS BIGINT\)\)", re.IGNORECASE), "?"),
+)
+
+
+def _to_sqlite(query, params):
+    """
+    把 SELECT TOP (?) 改寫成 LIMIT ? (參數移到最後)、日期分組改用 SQLite 的函式、游標與 rowversion 的轉換去掉；
+    其他語法 SQLite 都能直接執行。
+    """
+    for pattern, replacement in _DATE_REWRITES + _CURSOR_REWRITES + _ROWVERSION_REWRITES:
+        query = pattern.sub(replacement, query)
+    if _TOP_RE.search(query):
+        query = _TOP_RE.sub("SELECT", query).rstrip().rstrip(';') + " LIMIT ?;"
+        params = list(params[1:]) + [params[0]]
+    return query, params
+
+
+class _SQLServerCursor:
+    def __init__(self, raw, latency):
+        self._raw = raw
+        self._latency = latency
+
+    def execute(self, query, *params):
+        # pyodbc 同時接受 execute(sql, a, b) 與 execute(sql, [a, b])
+        if len(params) == 1 and isinstance(params[0], (list, tuple)):
+            params = params[0]
+        time.sleep(self._latency.sql)
+        self._raw.execute(*_to_sqlite(query, list(params)))
+        return self
+
+    def executemany(self, query, rows):
+        # 與 fast_executemany 相同：所有參數一次送出，只算一次往返的延遲
+        time.sleep(self._latency.sql)
+        self._raw.executemany(query, rows)
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class _SQLServerConnection:
+    def __init__(self, raw, latency):
+        self._raw = raw
+        self._latency = latency
+
+    def cursor(self):
+        return _SQLServerCursor(self._raw.cursor(), self._latency)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class FakeSQLServer:
+    """以 SQLite 檔案模擬 SQL Server 上的 log_data 表；connect() 的介面與 pyodbc.connect 相同。"""
+
+    def __init__(self, latency, rows=10000, seed=0, path=None):
+        self.latency = latency
+        self.path = path or os.path.join(tempfile.mkdtemp(prefix="bench_sql_"), "log_data.sqlite3")
+        sqlite3.register_adapter(datetime, lambda value: value.isoformat(sep=' '))
+        sqlite3.register_converter("TIMESTAMP", lambda raw: datetime.fromisoformat(raw.decode('utf-8')))
+        self._seed(rows, seed)
+
+    def _open(self):
+        raw = sqlite3.connect(self.path, timeout=30, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+        return raw
+
+    def _seed(self, rows, seed):
+        rng = np.random.default_rng(seed)
+        start = datetime(2025, 1, 1)
+        records = []
+        for log_id in range(1, rows + 1):
+            log_date = start + timedelta(seconds=int(rng.integers(0, 365 * 86400)))
+            status = LOG_STATUS_VALUES[int(rng.integers(0, len(LOG_STATUS_VALUES)))]
+            ticket = f"INC{int(rng.integers(0, 10 ** 7)):07d}" if status else None
+            message = (f"[{log_date:%a %b %d %H:%M:%S %Y}] [error] [client 10.0.{log_id % 256}.{log_id % 7}] "
+                       f"File does not exist: /var/www/html/page_{log_id}.html")
+            records.append((log_id, log_date, message, ticket, status, log_id))
+        raw = self._open()
+        raw.execute("PRAGMA journal_mode=WAL;")
+        raw.execute("DROP TABLE IF EXISTS log_data;")
+        raw.execute(
+            "CREATE TABLE log_data (log_id INTEGER PRIMARY KEY, log_date TIMESTAMP, log_data TEXT, "
+            "ticket_number TEXT, status TEXT, row_version INTEGER);"
+        )
+        raw.execute("CREATE INDEX ix_log_data_date ON log_data (log_date DESC, log_id DESC);")
+        raw.execute("CREATE INDEX ix_log_data_status ON log_data (status, log_date, ticket_number);")
+        raw.execute("CREATE INDEX ix_log_data_row_version ON log_data (row_version);")
+        # SQL Server rowversion 的替身：每次寫入都取目前最大值 + 1
+        raw.execute(
+            "CREATE TRIGGER trg_log_data_row_version AFTER UPDATE OF log_data, ticket_number, status ON log_data "
+            "BEGIN UPDATE log_data SET row_version = (SELECT MAX(row_version) + 1 FROM log_data) "
+            "WHERE log_id = NEW.log_id; END;"
+        )
+        raw.executemany("INSERT INTO log_data VALUES (?, ?, ?, ?, ?, ?);", records)
+        raw.commit()
+        raw.close()
+
+    def connect(self, *args, **kwargs):
+        return _SQLServerConnection(self._open(), self.latency)
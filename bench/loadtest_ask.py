@@ -0,0 +1,159 @@
+# bench/loadtest_ask.py
+# 比較 /api/ask 在「同步 Flask (單一 worker、單一執行緒，與 Dockerfile 預設相同)」與
+# 「asyncio 服務模式 (asgi_app)」下的延遲與吞吐量。所有外部服務都以 bench/fakes.py 的固定延遲假後端取代。
+#
+# 用法:
+#   python bench/loadtest_ask.py                              # 兩種模式各跑一次並列出比較
+#   python bench/loadtest_ask.py --requests 400 --concurrency 200 --generate-latency 2
+#   python bench/loadtest_ask.py --serve async --port 8091    # 只啟動其中一種伺服器 (供其他工具壓測)
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# 讓 app.py 匯入時不會連到真正的後端，且每個問題都完整走過 embed → search → generate
+BENCH_ENV = {
+    "QDRANT_URL": "http://127.0.0.1:1",
+    "GOOGLE_API_KEY": "",
+    "MONGO_CONNECTION_STRING": "",
+    "ANSWER_CACHE_ENABLED": "false",
+    "EMBEDDING_CACHE_ENABLED": "false",
+}
+
+
+def install_fakes(latency):
+    import fakes
+    import app as sync_app
+
+    fake_genai = fakes.FakeGenai(latency)
+    sync_app.genai.embed_content = fake_genai.embed_content
+    sync_app.genai.embed_content_async = fake_genai.embed_content_async
+    sync_app.gemini_model = fakes.FakeGenerativeModel(latency)
+    sync_app.qdrant_client = fakes.FakeQdrantClient(latency)
+    sync_app.is_gemini_configured = True
+    sync_app.is_qdrant_configured = True
+    return sync_app
+
+
+def serve(mode, port, latency):
+    sync_app = install_fakes(latency)
+    if mode == 'sync':
+        from werkzeug.serving import run_simple
+        run_simple('127.0.0.1', port, sync_app.app, threaded=False, use_reloader=False)
+    else:
+        import uvicorn
+        import fakes
+        import asgi_app
+        asgi_app.AsyncQdrantClient = lambda *args, **kwargs: fakes.FakeAsyncQdrantClient(latency)
+        uvicorn.run(asgi_app.app, host='127.0.0.1', port=port, log_level='warning')
+
+
+def wait_for_port(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(('127.0.0.1', port)) == 0:
+                return
+        time.sleep(0.2)
+    raise RuntimeError(f"伺服器在 {timeout} 秒內沒有開始監聽 port {port}")
+
+
+def ask_once(port, i, timeout):
+    body = json.dumps({"question": f"壓力測試問題 #{i}"}).encode('utf-8')
+    req = urllib.request.Request(
+        f"http://127.0.0.1:{port}/api/ask", data=body, headers={'Content-Type': 'application/json'}
+    )
+    start = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        resp.read()
+        ok = resp.status == 200
+    return time.perf_counter() - start, ok
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+def run_load(port, total_requests, concurrency, timeout):
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(ask_once, port, i, timeout) for i in range(total_requests)]
+        for future in futures:
+            try:
+                latency, ok = future.result()
+                latencies.append(latency)
+                errors += 0 if ok else 1
+            except Exception:
+                errors += 1
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': total_requests,
+        'errors': errors,
+        'elapsed_seconds': elapsed,
+        'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+    }
+
+
+def run_mode(mode, args):
+    port = args.port + (0 if mode == 'sync' else 1)
+    env = dict(os.environ, **BENCH_ENV)
+    cmd = [sys.executable, os.path.abspath(__file__), '--serve', mode, '--port', str(port),
+           '--embed-latency', str(args.embed_latency), '--search-latency', str(args.search_latency),
+           '--generate-latency', str(args.generate_latency)]
+    server = subprocess.Popen(cmd, env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        return run_load(port, args.requests, args.concurrency, args.timeout)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/api/ask 同步與 asyncio 服務模式的壓力測試比較。")
+    parser.add_argument('--serve', choices=['sync', 'async'], help="只啟動指定模式的伺服器")
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--embed-latency', type=float, default=0.1)
+    parser.add_argument('--search-latency', type=float, default=0.03)
+    parser.add_argument('--generate-latency', type=float, default=1.0)
+    parser.add_argument('--modes', default='sync,async')
+    args = parser.parse_args()
+
+    import fakes
+    latency = fakes.FakeLatency(args.embed_latency, args.search_latency, args.generate_latency)
+    if args.serve:
+        os.environ.update(BENCH_ENV)
+        serve(args.serve, args.port, latency)
+        return
+
+    print(f"每個問題的模擬延遲: embed {args.embed_latency}s + search {args.search_latency}s + generate {args.generate_latency}s")
+    print(f"共 {args.requests} 個請求，同時 {args.concurrency} 個連線。\n")
+    print(f"{'模式':<8}{'吞吐量 (req/s)':>16}{'p50 (s)':>10}{'p95 (s)':>10}{'p99 (s)':>10}{'錯誤':>6}")
+    for mode in args.modes.split(','):
+        result = run_mode(mode, args)
+        print(f"{mode:<8}{result['throughput_rps']:>16.2f}{result['p50']:>10.2f}{result['p95']:>10.2f}"
+              f"{result['p99']:>10.2f}{result['errors']:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# collection_profiles.py
+# factory_manuals 集合的儲存設定檔 (建立集合時使用) 與查詢時的搜尋參數。
+# 向量全部放在 RAM 是最大的記憶體成本；量化後只有壓縮過的向量常駐 RAM，原始 float32 向量放在磁碟，
+# 搜尋時先以量化向量找出 limit × oversampling 個候選，再以原始向量重新計分 (rescore)。
+#
+# 每個 768 維向量在 RAM 中約佔：
+#   default 3072 bytes (float32)、scalar 768 bytes (int8)、binary 96 bytes (1 bit/維)，另加 HNSW 圖。
+VECTOR_DIMENSION = 768  # Gemini 'text-embedding-004' 的向量維度
+
+# 各設定檔：
+#   quantization: None / 'scalar' (int8) / 'binary'
+#   on_disk:      原始向量是否放在磁碟 (memmap)
+#   hnsw_m / hnsw_ef_construct / hnsw_on_disk: HNSW 圖的參數 (None 表示 Qdrant 預設 m=16、ef_construct=100)
+#   on_disk_payload: payload (條目原文) 是否放在磁碟
+#   search:       建議搭配的查詢參數 (QDRANT_HNSW_EF / QDRANT_QUANTIZATION_OVERSAMPLING)
+COLLECTION_PROFILES = {
+    'default': {
+        'description': "float32 向量與 HNSW 都放在 RAM (原本 reset_collection.py 的設定)",
+        'quantization': None,
+        'on_disk': False,
+        'hnsw_m': None,
+        'hnsw_ef_construct': None,
+        'hnsw_on_disk': False,
+        'on_disk_payload': False,
+        'search': {'hnsw_ef': None, 'oversampling': None},
+    },
+    'scalar': {
+        'description': "int8 量化向量常駐 RAM，原始向量放磁碟並用於 rescore (RAM 約為 1/4)",
+        'quantization': 'scalar',
+        'on_disk': True,
+        'hnsw_m': 16,
+        'hnsw_ef_construct': 128,
+        'hnsw_on_disk': False,
+        'on_disk_payload': True,
+        'search': {'hnsw_ef': 128, 'oversampling': 2.0},
+    },
+    'binary': {
+        'description': "1 bit/維的二元量化常駐 RAM，原始向量放磁碟 (RAM 約為 1/32，需要較大的 oversampling)",
+        'quantization': 'binary',
+        'on_disk': True,
+        'hnsw_m': 16,
+        'hnsw_ef_construct': 128,
+        'hnsw_on_disk': False,
+        'on_disk_payload': True,
+        'search': {'hnsw_ef': 128, 'oversampling': 3.0},
+    },
+    'low_memory': {
+        'description': "int8 量化，原始向量、HNSW 圖與 payload 都放磁碟，較小的圖 (m=8)",
+        'quantization': 'scalar',
+        'on_disk': True,
+        'hnsw_m': 8,
+        'hnsw_ef_construct': 64,
+        'hnsw_on_disk': True,
+        'on_disk_payload': True,
+        'search': {'hnsw_ef': 96, 'oversampling': 2.0},
+    },
+}
+
+# 建立在 payload 上的索引 (欄位 -> 型別)；依來源、種類、章節過濾或比對內容雜湊時不必掃描整個集合
+PAYLOAD_INDEXES = {
+    'kind': 'keyword',
+    'section': 'keyword',
+    'source': 'keyword',
+    'content_hash': 'keyword',
+}
+
+
+def get_profile(name):
+    if name not in COLLECTION_PROFILES:
+        raise ValueError(f"未知的集合設定檔 '{name}'，可用: {', '.join(COLLECTION_PROFILES)}")
+    return COLLECTION_PROFILES[name]
+
+
+def _quantization_config(models, profile):
+    if profile['quantization'] == 'scalar':
+        return models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(
+            type=models.ScalarType.INT8, quantile=0.99, always_ram=True
+        ))
+    if profile['quantization'] == 'binary':
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+    return None
+
+
+def _hnsw_config(models, profile):
+    return models.HnswConfigDiff(
+        m=profile['hnsw_m'], ef_construct=profile['hnsw_ef_construct'], on_disk=profile['hnsw_on_disk']
+    )
+
+
+def collection_config(models, profile_name, dimension=VECTOR_DIMENSION):
+    """create_collection() 的參數 (不含 collection_name)。"""
+    profile = get_profile(profile_name)
+    return dict(
+        vectors_config=models.VectorParams(
+            size=dimension, distance=models.Distance.COSINE, on_disk=profile['on_disk']
+        ),
+        hnsw_config=_hnsw_config(models, profile),
+        quantization_config=_quantization_config(models, profile),
+        on_disk_payload=profile['on_disk_payload'],
+    )
+
+
+def update_config(models, profile_name):
+    """
+    update_collection() 的參數：把既有集合改成指定的設定檔 (Qdrant 會在背景重建索引與量化資料)。
+    on_disk_payload 無法在建立後修改，需以 ingest_knowledge_base.py --rebuild 重建集合。
+    """
+    profile = get_profile(profile_name)
+    quantization = _quantization_config(models, profile)
+    return dict(
+        vectors_config={"": models.VectorParamsDiff(on_disk=profile['on_disk'])},
+        hnsw_config=_hnsw_config(models, profile),
+        quantization_config=quantization if quantization is not None else models.Disabled.DISABLED,
+    )
+
+
+def create_payload_indexes(client, models, collection_name):
+    for field_name, schema in PAYLOAD_INDEXES.items():
+        client.create_payload_index(
+            collection_name=collection_name, field_name=field_name,
+            field_schema=models.PayloadSchemaType(schema), wait=True
+        )
+
+
+def create_collection(client, models, collection_name, profile_name):
+    """以設定檔建立集合並建立 payload 索引。"""
+    client.create_collection(collection_name=collection_name, **collection_config(models, profile_name))
+    create_payload_indexes(client, models, collection_name)
+
+
+def search_params(models, hnsw_ef=None, exact=False, rescore=True, oversampling=None):
+    """
+    查詢時的搜尋參數：hnsw_ef 越大召回率越高但越慢 (None 表示使用集合的 ef_construct)；
+    rescore / oversampling 只對量化集合有效，未量化的集合會忽略。
+    """
+    return models.SearchParams(
+        hnsw_ef=hnsw_ef or None,
+        exact=exact,
+        quantization=models.QuantizationSearchParams(rescore=rescore, oversampling=oversampling or None),
+    )
+
+
+def estimate_ram_bytes(profile_name, vectors, dimension=VECTOR_DIMENSION):
+    """向量資料常駐 RAM 的估計值 (不含 HNSW 圖與 payload)。"""
+    profile = get_profile(profile_name)
+    per_vector = 0 if profile['on_disk'] else dimension * 4
+    if profile['quantization'] == 'scalar':
+        per_vector += dimension
+    elif profile['quantization'] == 'binary':
+        per_vector += (dimension + 7) // 8
+    return per_vector * vectors
@@ -0,0 +1,181 @@
+# context_budget.py
+# Qdrant 搜尋結果送進 prompt 前的後處理：
+#   1. 分數落差截斷：cosine 分數相對第一名掉太多、或相鄰兩筆落差過大時，後面的結果一律捨棄。
+#   2. MMR 去重：依「相關度 - 與已選內容的重複度」挑選，近乎重複的區塊只保留一份。
+#      與 BM25 融合過的結果以融合分數作為相關度 (排序)，分數門檻仍只比較 cosine 分數。
+#   3. Token 預算：依估算的 token 數把區塊裝進上下文，超過上限就停止。
+# 每一階段保留 / 捨棄的數量都會記錄下來，方便在召回率與延遲之間調整參數。
+import re
+import threading
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def estimate_tokens(text):
+    """粗估 token 數：中日韓文字約 1 字 1 token，其餘約 4 個字元 1 token。"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def dense_score(hit):
+    """搜尋結果的 cosine 分數：BM25 融合後的結果 (lexical_index.FusedHit) 取 dense_score，Qdrant 結果取 score。"""
+    return getattr(hit, 'dense_score', hit.score)
+
+
+def rank_score(hit):
+    """排序用的分數：BM25 融合後的結果取 fused_score，Qdrant 結果取 score。"""
+    return getattr(hit, 'fused_score', hit.score)
+
+
+def extractive_candidate(hits, min_score, min_margin):
+    """
+    cosine 分數最高的結果 >= min_score、且領先第二名 >= min_margin 時回傳該結果，否則回傳 None。
+    門檻比的是 cosine 分數而不是融合分數：融合分數會因沒有字詞重疊而下降，
+    BM25 最高的區塊也一定會多加一段，無法對應「cosine >= 門檻」的設定。
+    """
+    if not hits:
+        return None
+    ranked = sorted(hits, key=dense_score, reverse=True)
+    top_score = dense_score(ranked[0])
+    runner_up = dense_score(ranked[1]) if len(ranked) > 1 else 0.0
+    if top_score < min_score or top_score - runner_up < min_margin:
+        return None
+    return ranked[0]
+
+
+def _shingles(text, size=3):
+    text = _SPACE_RE.sub(" ", text.lower()).strip()
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ContextBuilder:
+    """
+    執行緒安全；build() 回傳 (保留的搜尋結果, 本次統計)，stats() 回傳累計統計。
+
+    max_score_gap:      依 cosine 分數排序後，相鄰兩筆分數差超過此值時截斷。
+    min_relative_score: cosine 分數低於「第一名分數 × 此比例」的結果捨棄。
+    mmr_lambda:         MMR 中相關度的權重 (1.0 = 只看分數，不考慮重複)。
+    duplicate_threshold: 與已選區塊的文字相似度 (3-gram Jaccard) 高於此值時視為重複並捨棄。
+    max_context_tokens: 上下文的 token 預算；第一個區塊本身就超過時會截斷該區塊。
+    max_chunks:         最多保留的區塊數。
+    """
+
+    def __init__(self, max_score_gap=0.08, min_relative_score=0.8, mmr_lambda=0.7,
+                 duplicate_threshold=0.85, max_context_tokens=3000, max_chunks=8):
+        self.max_score_gap = max_score_gap
+        self.min_relative_score = min_relative_score
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_threshold = duplicate_threshold
+        self.max_context_tokens = max_context_tokens
+        self.max_chunks = max_chunks
+
+        self._lock = threading.Lock()
+        self._totals = {
+            'requests': 0,
+            'candidates': 0,
+            'dropped_score_gap': 0,
+            'dropped_duplicate': 0,
+            'dropped_budget': 0,
+            'retained': 0,
+            'context_tokens': 0,
+        }
+
+    # --- 1. 分數落差截斷 ---
+    def cut_by_score_gap(self, hits):
+        """以 cosine 分數決定保留哪些結果，回傳時依排序分數 (融合分數) 由高到低排列。"""
+        if not hits:
+            return []
+        by_score = sorted(hits, key=dense_score, reverse=True)
+        floor = dense_score(by_score[0]) * self.min_relative_score
+        kept = [by_score[0]]
+        for prev, hit in zip(by_score, by_score[1:]):
+            if dense_score(hit) < floor or dense_score(prev) - dense_score(hit) > self.max_score_gap:
+                break
+            kept.append(hit)
+        return sorted(kept, key=rank_score, reverse=True)
+
+    # --- 2. MMR 去重 ---
+    def select_mmr(self, hits):
+        """回傳 (依 MMR 順序挑出的結果, 因重複而捨棄的數量)。"""
+        candidates = [(hit, _shingles(hit.payload.get('text', ''))) for hit in hits]
+        selected = []
+        duplicates = 0
+        while candidates:
+            best_idx, best_value = None, None
+            for idx, (hit, shingles) in enumerate(candidates):
+                redundancy = max((_jaccard(shingles, s) for _, s in selected), default=0.0)
+                value = self.mmr_lambda * rank_score(hit) - (1 - self.mmr_lambda) * redundancy
+                if best_value is None or value > best_value:
+                    best_idx, best_value = idx, value
+            hit, shingles = candidates.pop(best_idx)
+            if any(_jaccard(shingles, s) >= self.duplicate_threshold for _, s in selected):
+                duplicates += 1
+                continue
+            selected.append((hit, shingles))
+        return [hit for hit, _ in selected], duplicates
+
+    # --- 3. Token 預算 ---
+    def pack(self, hits):
+        """回傳 (放得進預算的 [(hit, text)], 使用的 token 數)。"""
+        packed = []
+        used = 0
+        for hit in hits[:self.max_chunks]:
+            text = hit.payload.get('text', '錯誤：找不到文字內容')
+            tokens = estimate_tokens(text)
+            if used + tokens > self.max_context_tokens:
+                if packed:
+                    break
+                # 最相關的區塊本身就超過預算時，截斷而不是整個捨棄
+                text = text[:self.max_context_tokens]
+                while estimate_tokens(text) > self.max_context_tokens:
+                    text = text[:int(len(text) * 0.9)]
+                tokens = estimate_tokens(text)
+            packed.append((hit, text))
+            used += tokens
+        return packed, used
+
+    def build(self, hits):
+        """依序執行三個階段；回傳 ([(hit, 要放進上下文的文字)], 本次統計 dict)。"""
+        cut = self.cut_by_score_gap(hits)
+        deduped, duplicates = self.select_mmr(cut)
+        packed, used = self.pack(deduped)
+        report = {
+            'candidates': len(hits),
+            'dropped_score_gap': len(hits) - len(cut),
+            'dropped_duplicate': duplicates,
+            'dropped_budget': len(deduped) - len(packed),
+            'retained': len(packed),
+            'context_tokens': used,
+        }
+        with self._lock:
+            self._totals['requests'] += 1
+            for key, value in report.items():
+                self._totals[key] += value
+        return packed, report
+
+    def stats(self):
+        with self._lock:
+            totals = dict(self._totals)
+        requests = totals['requests']
+        totals['avg_retained'] = round(totals['retained'] / requests, 2) if requests else 0.0
+        totals['avg_context_tokens'] = round(totals['context_tokens'] / requests, 1) if requests else 0.0
+        totals['config'] = {
+            'max_score_gap': self.max_score_gap,
+            'min_relative_score': self.min_relative_score,
+            'mmr_lambda': self.mmr_lambda,
+            'duplicate_threshold': self.duplicate_threshold,
+            'max_context_tokens': self.max_context_tokens,
+            'max_chunks': self.max_chunks,
+        }
+        return totals
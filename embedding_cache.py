@@ -0,0 +1,178 @@
+# embedding_cache.py
+# genai.embed_content 前的 Embedding 快取：以 (模型名稱, task_type, 正規化文字) 為鍵，
+# 記憶體內為 LRU，可選擇再加一層 MongoDB 持久層。
+# 向量一律以 float32 numpy 陣列保存 (768 維約 3KB)，而不是 Python float list (約 25KB)。
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from answer_cache import normalize_question
+
+
+def embedding_cache_key(model, task_type, text):
+    raw = f"{model}\x00{task_type}\x00{normalize_question(text)}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _as_float32(vector):
+    arr = np.asarray(vector, dtype=np.float32)
+    arr.setflags(write=False)  # 快取中的向量共用同一份記憶體，避免被呼叫端意外修改
+    return arr
+
+
+class MongoEmbeddingStore:
+    """以 MongoDB 集合保存向量；向量以 float32 原始位元組 (BSON binary) 存放。"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get_many(self, keys):
+        docs = self.collection.find({'_id': {'$in': list(keys)}})
+        return {doc['_id']: np.frombuffer(doc['vector'], dtype=np.float32) for doc in docs}
+
+    def put_many(self, items):
+        from pymongo import UpdateOne
+        ops = [
+            UpdateOne(
+                {'_id': key},
+                {'$set': {
+                    'model': model,
+                    'task_type': task_type,
+                    'dim': int(vector.shape[0]),
+                    'vector': vector.tobytes(),
+                    'created_at': time.time(),
+                }},
+                upsert=True,
+            )
+            for key, model, task_type, vector in items
+        ]
+        if ops:
+            self.collection.bulk_write(ops, ordered=False)
+
+
+class EmbeddingCache:
+    """
+    執行緒安全的 Embedding 快取。
+
+    embed_fn(model, texts, task_type) 需回傳與 texts 等長的向量 list；
+    embed() 只會把未命中的文字一次送出，命中的直接回傳快取中的 float32 陣列。
+    """
+
+    def __init__(self, embed_fn, max_entries=5000, persistent_store=None):
+        self.embed_fn = embed_fn
+        self.max_entries = max_entries
+        self.persistent_store = persistent_store
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+        self._memory_hits = 0
+        self._persistent_hits = 0
+        self._misses = 0
+        self._embed_calls = 0
+        self._persistent_errors = 0
+
+    def _store(self, key, vector):
+        # 呼叫端需持有 self._lock
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _lookup(self, model, texts, task_type):
+        """查記憶體與持久層；回傳 (results, missing)，missing 為 key -> texts 中的索引 list。"""
+        keys = [embedding_cache_key(model, task_type, text) for text in texts]
+        results = [None] * len(texts)
+        missing = {}  # 相同的鍵只送一次
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    self._memory_hits += 1
+                    results[i] = vector
+                else:
+                    missing.setdefault(key, []).append(i)
+
+        if missing and self.persistent_store is not None:
+            try:
+                found = self.persistent_store.get_many(missing.keys())
+            except Exception as e:
+                print(f"🟡 讀取 Embedding 持久快取失敗: {e}")
+                self._persistent_errors += 1
+                found = {}
+            with self._lock:
+                for key, vector in found.items():
+                    vector = _as_float32(vector)
+                    self._store(key, vector)
+                    for i in missing.pop(key):
+                        results[i] = vector
+                        self._persistent_hits += 1
+        return results, missing
+
+    def _fill(self, model, task_type, results, missing, vectors):
+        """將新取得的向量放入快取 (含持久層) 並填入 results。"""
+        fresh = []
+        with self._lock:
+            self._embed_calls += 1
+            for key, vector in zip(missing.keys(), vectors):
+                vector = _as_float32(vector)
+                self._store(key, vector)
+                fresh.append((key, model, task_type, vector))
+                for i in missing[key]:
+                    results[i] = vector
+                    self._misses += 1
+        if self.persistent_store is not None:
+            try:
+                self.persistent_store.put_many(fresh)
+            except Exception as e:
+                print(f"🟡 寫入 Embedding 持久快取失敗: {e}")
+                self._persistent_errors += 1
+        return results
+
+    def embed(self, model, texts, task_type):
+        """回傳與 texts 等長的 float32 向量 list。"""
+        results, missing = self._lookup(model, texts, task_type)
+        if not missing:
+            return results
+        miss_texts = [texts[indexes[0]] for indexes in missing.values()]
+        vectors = self.embed_fn(model, miss_texts, task_type)
+        return self._fill(model, task_type, results, missing, vectors)
+
+    async def embed_async(self, model, texts, task_type, async_embed_fn):
+        """embed() 的 asyncio 版本：有持久層時查詢放到執行緒，未命中的文字以 async_embed_fn 取得。"""
+        if self.persistent_store is None:
+            results, missing = self._lookup(model, texts, task_type)
+        else:
+            results, missing = await asyncio.to_thread(self._lookup, model, texts, task_type)
+        if not missing:
+            return results
+        miss_texts = [texts[indexes[0]] for indexes in missing.values()]
+        vectors = await async_embed_fn(model, miss_texts, task_type)
+        if self.persistent_store is None:
+            return self._fill(model, task_type, results, missing, vectors)
+        return await asyncio.to_thread(self._fill, model, task_type, results, missing, vectors)
+
+    def embed_one(self, model, text, task_type):
+        return self.embed(model, [text], task_type)[0]
+
+    def stats(self):
+        with self._lock:
+            hits = self._memory_hits + self._persistent_hits
+            lookups = hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'memory_bytes': int(sum(v.nbytes for v in self._entries.values())),
+                'memory_hits': self._memory_hits,
+                'persistent_hits': self._persistent_hits,
+                'misses': self._misses,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'embed_calls': self._embed_calls,
+                'persistent_errors': self._persistent_errors,
+            }
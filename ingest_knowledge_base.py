@@ -0,0 +1,362 @@
+# ingest_knowledge_base.py
+# 將 ITKM.txt 解析成「每個條目一個 chunk」，批次產生 Embedding 後大量寫入 Qdrant 的 factory_manuals。
+# 每個 chunk 的 point ID 由內容雜湊決定，因此可以只處理新增/修改/刪除的條目。
+#
+# 用法:
+#   python ingest_knowledge_base.py                 # 增量同步：只 embed 新增或修改的條目，並刪除已移除的條目
+#   python ingest_knowledge_base.py --rebuild       # 藍綠重建：建好新集合後才把 alias 切過去
+#   python ingest_knowledge_base.py --rebuild --profile scalar   # 以量化設定檔重建 (見 collection_profiles.py)
+#   python ingest_knowledge_base.py --dry-run       # 只解析並列出 chunk，不呼叫任何外部服務
+#   python ingest_knowledge_base.py --file other.txt --embed-batch-size 50 --concurrency 2
+import argparse
+import hashlib
+import os
+import random
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+import collection_profiles
+from rate_limit import is_rate_limited
+
+DEFAULT_SOURCE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ITKM.txt")
+COLLECTION_NAME = "factory_manuals"
+
+# Gemini batchEmbedContents 一次最多 100 筆
+EMBED_BATCH_SIZE = 100
+EMBED_CONCURRENCY = 4
+UPSERT_BATCH_SIZE = 256
+MAX_RETRIES = 6
+
+SCROLL_BATCH_SIZE = 1000
+
+# 產生 point ID 用的固定命名空間；相同內容永遠得到相同 ID
+KB_POINT_NAMESPACE = uuid.UUID("6f1c2c1e-7d1b-4c8e-9a53-3f0e2b8f4a10")
+
+_SECTION_RE = re.compile(r"^\d+\.\s+.+")
+
+
+# --- 解析 ITKM.txt ---
+def parse_knowledge_base(text, source="ITKM.txt"):
+    """
+    將知識庫文字切成條目，回傳 chunk dict 的 list：
+      - 以 `#` 開頭的行開始一個條目，直到空行為止 (例如 `#apache error code` + 錯誤碼 + 建議)。
+        沒有內容、後面緊接另一個 `#` 的標題 (例如 `#tibame課程維護的測試帳號` 之下的 `#alpha`)
+        會被當作上層標題，一併放進同一組裡每個子條目的文字中。
+      - 以 `Q:` 開頭的行開始一個問答條目 (Q: ... A: ...)，直到空行為止。
+      - 其他不屬於任何條目的行 (目錄、章節標題) 不會成為 chunk；
+        形如 `1. 帳號與密碼 (Account & Password) - 50則` 的章節標題會記錄在後續條目的 section 欄位。
+    """
+    chunks = []
+    parent_headers = []
+    current = None
+    section = None
+
+    def flush():
+        nonlocal current
+        if current is None:
+            return
+        body = [line for line in current['lines'][1:] if line.strip()]
+        if current['kind'] == 'heading' and not body:
+            # 沒有內容的標題：視為下一個條目的上層標題
+            parent_headers.append(current['lines'][0])
+        else:
+            lines = (parent_headers if current['kind'] == 'heading' else []) + current['lines']
+            chunks.append({
+                'title': current['title'],
+                'text': "\n".join(line.rstrip() for line in lines).strip(),
+                'kind': current['kind'],
+                'section': section,
+                'source': source,
+                'line': current['line'],
+            })
+        current = None
+
+    for line_no, raw_line in enumerate(text.splitlines(), start=1):
+        line = raw_line.rstrip()
+        stripped = line.strip()
+
+        if not stripped:
+            flush()
+            parent_headers = []
+            continue
+
+        if stripped.startswith('#'):
+            flush()
+            current = {'kind': 'heading', 'title': stripped.lstrip('#').strip(), 'lines': [stripped], 'line': line_no}
+        elif stripped.startswith('Q:'):
+            flush()
+            current = {'kind': 'qa', 'title': stripped[2:].strip(), 'lines': [stripped], 'line': line_no}
+        elif current is not None:
+            current['lines'].append(line)
+        elif _SECTION_RE.match(stripped):
+            section = stripped
+
+    flush()
+    return chunks
+
+
+def load_chunks(path):
+    with open(path, encoding='utf-8') as f:
+        return parse_knowledge_base(f.read(), source=os.path.basename(path))
+
+
+# --- 批次 Embedding (有上限的並行 + 速率限制退避) ---
+def embed_batch_with_backoff(genai, model, texts, task_type="RETRIEVAL_DOCUMENT", max_retries=MAX_RETRIES):
+    for attempt in range(max_retries):
+        try:
+            result = genai.embed_content(model=model, content=texts, task_type=task_type)
+            return result['embedding']
+        except Exception as e:
+            if not is_rate_limited(e) or attempt == max_retries - 1:
+                raise
+            delay = min(30.0, 1.0 * (2 ** attempt))
+            delay = random.uniform(delay / 2, delay)
+            print(f"🟡 Embedding 遭到速率限制或暫時性錯誤 ({type(e).__name__})，{delay:.1f} 秒後重試...")
+            time.sleep(delay)
+
+
+def embed_chunks(genai, model, texts, batch_size=EMBED_BATCH_SIZE, concurrency=EMBED_CONCURRENCY):
+    """將文字分批送出 (每批一次 API 呼叫)，最多 concurrency 批同時進行；回傳與 texts 同順序的向量。"""
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        results = list(executor.map(lambda batch: embed_batch_with_backoff(genai, model, batch), batches))
+    return [vector for batch_vectors in results for vector in batch_vectors]
+
+
+# --- 內容雜湊與 point ID ---
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def chunk_point_id(chunk):
+    return str(uuid.uuid5(KB_POINT_NAMESPACE, content_hash(chunk['text'])))
+
+
+def index_chunks_by_id(chunks):
+    """以 point ID 建立索引；內容完全相同的條目只保留第一個。"""
+    indexed = {}
+    for chunk in chunks:
+        indexed.setdefault(chunk_point_id(chunk), chunk)
+    return indexed
+
+
+# --- 大量寫入 Qdrant ---
+def build_points(models, chunks, vectors):
+    return [
+        models.PointStruct(
+            id=chunk_point_id(chunk),
+            vector=list(vector),
+            payload={
+                'text': chunk['text'],
+                'title': chunk['title'],
+                'kind': chunk['kind'],
+                'section': chunk['section'],
+                'source': chunk['source'],
+                'content_hash': content_hash(chunk['text']),
+            },
+        )
+        for chunk, vector in zip(chunks, vectors)
+    ]
+
+
+def upsert_points(client, collection_name, points, batch_size=UPSERT_BATCH_SIZE):
+    """以 wait=False 大批寫入；最後一批 wait=True，確保結束時所有資料都已可被搜尋。"""
+    for start in range(0, len(points), batch_size):
+        batch = points[start:start + batch_size]
+        is_last = start + batch_size >= len(points)
+        client.upsert(collection_name=collection_name, points=batch, wait=is_last)
+
+
+def fetch_existing_ids(client, collection_name):
+    """以 scroll 取得集合內所有 point ID (不取向量與 payload)。"""
+    ids = set()
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            limit=SCROLL_BATCH_SIZE,
+            offset=offset,
+            with_payload=False,
+            with_vectors=False,
+        )
+        ids.update(str(point.id) for point in points)
+        if offset is None:
+            return ids
+
+
+def fetch_vectors(client, collection_name, ids):
+    """取回既有 point 的向量，讓藍綠重建時未變更的條目不必重新 embed。"""
+    vectors = {}
+    ids = list(ids)
+    for start in range(0, len(ids), SCROLL_BATCH_SIZE):
+        for point in client.retrieve(collection_name=collection_name, ids=ids[start:start + SCROLL_BATCH_SIZE],
+                                     with_payload=False, with_vectors=True):
+            vectors[str(point.id)] = point.vector
+    return vectors
+
+
+def collection_exists(client, name):
+    return any(c.name == name for c in client.get_collections().collections)
+
+
+def resolve_alias(client, alias_name):
+    """回傳 alias 目前指向的集合名稱；不是 alias 時回傳 None。"""
+    for alias in client.get_aliases().aliases:
+        if alias.alias_name == alias_name:
+            return alias.collection_name
+    return None
+
+
+def embed_new_chunks(genai, embedding_model, chunks, args):
+    if not chunks:
+        return []
+    embed_start = time.perf_counter()
+    vectors = embed_chunks(
+        genai, embedding_model, [chunk['text'] for chunk in chunks],
+        batch_size=args.embed_batch_size, concurrency=args.concurrency
+    )
+    embed_seconds = time.perf_counter() - embed_start
+    print(f"✅ Embedding 完成: {len(vectors)} 筆，耗時 {embed_seconds:.2f} 秒 ({len(vectors) / embed_seconds:.1f} 筆/秒)。")
+    return vectors
+
+
+def sync_collection(client, models, genai, embedding_model, chunks, args):
+    """
+    增量同步：比對內容雜湊 (point ID)，只 embed/寫入新增或修改的條目，並刪除已不存在的條目。
+    修改過的條目內容雜湊會改變，等同「刪除舊 ID + 新增新 ID」。
+    """
+    collection_name = args.collection
+    if not collection_exists(client, collection_name) and resolve_alias(client, collection_name) is None:
+        print(f"集合 '{collection_name}' 不存在，以設定檔 '{args.profile}' 建立新集合。")
+        collection_profiles.create_collection(client, models, collection_name, args.profile)
+
+    desired = index_chunks_by_id(chunks)
+    existing = fetch_existing_ids(client, collection_name)
+    to_add = [desired[point_id] for point_id in desired if point_id not in existing]
+    to_delete = [point_id for point_id in existing if point_id not in desired]
+    print(f"比對結果: 共 {len(desired)} 個條目，未變更 {len(desired) - len(to_add)}，"
+          f"新增/修改 {len(to_add)}，待刪除 {len(to_delete)}。")
+
+    if to_add:
+        vectors = embed_new_chunks(genai, embedding_model, to_add, args)
+        upsert_start = time.perf_counter()
+        upsert_points(client, collection_name, build_points(models, to_add, vectors), args.upsert_batch_size)
+        upsert_seconds = time.perf_counter() - upsert_start
+        print(f"✅ 寫入完成: {len(to_add)} 筆，耗時 {upsert_seconds:.2f} 秒 ({len(to_add) / upsert_seconds:.1f} 筆/秒)。")
+    if to_delete:
+        client.delete(
+            collection_name=collection_name,
+            points_selector=models.PointIdsList(points=to_delete),
+            wait=True
+        )
+        print(f"✅ 已刪除 {len(to_delete)} 個已移除的條目。")
+    if not to_add and not to_delete:
+        print("知識庫沒有任何變更。")
+
+
+def rebuild_collection_blue_green(client, models, genai, embedding_model, chunks, args):
+    """
+    藍綠重建：在新的集合 (<alias>_<時間戳>) 中建立完整索引，完成後一次切換 alias，
+    查詢永遠不會打到建到一半的集合。未變更的條目沿用舊集合中的向量。
+    """
+    alias_name = args.collection
+    new_collection = f"{alias_name}_{time.strftime('%Y%m%d%H%M%S')}"
+    old_collection = resolve_alias(client, alias_name)
+    is_plain_collection = old_collection is None and collection_exists(client, alias_name)
+    source_collection = old_collection or (alias_name if is_plain_collection else None)
+
+    desired = index_chunks_by_id(chunks)
+    reused = fetch_vectors(client, source_collection, desired.keys()) if source_collection else {}
+    to_embed = [chunk for point_id, chunk in desired.items() if point_id not in reused]
+    print(f"藍綠重建: 新集合 '{new_collection}'，沿用 {len(reused)} 個既有向量，需 embed {len(to_embed)} 個條目。")
+
+    new_vectors = dict(zip(
+        [chunk_point_id(chunk) for chunk in to_embed],
+        embed_new_chunks(genai, embedding_model, to_embed, args)
+    ))
+    ordered_chunks = list(desired.values())
+    vectors = [reused.get(point_id, new_vectors.get(point_id)) for point_id in desired]
+
+    collection_profiles.create_collection(client, models, new_collection, args.profile)
+    upsert_start = time.perf_counter()
+    upsert_points(client, new_collection, build_points(models, ordered_chunks, vectors), args.upsert_batch_size)
+    upsert_seconds = time.perf_counter() - upsert_start
+    print(f"✅ 寫入完成: {len(ordered_chunks)} 筆，耗時 {upsert_seconds:.2f} 秒 ({len(ordered_chunks) / upsert_seconds:.1f} 筆/秒)。")
+
+    if is_plain_collection:
+        # alias 不能與既有集合同名：第一次改用藍綠部署時，必須先刪除舊的實體集合 (會有極短暫的空窗)
+        print(f"🟡 '{alias_name}' 目前是實體集合而非 alias，將刪除後改為 alias (僅第一次轉換需要)。")
+        client.delete_collection(collection_name=alias_name)
+
+    operations = [models.CreateAliasOperation(
+        create_alias=models.CreateAlias(collection_name=new_collection, alias_name=alias_name)
+    )]
+    if old_collection:
+        operations.insert(0, models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias_name)))
+    client.update_collection_aliases(change_aliases_operations=operations)
+    print(f"✅ alias '{alias_name}' 已切換到 '{new_collection}'。")
+
+    if old_collection and not args.keep_old:
+        client.delete_collection(collection_name=old_collection)
+        print(f"✅ 已刪除舊集合 '{old_collection}'。")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="將 ITKM.txt 批次索引到 Qdrant factory_manuals 集合。")
+    parser.add_argument("--file", default=DEFAULT_SOURCE_FILE, help="知識庫文字檔路徑 (預設: ITKM.txt)")
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--embed-batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=EMBED_CONCURRENCY)
+    parser.add_argument("--upsert-batch-size", type=int, default=UPSERT_BATCH_SIZE)
+    parser.add_argument("--rebuild", action="store_true", help="以藍綠方式完整重建集合並切換 alias")
+    parser.add_argument("--profile", default=os.getenv("QDRANT_COLLECTION_PROFILE", "default"),
+                        choices=list(collection_profiles.COLLECTION_PROFILES),
+                        help="建立新集合時使用的儲存設定檔 (量化、on_disk、HNSW 參數)")
+    parser.add_argument("--keep-old", action="store_true", help="藍綠重建後保留舊集合 (方便回滾)")
+    parser.add_argument("--dry-run", action="store_true", help="只解析並列出 chunk")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    chunks = load_chunks(args.file)
+    print(f"✅ 已解析 {len(chunks)} 個條目 (來源: {args.file})。")
+    if args.dry_run:
+        for chunk in chunks:
+            print(f"   - [{chunk['kind']}] 第 {chunk['line']} 行: {chunk['title'][:50]}")
+        return
+    if not chunks:
+        print("🟡 沒有任何可索引的條目，結束。")
+        return
+
+    load_dotenv()
+    import google.generativeai as genai
+    from qdrant_client import QdrantClient, models
+
+    google_api_key = os.getenv("GOOGLE_API_KEY")
+    if not google_api_key:
+        raise ValueError("找不到 GOOGLE_API_KEY，請在 .env 檔案中設定")
+    genai.configure(api_key=google_api_key)
+    embedding_model = os.getenv("GEMINI_EMBEDDING_MODEL", "models/text-embedding-004")
+
+    client = QdrantClient(
+        url=os.getenv("QDRANT_URL", "http://localhost:6333"),
+        api_key=os.getenv("QDRANT_API_KEY") or None,
+        prefer_grpc=False,
+        timeout=60
+    )
+
+    if args.rebuild:
+        rebuild_collection_blue_green(client, models, genai, embedding_model, chunks, args)
+    else:
+        sync_collection(client, models, genai, embedding_model, chunks, args)
+
+    total_seconds = time.perf_counter() - start_time
+    count = client.count(collection_name=args.collection, exact=True).count
+    print(f"\n🎉 索引完成！集合 '{args.collection}' 目前共有 {count} 個向量，總耗時 {total_seconds:.2f} 秒。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+# lexical_index.py
+# factory_manuals 旁的 BM25 詞彙索引，用來補強 Embedding 不擅長的精確查詢
+# (例如 `#apache error code` 底下的 10000131 這類錯誤碼或單號)。
+# 索引由 Qdrant 中各 point 的 payload 文字在行程內建立 (同時保留向量，方便替只被詞彙命中的區塊計算 cosine)，
+# 知識庫版本改變時整個重建後一次替換，查詢不需要加鎖。
+import math
+import re
+import time
+import unicodedata
+
+import numpy as np
+
+# ASCII 詞：英數字開頭，可包含 - _ . @ (讓 ERR-1234、v1.2、alpha_tester05 保持為單一詞)
+_WORD_RE = re.compile(r"[a-z0-9][a-z0-9_\-.@]*[a-z0-9]|[a-z0-9]")
+_CJK_RUN_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+# 識別碼 (只認真正的單號 / 帳號格式，一般技術詞彙如 ipv4、win10、25mb、office365、sha256 不算)：
+#   - 5 位以上的純數字：錯誤碼 (例如 10000131)；4 位以下 (年份、分機、HTTP 狀態碼) 太常見
+#   - 2~5 個英文字母 + 5 位以上數字 (可用 - 分隔)：工單號 (INC0012345、CHG-123456)
+#   - 英文詞_英文詞 + 數字：測試帳號 (alpha_tester05)
+_IDENTIFIER_RE = re.compile(r"^(?:\d{5,}|[a-z]{2,5}-?\d{5,}|[a-z]+(?:_[a-z]+)+\d+)$")
+
+
+def tokenize(text):
+    """英數字以詞為單位，中日韓文字以相鄰兩字 (bigram) 為單位；單獨一個漢字時保留該字。"""
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = _WORD_RE.findall(text)
+    for run in _CJK_RUN_RE.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def extract_identifiers(text):
+    return {token for token in _WORD_RE.findall(unicodedata.normalize("NFKC", text or "").lower())
+            if _IDENTIFIER_RE.match(token)}
+
+
+def _unit_vector(vector):
+    arr = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(arr))
+    return arr / norm if norm > 0 else arr
+
+
+class FusedHit:
+    """
+    與 Qdrant ScoredPoint 相同的介面 (id / score / payload)；score 仍是向量 cosine 分數，
+    另外附上正規化後的 BM25 分數與只用來排序的融合分數。
+    """
+    __slots__ = ('id', 'score', 'payload', 'lexical_score', 'fused_score')
+
+    def __init__(self, id, score, payload, lexical_score, fused_score):
+        self.id = id
+        self.score = score
+        self.payload = payload
+        self.lexical_score = lexical_score
+        self.fused_score = fused_score
+
+    @property
+    def dense_score(self):
+        return self.score
+
+
+class _IndexState:
+    def __init__(self, ids, payloads, vectors, postings, doc_lengths, version):
+        self.ids = ids
+        self.payloads = payloads
+        self.vectors = vectors          # (N, dim) float32 已正規化；沒有向量時為 None
+        self.postings = postings        # token -> (doc 索引陣列, 詞頻陣列)
+        self.doc_lengths = doc_lengths
+        self.avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        self.position = {point_id: i for i, point_id in enumerate(ids)}
+        self.version = version
+        self.built_at = time.time()
+
+
+class LexicalIndex:
+    """
+    BM25 索引與混合檢索。
+
+    weight:          融合分數 (只用來排序) 中 BM25 (以本次查詢最高分正規化) 的權重，其餘為 cosine 分數。
+    limit:           每次查詢最多加入的 BM25 候選數。
+    min_dense_score: 只被 BM25 找到的區塊，cosine 分數至少要達到此值 (含識別碼的區塊不受限)，
+                     避免常見字詞把不相關的區塊帶進上下文；應與向量搜尋的分數門檻相同。
+    """
+
+    def __init__(self, weight=0.3, limit=20, min_dense_score=0.4, k1=1.5, b=0.75):
+        self.weight = weight
+        self.limit = limit
+        self.min_dense_score = min_dense_score
+        self.k1 = k1
+        self.b = b
+        self._state = None
+        self._identifier_hits = 0
+        self._fused_queries = 0
+        self._lexical_only_hits = 0
+
+    # --- 建立索引 ---
+    def build(self, points, version=None):
+        """points 為 (id, payload, vector 或 None) 的 list；建立完成後才替換目前的索引。"""
+        ids, payloads, vectors = [], [], []
+        term_freqs = {}
+        lengths = []
+        for doc_idx, (point_id, payload, vector) in enumerate(points):
+            ids.append(point_id)
+            payloads.append(payload or {})
+            vectors.append(vector)
+            tokens = tokenize((payload or {}).get('text', ''))
+            lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                term_freqs.setdefault(token, ([], []))
+                term_freqs[token][0].append(doc_idx)
+                term_freqs[token][1].append(tf)
+        postings = {
+            token: (np.asarray(docs, dtype=np.int32), np.asarray(tfs, dtype=np.float32))
+            for token, (docs, tfs) in term_freqs.items()
+        }
+        matrix = None
+        if vectors and all(v is not None for v in vectors):
+            matrix = np.stack([_unit_vector(v) for v in vectors])
+        self._state = _IndexState(ids, payloads, matrix, postings, np.asarray(lengths, dtype=np.float32), version)
+        return len(ids)
+
+    def load_from_qdrant(self, client, collection_name, version=None, batch_size=256):
+        """以 scroll 讀出整個 collection 的文字與向量並重建索引。"""
+        points = []
+        offset = None
+        while True:
+            batch, offset = client.scroll(
+                collection_name=collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            points.extend((point.id, point.payload, point.vector) for point in batch)
+            if offset is None:
+                break
+        return self.build(points, version)
+
+    @property
+    def version(self):
+        return self._state.version if self._state is not None else None
+
+    @property
+    def ready(self):
+        return self._state is not None
+
+    # --- 查詢 ---
+    def _bm25_scores(self, state, tokens):
+        scores = np.zeros(len(state.ids), dtype=np.float32)
+        n_docs = len(state.ids)
+        for token in set(tokens):
+            posting = state.postings.get(token)
+            if posting is None:
+                continue
+            docs, tfs = posting
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * state.doc_lengths[docs] / (state.avg_length or 1.0))
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+        return scores
+
+    def match_identifier(self, question):
+        """
+        問題中的識別碼 (例如錯誤碼) 只出現在唯一一個區塊時，回傳該區塊的 payload；否則回傳 None。
+        多個識別碼指向不同區塊時視為不明確，交給一般流程處理。
+        """
+        state = self._state
+        if state is None:
+            return None
+        matched = set()
+        for identifier in extract_identifiers(question):
+            posting = state.postings.get(identifier)
+            if posting is not None and len(posting[0]) == 1:
+                matched.add(int(posting[0][0]))
+        if len(matched) != 1:
+            return None
+        self._identifier_hits += 1
+        return state.payloads[matched.pop()]
+
+    def fuse(self, question, query_vector, dense_hits):
+        """
+        將 Qdrant 的向量搜尋結果與 BM25 結果合併，依融合分數 (fused_score) 由高到低排序。
+        融合分數 = (1 - weight) × cosine + weight × (BM25 / 本次最高 BM25)，只用來決定順序：
+        沒有字詞重疊的區塊會降到 (1 - weight) × cosine，BM25 最高的區塊一定多加 weight，
+        不在 cosine 的尺度上。因此各結果的 score 維持 cosine 分數 (只被 BM25 找到的區塊為另外計算的 cosine)，
+        後續的分數截斷與直接擷取門檻都以 score 比較。
+        """
+        state = self._state
+        if state is None:
+            return dense_hits
+        scores = self._bm25_scores(state, tokenize(question))
+        max_score = float(scores.max()) if len(scores) else 0.0
+        if max_score <= 0:
+            return dense_hits
+        self._fused_queries += 1
+        lexical = scores / max_score
+
+        identifiers = extract_identifiers(question)
+        identifier_docs = set()
+        for identifier in identifiers:
+            posting = state.postings.get(identifier)
+            if posting is not None:
+                identifier_docs.update(int(i) for i in posting[0])
+
+        query = _unit_vector(query_vector) if query_vector is not None else None
+        fused = {}
+        for hit in dense_hits:
+            idx = state.position.get(hit.id)
+            lexical_score = float(lexical[idx]) if idx is not None else 0.0
+            fused[hit.id] = FusedHit(
+                hit.id,
+                hit.score,
+                hit.payload,
+                lexical_score,
+                (1 - self.weight) * hit.score + self.weight * lexical_score,
+            )
+
+        top = np.argsort(-scores)[:self.limit]
+        for idx in top:
+            idx = int(idx)
+            if scores[idx] <= 0 or state.ids[idx] in fused:
+                continue
+            dense_score = 0.0
+            if query is not None and state.vectors is not None and state.vectors.shape[1] == query.shape[0]:
+                dense_score = float(state.vectors[idx] @ query)
+            if dense_score < self.min_dense_score and idx not in identifier_docs:
+                continue
+            self._lexical_only_hits += 1
+            fused[state.ids[idx]] = FusedHit(
+                state.ids[idx],
+                dense_score,
+                state.payloads[idx],
+                float(lexical[idx]),
+                (1 - self.weight) * dense_score + self.weight * float(lexical[idx]),
+            )
+        return sorted(fused.values(), key=lambda hit: hit.fused_score, reverse=True)
+
+    def stats(self):
+        state = self._state
+        return {
+            'ready': state is not None,
+            'documents': len(state.ids) if state else 0,
+            'terms': len(state.postings) if state else 0,
+            'has_vectors': bool(state is not None and state.vectors is not None),
+            'kb_version': state.version if state else None,
+            'built_at': state.built_at if state else None,
+            'identifier_hits': self._identifier_hits,
+            'fused_queries': self._fused_queries,
+            'lexical_only_hits': self._lexical_only_hits,
+        }
@@ -0,0 +1,178 @@
+# local_vector_index.py
+# factory_manuals 的行程內向量索引：由 Qdrant 以 scroll 匯出向量與 payload，存成 float32 NumPy 矩陣，
+# 查詢改以一次矩陣乘法 (已正規化向量的內積 = cosine) 完成，不需要每個問題都到 Qdrant 來回一趟。
+# 知識庫只有幾百個 768 維的區塊時，精確搜尋只要幾十微秒，比任何網路往返都快。
+# 設定 path 時向量另外寫成 .npy 檔：同一台機器的其他 worker 在知識庫版本相同時以 memory-map 直接由檔案載入，
+# 共用作業系統的頁面快取，不必各自重新 scroll；負責重建的 worker 則直接使用剛建立的記憶體陣列。
+# 知識庫版本改變時整個重建後一次替換，查詢不需要加鎖。
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class LocalHit:
+    """與 Qdrant ScoredPoint 相同的介面 (id / score / payload)。"""
+    __slots__ = ('id', 'score', 'payload')
+
+    def __init__(self, id, score, payload):
+        self.id = id
+        self.score = score
+        self.payload = payload
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class _IndexState:
+    def __init__(self, ids, payloads, vectors, version, source):
+        self.ids = ids
+        self.payloads = payloads
+        self.vectors = vectors          # (N, dim) float32 已正規化；可能是 np.memmap
+        self.version = version
+        self.source = source            # 'qdrant' 或 'file'
+        self.loaded_at = time.time()
+
+
+class LocalVectorIndex:
+    """
+    path: 向量檔 (.npy) 的路徑，payload 與版本寫在同名的 .json；None 時只保留在記憶體。
+    search / search_batch 的結果與 Qdrant 相同：依分數由高到低、只保留 score_threshold 以上的結果。
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._state = None
+        self._lock = threading.Lock()
+        self._searches = 0
+        self._batch_queries = 0
+
+    # --- 載入 ---
+    def build(self, points, version=None, source='qdrant'):
+        """points 為 (id, payload, vector) 的 list；建立完成後才替換目前的索引。"""
+        ids = [point_id for point_id, _, _ in points]
+        payloads = [payload or {} for _, payload, _ in points]
+        if points:
+            vectors = _normalize_rows(np.asarray([vector for _, _, vector in points], dtype=np.float32))
+        else:
+            vectors = np.zeros((0, 0), dtype=np.float32)
+        if self.path:
+            # 不重新讀回檔案：儲存後另一個 worker 可能已替換成別的版本，沿用剛建立的陣列才能與 ids 對齊
+            self._save(ids, payloads, vectors, version)
+        self._state = _IndexState(ids, payloads, vectors, version, source)
+        return len(ids)
+
+    def load_from_qdrant(self, client, collection_name, version=None, batch_size=256):
+        """以 scroll 讀出整個 collection 的向量與 payload 並重建索引。"""
+        points = []
+        offset = None
+        while True:
+            batch, offset = client.scroll(
+                collection_name=collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            points.extend((point.id, point.payload, point.vector) for point in batch)
+            if offset is None:
+                break
+        return self.build(points, version)
+
+    def load_file(self, version):
+        """檔案中的版本與 version 相同時以 memory-map 載入並回傳筆數；沒有檔案或版本不同時回傳 None。"""
+        if not self.path:
+            return None
+        try:
+            with open(self._meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta['version'] != version:
+                return None
+            vectors = np.load(self.path, mmap_mode='r')
+        except (OSError, ValueError, KeyError):
+            return None
+        # 另一個 worker 可能正在寫入較新的版本，筆數不一致時視為沒有檔案
+        if vectors.shape[0] != len(meta['ids']):
+            return None
+        self._state = _IndexState(meta['ids'], meta['payloads'], vectors, version, 'file')
+        return len(meta['ids'])
+
+    @property
+    def _meta_path(self):
+        return os.path.splitext(self.path)[0] + '.json'
+
+    def _save(self, ids, payloads, vectors, version):
+        # 先寫暫存檔再 os.replace，其他 worker 不會讀到寫到一半的檔案；向量先於 metadata 替換
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_suffix = f".{os.getpid()}.tmp"
+        with open(self.path + tmp_suffix, 'wb') as f:
+            np.save(f, vectors)
+        os.replace(self.path + tmp_suffix, self.path)
+        with open(self._meta_path + tmp_suffix, 'w', encoding='utf-8') as f:
+            json.dump({'version': version, 'ids': ids, 'payloads': payloads}, f, ensure_ascii=False)
+        os.replace(self._meta_path + tmp_suffix, self._meta_path)
+
+    @property
+    def version(self):
+        return self._state.version if self._state is not None else None
+
+    @property
+    def ready(self):
+        return self._state is not None
+
+    # --- 查詢 ---
+    def _top_hits(self, state, scores, limit, score_threshold):
+        if limit < len(scores):
+            candidates = np.argpartition(-scores, limit - 1)[:limit]
+        else:
+            candidates = np.arange(len(scores))
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        hits = []
+        for idx in candidates:
+            score = float(scores[idx])
+            if score_threshold is not None and score < score_threshold:
+                break
+            hits.append(LocalHit(state.ids[idx], score, state.payloads[idx]))
+        return hits
+
+    def search(self, query_vector, limit=10, score_threshold=None):
+        """精確的 cosine 搜尋；索引尚未載入時丟出 RuntimeError。"""
+        return self.search_batch([query_vector], limit, score_threshold)[0]
+
+    def search_batch(self, query_vectors, limit=10, score_threshold=None):
+        """多個查詢以一次矩陣乘法計分，回傳與 query_vectors 相同順序的結果 list。"""
+        state = self._state
+        if state is None:
+            raise RuntimeError("本機向量索引尚未載入")
+        with self._lock:
+            self._searches += len(query_vectors)
+            if len(query_vectors) > 1:
+                self._batch_queries += 1
+        if not len(state.ids) or not query_vectors:
+            return [[] for _ in query_vectors]
+        queries = _normalize_rows(np.asarray(query_vectors, dtype=np.float32))
+        scores = queries @ state.vectors.T
+        return [self._top_hits(state, row, limit, score_threshold) for row in scores]
+
+    def stats(self):
+        state = self._state
+        with self._lock:
+            searches, batch_queries = self._searches, self._batch_queries
+        return {
+            'ready': state is not None,
+            'points': len(state.ids) if state else 0,
+            'dimension': int(state.vectors.shape[1]) if state is not None and state.vectors.ndim == 2 else 0,
+            'memory_mapped': isinstance(state.vectors, np.memmap) if state else False,
+            'path': self.path,
+            'source': state.source if state else None,
+            'kb_version': state.version if state else None,
+            'loaded_at': state.loaded_at if state else None,
+            'searches': searches,
+            'batch_queries': batch_queries,
+        }
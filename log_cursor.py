@@ -0,0 +1,52 @@
+# log_cursor.py
+# /api/logs 的 keyset 分頁 (ORDER BY log_date DESC, log_id DESC)：
+# 把一頁最後一筆的 (log_date, log_id) 編碼成不透明的游標字串，下一頁再以它組出 WHERE 條件。
+import base64
+import json
+import re
+from datetime import datetime
+
+import pandas as pd
+
+# log_date 欄位可用的 SQL Server 型別
+_DATE_SQL_TYPE_RE = re.compile(r"^(?:DATETIME|SMALLDATETIME|DATETIME2(?:\([0-7]\))?)$", re.IGNORECASE)
+
+
+def encode_log_cursor(log_date, log_id):
+    """將最後一筆的 (log_date, log_id) 編碼成不透明的游標字串 (時間保留到微秒)。"""
+    if pd.isna(log_date):
+        date_value = None
+    else:
+        date_value = pd.Timestamp(log_date).to_pydatetime().isoformat()
+    payload = json.dumps({"d": date_value, "i": int(log_id)})
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_log_cursor(cursor):
+    """解碼游標字串，回傳 (log_date, log_id)；格式錯誤時拋出 ValueError。"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        log_date = datetime.fromisoformat(payload["d"]) if payload["d"] is not None else None
+        return log_date, int(payload["i"])
+    except Exception as e:
+        raise ValueError(f"無效的分頁游標: {cursor}") from e
+
+
+def keyset_condition(cursor, date_sql_type='DATETIME'):
+    """
+    回傳游標之後 (下一頁) 的 (SQL 條件, 參數)。
+    游標中的時間先 CAST 成 log_date 欄位的型別 (date_sql_type) 再比較：DATETIME 欄位以 1/300 秒為單位，
+    讀出的 .997 實際上是 .99666…；SQL Server 2016 起直接與 DATETIME2 參數比較時 log_date = ? 不成立、
+    log_date < ? 卻成立，相同時間的列會在每一頁重複出現。
+    """
+    if not _DATE_SQL_TYPE_RE.match(date_sql_type):
+        raise ValueError(f"無效的 log_date 型別: {date_sql_type}")
+    cursor_date, cursor_id = cursor
+    # ORDER BY log_date DESC 時 SQL Server 會把 NULL 排在最後
+    if cursor_date is None:
+        return "(log_date IS NULL AND log_id < ?)", [cursor_id]
+    cursor_value = f"CAST(? AS {date_sql_type.upper()})"
+    return (
+        f"(log_date < {cursor_value} OR (log_date = {cursor_value} AND log_id < ?) OR log_date IS NULL)",
+        [cursor_date, cursor_date, cursor_id],
+    )
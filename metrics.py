@@ -0,0 +1,197 @@
+# metrics.py
+# 每個請求各階段的耗時 (embed / qdrant_search / prompt_build / generate / mongo_save / sql_connect / sql_query / format)
+# 與累計的直方圖、計數器，以 Prometheus 文字格式由 /metrics 輸出。
+# 詳細的除錯輸出改為抽樣：只有被抽中的請求 (或超過 slow_seconds 的請求) 才會印出 debug 訊息與各階段耗時，
+# 高負載時不再每個請求都把整段上下文印到 stdout。
+import contextvars
+import functools
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_request = contextvars.ContextVar('metrics_request', default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + list(extra or [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in items) + "}"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class RequestTrace:
+    """單一請求的各階段耗時；同一階段出現多次時累加。"""
+    __slots__ = ('endpoint', 'started', 'stages', 'sampled')
+
+    def __init__(self, endpoint, sampled):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.sampled = sampled
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+
+class Metrics:
+    """
+    執行緒安全的指標集合 (每個行程各自累計；多個 worker 時由 Prometheus 分別抓取)。
+
+    debug_sample_rate: 請求被抽樣的機率；被抽中的請求會印出 debug() 訊息與各階段耗時。
+    slow_seconds:      超過此秒數的請求一律印出各階段耗時 (None 表示不啟用)。
+    """
+
+    def __init__(self, namespace='itkb', buckets=DEFAULT_BUCKETS, debug_sample_rate=0.0, slow_seconds=None):
+        self.namespace = namespace
+        self.buckets = tuple(sorted(buckets))
+        self.debug_sample_rate = debug_sample_rate
+        self.slow_seconds = slow_seconds
+        self._lock = threading.Lock()
+        self._histograms = {}   # name -> {label key: [bucket counts..., sum, count]}
+        self._counters = {}     # name -> {label key: value}
+        self._help = {}
+        self._collectors = []
+
+    # --- 定義與收集 ---
+    def describe(self, name, help_text):
+        self._help[f"{self.namespace}_{name}"] = help_text
+
+    def register_collector(self, collector):
+        """collector() 在每次輸出 /metrics 時呼叫，回傳 (名稱, 'gauge' 或 'counter', labels dict, 數值) 的 list。"""
+        self._collectors.append(collector)
+
+    def observe(self, name, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(f"{self.namespace}_{name}", {})
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def inc(self, name, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(f"{self.namespace}_{name}", {})
+            series[key] = series.get(key, 0) + amount
+
+    # --- 階段計時 ---
+    def record_stage(self, stage, seconds):
+        self.observe('stage_seconds', seconds, stage=stage)
+        trace = _current_request.get()
+        if trace is not None:
+            trace.add(stage, seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(stage, time.perf_counter() - started)
+
+    def timed(self, stage):
+        """函式裝飾器：每次呼叫都記錄為 stage 階段的耗時。"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # --- 請求範圍 ---
+    def begin_request(self, endpoint):
+        """開始記錄一個請求；回傳交給 end_request() 的 handle。"""
+        trace = RequestTrace(endpoint, random.random() < self.debug_sample_rate)
+        return _current_request.set(trace), trace
+
+    def end_request(self, handle, status=None):
+        token, trace = handle
+        seconds = time.perf_counter() - trace.started
+        self.observe('request_seconds', seconds, endpoint=trace.endpoint)
+        self.inc('requests_total', endpoint=trace.endpoint, status=status if status is not None else 'unknown')
+        try:
+            _current_request.reset(token)
+        except ValueError:
+            # 串流回應在另一個 context 中結束 (例如 call_on_close)，只需要清掉目前的值
+            _current_request.set(None)
+        if trace.sampled or (self.slow_seconds is not None and seconds >= self.slow_seconds):
+            print("⏱️ " + json.dumps({
+                'endpoint': trace.endpoint,
+                'status': status,
+                'seconds': round(seconds, 4),
+                'stages': {stage: round(value, 4) for stage, value in trace.stages.items()},
+                'sampled': trace.sampled,
+            }, ensure_ascii=False))
+
+    def debug(self, message):
+        """只有目前的請求被抽樣時才印出 (不在請求範圍內時一律不印)。"""
+        trace = _current_request.get()
+        if trace is not None and trace.sampled:
+            print(message)
+
+    # --- 輸出 ---
+    def render(self):
+        """Prometheus text exposition format (0.0.4)。"""
+        lines = []
+        with self._lock:
+            histograms = {name: {key: list(state) for key, state in series.items()}
+                          for name, series in self._histograms.items()}
+            counters = {name: dict(series) for name, series in self._counters.items()}
+
+        for name, series in sorted(histograms.items()):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, state in sorted(series.items()):
+                for bound, count in zip(self.buckets, state):
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', _format_value(float(bound)))])} {count}")
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {state[-1]}")
+                lines.append(f"{name}_sum{_format_labels(key)} {_format_value(state[-2])}")
+                lines.append(f"{name}_count{_format_labels(key)} {state[-1]}")
+
+        for name, series in sorted(counters.items()):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+
+        collected = {}
+        for collector in self._collectors:
+            try:
+                for name, kind, labels, value in collector():
+                    full_name = f"{self.namespace}_{name}"
+                    collected.setdefault(full_name, (kind, []))[1].append((_label_key(labels), value))
+            except Exception as e:
+                print(f"🟡 收集指標失敗: {e}")
+        for name, (kind, samples) in sorted(collected.items()):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in samples:
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
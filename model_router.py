@@ -0,0 +1,125 @@
+# model_router.py
+# 生成前的模型路由 (同步、asyncio 與批次路徑共用)，以及 Gemini 回應 usage_metadata 的整理。
+# 便宜的情況交給較快、較便宜的模型，需要整理多個區塊的困難情況維持原本的主要模型與 prompt：
+#   extract_fast: 知識庫擷取且上下文很短 → 快速模型 (工作只是照抄其中一個區塊)，輸出上限依上下文長度
+#   classify:     (classify_general 開啟時) 知識庫沒有相關結果 → 先由快速模型判斷是否 IT 相關 (只輸出一個詞)，
+#                 不相關時直接回覆固定的拒答 (refusal_fast)；相關或無法判斷時交給主要模型 (main)。
+#                 IT 問題因此多一次串行的呼叫，預設關閉
+#   main:         其他情況，與原本相同
+# 快速模型呼叫失敗或輸出達到上限時，呼叫端一律退回主要模型。
+import threading
+
+NOT_IT_REFUSAL = "抱歉，我只回答 IT 技術相關的問題。"
+CLASSIFY_MAX_OUTPUT_TOKENS = 8
+# 路由後實際使用的方式 (stats() 的 key)
+MODEL_ROUTES = ('extract_fast', 'refusal_fast', 'main')
+
+
+def build_classification_prompt(question):
+    return f"""
+        判斷以下問題是否屬於 IT 技術領域 (例如：電腦軟硬體、網路、系統、程式開發、工廠設備的系統操作等)。
+        只回覆一個詞：屬於時回覆 IT，不屬於時回覆 NOT_IT，不要有任何其他文字。
+
+        問題："{question}"
+        """
+
+
+def parse_classification(text):
+    """回傳 True (IT 相關)、False (不相關)；無法判斷時回傳 None (交給主要模型)。"""
+    label = (text or "").strip().strip('"「」。.').upper()
+    if label == 'NOT_IT':
+        return False
+    if label == 'IT':
+        return True
+    return None
+
+
+def is_truncated(response):
+    """回應是否因為 max_output_tokens 被截斷。"""
+    for candidate in getattr(response, 'candidates', None) or []:
+        if getattr(getattr(candidate, 'finish_reason', None), 'name', None) == 'MAX_TOKENS':
+            return True
+    return False
+
+
+def usage_from_response(response, model_name, route):
+    """由 response.usage_metadata 整理出一次呼叫的 token 用量；沒有用量資訊時回傳 None。"""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return None
+    prompt_tokens = getattr(usage, 'prompt_token_count', 0) or 0
+    output_tokens = getattr(usage, 'candidates_token_count', 0) or 0
+    return {
+        'model': model_name,
+        'route': route,
+        'prompt_tokens': prompt_tokens,
+        'output_tokens': output_tokens,
+        # 2.5 系列的思考 token 不計入 candidates_token_count，但計入 total_token_count
+        'total_tokens': getattr(usage, 'total_token_count', 0) or prompt_tokens + output_tokens,
+    }
+
+
+def summarize_usage(calls):
+    """一個問題所有 Gemini 呼叫的合計 (存入 MongoDB 問答記錄的 usage 欄位)。"""
+    return {
+        'prompt_tokens': sum(call['prompt_tokens'] for call in calls),
+        'output_tokens': sum(call['output_tokens'] for call in calls),
+        'total_tokens': sum(call['total_tokens'] for call in calls),
+        'calls': calls,
+    }
+
+
+class ModelRouter:
+    """
+    fast_model_name 為 None 時停用路由 (一律 main)。
+    extract_max_context_tokens: 上下文不超過此 token 數的知識庫擷取才交給快速模型。
+    fast_max_output_tokens / main_max_output_tokens: 各模型每次請求的輸出上限 (None 表示不限制)。
+    """
+
+    def __init__(self, fast_model_name=None, classify_general=False, extract_max_context_tokens=800,
+                 fast_max_output_tokens=1024, main_max_output_tokens=None):
+        self.fast_model_name = fast_model_name
+        self.classify_general = classify_general
+        self.extract_max_context_tokens = extract_max_context_tokens
+        self.fast_max_output_tokens = fast_max_output_tokens
+        self.main_max_output_tokens = main_max_output_tokens
+        self._lock = threading.Lock()
+        self._counts = {route: 0 for route in MODEL_ROUTES}
+        self._fallbacks = 0
+
+    def route(self, plan):
+        """回傳 'extract_fast'、'classify' 或 'main'。"""
+        if not self.fast_model_name:
+            return 'main'
+        if not plan['is_internal']:
+            return 'classify' if self.classify_general else 'main'
+        retrieval = plan['retrieval']
+        if retrieval is not None and retrieval['context_tokens'] <= self.extract_max_context_tokens:
+            return 'extract_fast'
+        return 'main'
+
+    def max_output_tokens(self, route, plan):
+        if route == 'classify':
+            return CLASSIFY_MAX_OUTPUT_TOKENS
+        if route == 'extract_fast':
+            # 照抄其中一個區塊，輸出不會超過上下文；加倍保留 token 估計的誤差
+            context_bound = plan['retrieval']['context_tokens'] * 2 + 64
+            if self.fast_max_output_tokens is None:
+                return context_bound
+            return min(self.fast_max_output_tokens, context_bound)
+        return self.main_max_output_tokens
+
+    def count(self, route, fallback=False):
+        with self._lock:
+            self._counts[route] += 1
+            if fallback:
+                self._fallbacks += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': bool(self.fast_model_name),
+                'fast_model': self.fast_model_name,
+                'routes': dict(self._counts),
+                'fallbacks': self._fallbacks,
+            }
@@ -0,0 +1,96 @@
+# provision_collection.py
+# 以 collection_profiles.py 的設定檔建立或調整 factory_manuals 集合 (量化、原始向量 on_disk、HNSW 參數、payload 索引)。
+# 既有集合 (或 alias 指向的集合) 會以 update_collection 套用設定，Qdrant 在背景重建索引，期間查詢不中斷；
+# on_disk_payload 只能在建立時指定，需要改變時請用 ingest_knowledge_base.py --rebuild --profile <名稱>。
+#
+# 用法:
+#   python provision_collection.py --list                     # 列出設定檔與目前向量數下的 RAM 估計
+#   python provision_collection.py --profile scalar           # 套用到既有集合 (不存在時建立空集合)
+#   python provision_collection.py --profile binary --recreate   # 刪除後重建空集合 (需重新執行 ingest)
+import argparse
+import os
+
+from dotenv import load_dotenv
+
+import collection_profiles
+from ingest_knowledge_base import COLLECTION_NAME, collection_exists, resolve_alias
+
+
+def print_profiles(vectors):
+    print(f"以 {vectors} 個向量估計向量資料常駐 RAM 的大小 (不含 HNSW 圖與 payload)：\n")
+    for name, profile in collection_profiles.COLLECTION_PROFILES.items():
+        ram = collection_profiles.estimate_ram_bytes(name, vectors)
+        print(f"  {name:<12}{ram / 1024 / 1024:>10.1f} MB   {profile['description']}")
+
+
+def print_search_settings(profile_name):
+    search = collection_profiles.get_profile(profile_name)['search']
+    print("建議的查詢設定 (.env)：")
+    print(f"  QDRANT_HNSW_EF={search['hnsw_ef'] or 0}")
+    if search['oversampling']:
+        print("  QDRANT_QUANTIZATION_RESCORE=true")
+        print(f"  QDRANT_QUANTIZATION_OVERSAMPLING={search['oversampling']}")
+
+
+def print_collection_info(client, collection_name):
+    info = client.get_collection(collection_name)
+    params = info.config.params
+    print(f"集合 '{collection_name}': 狀態 {info.status}，向量 {info.points_count}，已建索引 {info.indexed_vectors_count}")
+    print(f"  vectors: {params.vectors}")
+    print(f"  hnsw: {info.config.hnsw_config}")
+    print(f"  quantization: {info.config.quantization_config}")
+    print(f"  on_disk_payload: {params.on_disk_payload}")
+    print(f"  payload 索引: {', '.join(sorted(info.payload_schema)) or '無'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以儲存設定檔建立或調整 Qdrant 集合。")
+    parser.add_argument("--collection", default=COLLECTION_NAME, help="集合或 alias 名稱")
+    parser.add_argument("--profile", choices=list(collection_profiles.COLLECTION_PROFILES),
+                        default=os.getenv("QDRANT_COLLECTION_PROFILE", "default"))
+    parser.add_argument("--recreate", action="store_true", help="刪除後重建空集合 (資料需重新 ingest)")
+    parser.add_argument("--list", action="store_true", help="只列出設定檔")
+    args = parser.parse_args()
+
+    load_dotenv()
+    from qdrant_client import QdrantClient, models
+
+    client = QdrantClient(
+        url=os.getenv("QDRANT_URL", "http://localhost:6333"),
+        api_key=os.getenv("QDRANT_API_KEY") or None,
+        prefer_grpc=False,
+        timeout=60
+    )
+    target = resolve_alias(client, args.collection) or args.collection
+    exists = collection_exists(client, target)
+
+    if args.list:
+        vectors = client.count(collection_name=target, exact=True).count if exists else 0
+        print_profiles(vectors)
+        return
+
+    if exists and args.recreate:
+        client.delete_collection(collection_name=target)
+        print(f"✅ 已刪除集合 '{target}'。")
+        exists = False
+
+    if exists:
+        print(f"正在將設定檔 '{args.profile}' 套用到既有集合 '{target}'...")
+        client.update_collection(collection_name=target, **collection_profiles.update_config(models, args.profile))
+        collection_profiles.create_payload_indexes(client, models, target)
+        on_disk_payload = client.get_collection(target).config.params.on_disk_payload
+        if bool(on_disk_payload) != collection_profiles.get_profile(args.profile)['on_disk_payload']:
+            print("🟡 on_disk_payload 無法在建立後修改；需要時請以 ingest_knowledge_base.py --rebuild 重建。")
+        print("✅ 已套用，Qdrant 會在背景重建索引與量化資料 (狀態由 yellow 回到 green 即完成)。")
+    else:
+        collection_profiles.create_collection(client, models, target, args.profile)
+        print(f"✅ 已以設定檔 '{args.profile}' 建立集合 '{target}'，請執行 ingest_knowledge_base.py 寫入資料。")
+
+    print()
+    print_collection_info(client, target)
+    print()
+    print_search_settings(args.profile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+# qa_writer.py
+# 問答記錄的背景寫入器：請求執行緒只把記錄放進有上限的佇列，
+# 由背景執行緒依「筆數或時間」組成 insert_many 批次寫入 MongoDB。
+# 佇列滿了或 MongoDB 無法連線時，記錄會先寫到本機 spool 檔 (JSON Lines)，恢復後再補寫。
+# spool 目錄中每個行程一個檔案 (qa_spool_<主機>_<pid>.jsonl)，行程存活期間持有同名 .lock 檔的 flock；
+# 啟動時把已結束行程 (lock 可取得) 留下的 spool 檔接手補寫，worker 重啟後記錄不會遺失。
+import glob
+import json
+import os
+import queue
+import socket
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows：無法判斷其他行程是否存活，不接手其他行程的 spool 檔
+    fcntl = None
+
+from pymongo.errors import BulkWriteError
+
+_DUPLICATE_KEY = 11000
+
+
+class BackgroundQAWriter:
+    """
+    submit() 不會阻塞請求；close() 會在程式結束前把佇列中剩下的記錄寫完 (或寫入 spool)。
+    collection 可以先傳 None (例如 MongoDB 仍在背景連線)，期間的記錄會先寫入 spool，設定後再補寫。
+
+    每筆記錄以自己的 'id' 作為 MongoDB 的 _id，因此從 spool 補寫時重複的記錄會被安全地略過。
+    spool_dir 為 None 時不使用 spool (無法寫入的記錄直接捨棄)。
+    on_batch_written(seconds, count) (可選) 在每次成功寫入一個批次後呼叫。
+    """
+
+    def __init__(self, collection, max_queue=10000, batch_size=100, flush_interval=1.0,
+                 spool_dir=None, retry_interval=5.0, max_retry_interval=60.0, on_batch_written=None):
+        self.collection = collection
+        self.on_batch_written = on_batch_written
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool_dir = spool_dir
+        self.spool_path = None
+        self._lock_file = None
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+            owner = f"{socket.gethostname()}_{os.getpid()}"
+            self.spool_path = os.path.join(spool_dir, f"qa_spool_{owner}.jsonl")
+            self._lock_file = self._hold_lock(self.spool_path)
+        self._orphans_adopted = False
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._spool_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._healthy = True
+        self._next_retry_at = 0.0
+        self._current_retry_interval = retry_interval
+
+        self._stats_lock = threading.Lock()
+        self._submitted = 0
+        self._written = 0
+        self._batches = 0
+        self._spooled = 0
+        self._replayed = 0
+        self._adopted = 0
+        self._failures = 0
+        self._dropped = 0
+
+        self._thread = threading.Thread(target=self._run, name="qa-writer", daemon=True)
+        self._thread.start()
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    # --- 對外介面 ---
+    def submit(self, record):
+        record.setdefault('_id', record.get('id'))
+        self._count('_submitted')
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self._spool([record])
+
+    def close(self, timeout=10.0):
+        """停止背景執行緒，並把佇列中剩餘的記錄寫入 MongoDB 或 spool。"""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        remaining = self._drain(block=False)
+        if remaining:
+            self._write(remaining)
+        if self._lock_file is not None:
+            # spool 檔已不會再寫入，釋放 lock 讓其他行程可以接手
+            self._lock_file.close()
+        print(f"✅ 問答記錄背景寫入器已關閉 (累計寫入 {self._written} 筆，spool {self._spooled} 筆)。")
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'queued': self._queue.qsize(),
+                'submitted': self._submitted,
+                'written': self._written,
+                'batches': self._batches,
+                'spooled': self._spooled,
+                'replayed': self._replayed,
+                'adopted': self._adopted,
+                'failures': self._failures,
+                'dropped': self._dropped,
+                'mongodb_healthy': self._healthy,
+                'spool_pending': self._spool_pending(),
+            }
+
+    # --- 背景執行緒 ---
+    def _drain(self, block=True):
+        """取出最多 batch_size 筆；block 時最多等待 flush_interval 秒湊批次。"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                if block:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._drain()
+            if batch:
+                self._write(batch)
+            # MongoDB 不健康時，等到下一次重試時間才嘗試補寫 (即使期間沒有新的請求)
+            if not self._stop.is_set() and (self._healthy or time.monotonic() >= self._next_retry_at):
+                self._replay_spool()
+
+    def _insert_many(self, records):
+        try:
+            self.collection.insert_many(records, ordered=False)
+            return len(records)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            if all(err.get('code') == _DUPLICATE_KEY for err in errors):
+                # 重複的 _id 代表該筆之前已寫入成功 (例如從 spool 補寫)
+                return e.details.get('nInserted', 0)
+            raise
+
+    def _write(self, batch):
+        now = time.monotonic()
+        if self.collection is None or (not self._healthy and now < self._next_retry_at):
+            self._spool(batch)
+            return
+        try:
+            started = time.perf_counter()
+            inserted = self._insert_many(batch)
+            if self.on_batch_written is not None:
+                self.on_batch_written(time.perf_counter() - started, inserted)
+            self._count('_written', inserted)
+            self._count('_batches')
+            if not self._healthy:
+                print("✅ MongoDB 已恢復，問答記錄恢復直接寫入。")
+            self._healthy = True
+            self._current_retry_interval = self.retry_interval
+        except Exception as e:
+            self._count('_failures')
+            self._healthy = False
+            self._next_retry_at = now + self._current_retry_interval
+            self._current_retry_interval = min(self.max_retry_interval, self._current_retry_interval * 2)
+            print(f"❌ 批次寫入 MongoDB 失敗，{len(batch)} 筆改寫入 spool: {e}")
+            self._spool(batch)
+
+    # --- 本機 spool 檔 ---
+    def _spool(self, records):
+        if not self.spool_path:
+            self._count('_dropped', len(records))
+            print(f"❌ 未設定 spool 檔，捨棄 {len(records)} 筆問答記錄。")
+            return
+        try:
+            with self._spool_lock, open(self.spool_path, 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            self._count('_spooled', len(records))
+        except OSError as e:
+            self._count('_dropped', len(records))
+            print(f"❌ 寫入 spool 檔失敗，捨棄 {len(records)} 筆問答記錄: {e}")
+
+    def _spool_pending(self):
+        if not self.spool_path:
+            return False
+        return any(os.path.exists(path) and os.path.getsize(path) > 0
+                   for path in (self.spool_path, f"{self.spool_path}.replaying"))
+
+    @staticmethod
+    def _hold_lock(spool_path):
+        """持有 spool 檔對應的 .lock (行程結束時由作業系統釋放)，讓其他行程知道這個 spool 檔仍有人負責。"""
+        if fcntl is None:
+            return None
+        lock_file = open(os.path.splitext(spool_path)[0] + '.lock', 'w')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def _adopt_orphans(self):
+        """把已結束行程留下的 spool 檔 (含補寫到一半的 .replaying) 併入自己的 spool 檔，之後照常補寫。"""
+        self._orphans_adopted = True
+        if fcntl is None:
+            return
+        own = os.path.splitext(self.spool_path)[0]
+        paths = glob.glob(os.path.join(self.spool_dir, 'qa_spool_*.jsonl'))
+        paths += glob.glob(os.path.join(self.spool_dir, 'qa_spool_*.jsonl.replaying'))
+        owners = sorted({path.split('.jsonl')[0] for path in paths} - {own})
+        for owner in owners:
+            with open(owner + '.lock', 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue  # 該行程仍在執行，由它自己補寫
+                adopted = 0
+                for path in (f"{owner}.jsonl.replaying", f"{owner}.jsonl"):
+                    if not os.path.exists(path):
+                        continue
+                    with open(path, encoding='utf-8') as f, \
+                            self._spool_lock, open(self.spool_path, 'a', encoding='utf-8') as out:
+                        for line in f:
+                            if line.strip():
+                                out.write(line if line.endswith("\n") else line + "\n")
+                                adopted += 1
+                    # 先寫入自己的 spool 檔才刪除；中途結束時重複的記錄在補寫時會以 _id 略過
+                    os.remove(path)
+            os.remove(owner + '.lock')
+            if adopted:
+                self._count('_adopted', adopted)
+                print(f"✅ 接手已結束行程留下的 {adopted} 筆問答記錄 ({os.path.basename(owner)})。")
+
+    def _replay_spool(self):
+        """把 spool 檔中的記錄補寫回 MongoDB；失敗的部分會再寫回 spool。只由背景執行緒呼叫。"""
+        if not self.spool_path or self.collection is None:
+            return
+        if not self._orphans_adopted:
+            try:
+                self._adopt_orphans()
+            except OSError as e:
+                print(f"🟡 接手其他行程的 spool 檔失敗: {e}")
+        replay_path = f"{self.spool_path}.replaying"
+        # 上次補寫到一半就結束的程式可能留下 .replaying 檔，先處理它
+        if not os.path.exists(replay_path):
+            with self._spool_lock:
+                if not (os.path.exists(self.spool_path) and os.path.getsize(self.spool_path) > 0):
+                    return
+                os.replace(self.spool_path, replay_path)
+        with open(replay_path, encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        for start in range(0, len(records), self.batch_size):
+            batch = records[start:start + self.batch_size]
+            try:
+                self._count('_replayed', self._insert_many(batch))
+            except Exception as e:
+                self._count('_failures')
+                self._healthy = False
+                self._next_retry_at = time.monotonic() + self._current_retry_interval
+                print(f"❌ 從 spool 補寫 MongoDB 失敗，保留剩餘 {len(records) - start} 筆: {e}")
+                with self._spool_lock, open(self.spool_path, 'a', encoding='utf-8') as f:
+                    for record in records[start:]:
+                        f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                # 剩餘的記錄已寫回 spool 檔，才能刪除 .replaying
+                os.remove(replay_path)
+                return
+        # 全部寫入後才刪除：中途結束時 .replaying 會留到下次重新補寫 (已寫入的記錄以 _id 略過)
+        os.remove(replay_path)
+        self._healthy = True
+        self._current_retry_interval = self.retry_interval
+        print(f"✅ 已從 spool 補寫 {len(records)} 筆問答記錄到 MongoDB。")
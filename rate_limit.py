@@ -0,0 +1,10 @@
+# rate_limit.py
+# Gemini / Qdrant 呼叫的速率限制判斷，批次問答 (batch_qa.RateLimitGate) 與知識庫匯入 (ingest_knowledge_base) 共用，
+# 兩邊對「值得稍後重試」的錯誤看法一致。
+
+
+def is_rate_limited(exc):
+    """Gemini / Qdrant 的速率限制或暫時性錯誤 (值得稍後重試)。"""
+    name = type(exc).__name__
+    return name in ('ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable', 'DeadlineExceeded') \
+        or '429' in str(exc)
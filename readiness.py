@@ -0,0 +1,109 @@
+# readiness.py
+# 後端 (MongoDB / Qdrant / Gemini) 的背景初始化與就緒狀態。
+# 每個後端在自己的 daemon 執行緒中建立用戶端並做一次健康檢查，失敗時以指數退避重試，
+# 因此 worker 啟動時間只取決於 import Flask 的時間，而不是各後端的網路往返或逾時。
+import threading
+import time
+
+PENDING = 'pending'
+READY = 'ready'
+ERROR = 'error'
+DISABLED = 'disabled'
+
+
+class Backend:
+    """單一後端的狀態；init_fn() 建立用戶端並驗證連線，成功後依序呼叫 on_ready 回呼。"""
+
+    def __init__(self, name, init_fn, enabled=True, on_ready=None):
+        self.name = name
+        self.init_fn = init_fn
+        self.on_ready = list(on_ready or [])
+        self.state = PENDING if enabled else DISABLED
+        self.error = None
+        self.attempts = 0
+        self.init_seconds = None
+        self.ready_at = None
+        self._ready = threading.Event()
+
+    def snapshot(self):
+        return {
+            'state': self.state,
+            'error': self.error,
+            'attempts': self.attempts,
+            'init_seconds': round(self.init_seconds, 3) if self.init_seconds is not None else None,
+            'ready_at': self.ready_at,
+        }
+
+
+class BackendReadiness:
+    """
+    register() 登記後端，start() 為每個啟用的後端啟動一條初始化執行緒 (彼此並行)。
+    wait(name, timeout) 讓第一個用到該後端的請求最多等待 timeout 秒，而不是在 import 時阻塞。
+    """
+
+    def __init__(self, retry_interval=1.0, max_retry_interval=30.0):
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self._backends = {}
+        self._started = False
+        self._lock = threading.Lock()
+
+    def register(self, name, init_fn, enabled=True, on_ready=None):
+        self._backends[name] = Backend(name, init_fn, enabled, on_ready)
+
+    def on_ready(self, name, callback):
+        self._backends[name].on_ready.append(callback)
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for backend in self._backends.values():
+            if backend.state == DISABLED:
+                continue
+            thread = threading.Thread(target=self._init_loop, args=(backend,), name=f"init-{backend.name}", daemon=True)
+            thread.start()
+
+    def _init_loop(self, backend):
+        interval = self.retry_interval
+        started = time.monotonic()
+        while True:
+            backend.attempts += 1
+            try:
+                backend.init_fn()
+            except Exception as e:
+                backend.state = ERROR
+                backend.error = str(e)
+                print(f"❌ 初始化 {backend.name} 失敗 (第 {backend.attempts} 次)，{interval:.0f} 秒後重試: {e}")
+                time.sleep(interval)
+                interval = min(self.max_retry_interval, interval * 2)
+                continue
+            backend.init_seconds = time.monotonic() - started
+            backend.ready_at = time.time()
+            backend.state = READY
+            backend.error = None
+            backend._ready.set()
+            print(f"✅ {backend.name} 已就緒 ({backend.init_seconds:.2f} 秒)。")
+            for callback in backend.on_ready:
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"🟡 {backend.name} 就緒後的初始化步驟失敗: {e}")
+            return
+
+    def wait(self, name, timeout):
+        """等待後端就緒；回傳是否就緒。停用的後端立即回傳 False。"""
+        backend = self._backends.get(name)
+        if backend is None or backend.state == DISABLED:
+            return False
+        return backend._ready.wait(timeout)
+
+    def is_ready(self, name):
+        backend = self._backends.get(name)
+        return backend is not None and backend.state == READY
+
+    def snapshot(self):
+        backends = {name: backend.snapshot() for name, backend in self._backends.items()}
+        ready = all(b['state'] in (READY, DISABLED) for b in backends.values())
+        return {'ready': ready, 'backends': backends}
@@ -2,6 +2,7 @@
 import os
 from dotenv import load_dotenv
 from qdrant_client import QdrantClient, models
+import collection_profiles
 
 # --- 從 .env 讀取設定 ---
 load_dotenv()
@@ -9,7 +10,9 @@ QDRANT_URL="http://localhost:6333"
 QDRANT_API_KEY=""
 COLLECTION_NAME = "factory_manuals"
 # 這是 Gemini "text-embedding-004" 模型產生的向量維度
-VECTOR_DIMENSION = 768 
+VECTOR_DIMENSION = collection_profiles.VECTOR_DIMENSION
+# 儲存設定檔 (量化、on_disk、HNSW 參數)，見 collection_profiles.py
+COLLECTION_PROFILE = os.getenv("QDRANT_COLLECTION_PROFILE", "default")
 
 # --- 連線到 Qdrant ---
 try:
@@ -36,11 +39,8 @@ try:
 
     # --- 步驟 2: 重新建立一個乾淨的新集合 ---
     print(f"\n正在重新建立新的集合 '{COLLECTION_NAME}'...")
-    client.recreate_collection(
-        collection_name=COLLECTION_NAME,
-        vectors_config=models.VectorParams(size=VECTOR_DIMENSION, distance=models.Distance.COSINE)
-    )
-    print(f"✅ 成功建立新的、乾淨的集合 '{COLLECTION_NAME}'，維度為 {VECTOR_DIMENSION}。")
+    collection_profiles.create_collection(client, models, COLLECTION_NAME, COLLECTION_PROFILE)
+    print(f"✅ 成功建立新的、乾淨的集合 '{COLLECTION_NAME}'，維度為 {VECTOR_DIMENSION}，設定檔 '{COLLECTION_PROFILE}'。")
     print("\n🎉 重置完成！現在您可以執行您的資料索引/上傳腳本了。")
 
 except Exception as e:
@@ -0,0 +1,242 @@
+# single_flight.py
+# 相同問題的請求合併 (single-flight)：事故發生時很多人在幾秒內問同一個問題，
+# 只有第一個請求 (leader) 執行 Embedding / 搜尋 / 生成，同時到達的其他請求等待並共用它的結果。
+#   - SingleFlight：同一個行程內的執行緒，以 threading.Event 等待。
+#   - AsyncSingleFlight：asyncio 服務模式 (asgi_app) 的同一個事件迴圈內，以 Future 等待。
+#   - MongoFlightLease：跨 gunicorn worker，以 MongoDB 文件作為租約；
+#     leader 完成後把結果寫回租約文件，其他 worker 的請求輪詢到結果即回傳。
+import asyncio
+import hashlib
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from pymongo.errors import DuplicateKeyError
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _FlightStats:
+    """leaders: 實際執行的次數；shared: 共用其他請求結果的次數；timeouts: 等待逾時改為自行執行的次數。"""
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self._counts = {'leaders': 0, 'shared': 0, 'timeouts': 0}
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._counts[name] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._counts)
+
+
+class SingleFlight(_FlightStats):
+    """
+    執行緒安全；do(key, fn) 回傳 (結果, 是否共用其他請求的結果)。
+    同一個 key 同時只有一個 fn 在執行；leader 的例外也會傳給所有等待中的請求。
+    等待超過 timeout 秒的請求不再等待，改為自行執行 fn。
+    """
+
+    def __init__(self, timeout=60.0):
+        super().__init__()
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+
+        if not is_leader:
+            if not call.event.wait(self.timeout):
+                self._count('timeouts')
+                return fn(), False
+            self._count('shared')
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        self._count('leaders')
+        try:
+            call.result = fn()
+            return call.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+
+class AsyncSingleFlight(_FlightStats):
+    """SingleFlight 的 asyncio 版本：await do(key, coroutine_fn)，只能在同一個事件迴圈中使用。"""
+
+    def __init__(self, timeout=60.0):
+        super().__init__()
+        self.timeout = timeout
+        self._calls = {}
+
+    async def do(self, key, fn):
+        future = self._calls.get(key)
+        if future is not None:
+            try:
+                result = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+            except asyncio.TimeoutError:
+                self._count('timeouts')
+                return await fn(), False
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # leader 的請求被取消 (例如用戶端斷線)：自行處理
+                return await fn(), False
+            self._count('shared')
+            return result, True
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        self._count('leaders')
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result, False
+        except Exception as e:
+            future.set_exception(e)
+            # 沒有人等待時也要取出例外，避免 "Future exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            self._calls.pop(key, None)
+            if not future.done():
+                future.cancel()
+
+
+class MongoFlightLease(_FlightStats):
+    """
+    跨 worker 的 single-flight。collection 中每份文件代表一個處理中的問題：
+      {_id: 問題鍵的雜湊, owner, state: 'running' | 'done', result, expires_at}
+    expires_at 上的 TTL 索引負責清除殘留的文件 (MongoDB 約每 60 秒清理一次，所以是否過期一律以 expires_at 判斷)。
+
+    lease_seconds:  leader 的租約長度；超過仍未完成時 (例如 leader 的行程被終止) 其他 worker 可接手。
+    result_seconds: 完成後結果保留在租約文件中的時間，讓稍晚輪詢的請求 (與背景寫入 Queries 之前的空窗) 也能取用。
+    timeout:        等待其他 worker 的最長秒數，超過時自行處理。
+    failure_cooldown: 租約操作失敗後，這段時間內不再嘗試 (直接執行 fn，計入 bypassed)，
+                    MongoDB 故障時每個請求最多只付出一次逾時。
+    collection 為 None (MongoDB 未設定或尚未就緒) 時直接執行 fn。
+    collection 應來自逾時很短的用戶端：每次操作都在請求的執行緒上同步進行。
+    """
+
+    def __init__(self, collection=None, lease_seconds=60.0, result_seconds=10.0, poll_interval=0.2, timeout=60.0,
+                 failure_cooldown=30.0):
+        super().__init__()
+        self.collection = collection
+        self.lease_seconds = lease_seconds
+        self.result_seconds = result_seconds
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.failure_cooldown = failure_cooldown
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._counts['bypassed'] = 0
+        self._open_until = 0.0
+
+    def _trip(self):
+        self._open_until = time.monotonic() + self.failure_cooldown
+
+    @staticmethod
+    def _lease_id(key):
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _now():
+        return datetime.now(timezone.utc)
+
+    def ensure_indexes(self):
+        if self.collection is None:
+            return
+        try:
+            self.collection.create_index('expires_at', expireAfterSeconds=0)
+        except Exception as e:
+            print(f"🟡 建立 single-flight 租約的 TTL 索引失敗 (不影響查詢): {e}")
+
+    def _try_acquire(self, lease_id):
+        """取得租約時回傳 None，否則回傳目前的租約文件 (state 為 running 或 done)。"""
+        now = self._now()
+        lease = {'owner': self.owner, 'state': 'running', 'expires_at': now + timedelta(seconds=self.lease_seconds)}
+        try:
+            self.collection.insert_one({'_id': lease_id, **lease})
+            return None
+        except DuplicateKeyError:
+            pass
+        # 已過期的租約 (leader 異常終止，或結果的保留時間已過)：接手成為新的 leader
+        taken = self.collection.find_one_and_update(
+            {'_id': lease_id, 'expires_at': {'$lt': now}},
+            {'$set': lease, '$unset': {'result': ''}},
+        )
+        if taken is not None:
+            return None
+        return self.collection.find_one({'_id': lease_id}) or {'state': 'running'}
+
+    def run(self, key, fn):
+        """回傳 (結果, 是否共用其他 worker 的結果)；結果需可存入 MongoDB。"""
+        if self.collection is None:
+            return fn(), False
+        if time.monotonic() < self._open_until:
+            self._count('bypassed')
+            return fn(), False
+        lease_id = self._lease_id(key)
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                lease = self._try_acquire(lease_id)
+            except Exception as e:
+                print(f"🟡 取得跨 worker 租約失敗，{self.failure_cooldown:g} 秒內改為只在 worker 內合併: {e}")
+                self._trip()
+                return fn(), False
+            if lease is None:
+                self._count('leaders')
+                return self._lead(lease_id, fn), False
+            if lease.get('state') == 'done':
+                self._count('shared')
+                return lease['result'], True
+            if time.monotonic() >= deadline:
+                self._count('timeouts')
+                return fn(), False
+            time.sleep(self.poll_interval)
+
+    def _lead(self, lease_id, fn):
+        try:
+            result = fn()
+        except Exception:
+            # 失敗時立即釋放租約，讓等待中的 worker 自行處理
+            self._update(lease_id, delete=True)
+            raise
+        self._update(lease_id, result=result)
+        return result
+
+    def _update(self, lease_id, result=None, delete=False):
+        try:
+            if delete:
+                self.collection.delete_one({'_id': lease_id, 'owner': self.owner})
+            else:
+                self.collection.update_one(
+                    {'_id': lease_id, 'owner': self.owner},
+                    {'$set': {'state': 'done', 'result': result,
+                              'expires_at': self._now() + timedelta(seconds=self.result_seconds)}},
+                )
+        except Exception as e:
+            print(f"🟡 更新跨 worker 租約失敗 (等待中的請求會在逾時後自行處理): {e}")
+            self._trip()
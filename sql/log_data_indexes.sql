@@ -0,0 +1,22 @@
+-- sql/log_data_indexes.sql
+-- log_data 的建議索引 (SQL Server)。可重複執行：已存在的索引會略過。
+--
+-- IX_log_data_log_date_log_id: /api/logs 的 keyset 分頁 (ORDER BY log_date DESC, log_id DESC) 與日期篩選。
+-- IX_log_data_status:          /api/logs/summary 依狀態的筆數與未完成的積壓；
+--                              INCLUDE 讓查詢只需讀取這個窄索引，不必掃描含 log_data 內容的資料表。
+-- IX_log_data_log_date_status: /api/logs/summary 依日 / 依小時的筆數 (log_date 範圍搜尋，狀態直接由索引取得)。
+--
+-- 分頁游標的時間會以 CAST(? AS <LOGS_DATE_SQL_TYPE>) 與 log_date 比較，環境變數 LOGS_DATE_SQL_TYPE
+-- (預設 DATETIME) 必須與 log_date 欄位的型別相同，否則相同時間的列可能在每一頁重複出現。以下查詢可確認欄位型別：
+--   SELECT TYPE_NAME(system_type_id) AS type_name, scale FROM sys.columns
+--   WHERE object_id = OBJECT_ID('dbo.log_data') AND name = 'log_date';
+--   (datetime -> DATETIME；datetime2 且 scale = 7 -> DATETIME2(7)；smalldatetime -> SMALLDATETIME)
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_log_data_log_date_log_id' AND object_id = OBJECT_ID('dbo.log_data'))
+    CREATE INDEX IX_log_data_log_date_log_id ON dbo.log_data (log_date DESC, log_id DESC);
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_log_data_status' AND object_id = OBJECT_ID('dbo.log_data'))
+    CREATE INDEX IX_log_data_status ON dbo.log_data (status) INCLUDE (log_date, ticket_number);
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_log_data_log_date_status' AND object_id = OBJECT_ID('dbo.log_data'))
+    CREATE INDEX IX_log_data_log_date_status ON dbo.log_data (log_date) INCLUDE (status);
@@ -0,0 +1,17 @@
+-- sql/log_data_rowversion.sql
+-- /api/logs 增量同步與 ETag 用的 rowversion 欄位 (SQL Server)。可重複執行：已存在的欄位與索引會略過。
+-- 建立後設定 LOGS_ROWVERSION_COLUMN=row_version 啟用。
+--
+-- row_version:             每次 INSERT / UPDATE 由 SQL Server 自動遞增，不需要修改任何寫入的程式。
+-- IX_log_data_row_version: 水位 (MAX(row_version)) 只讀取索引的最後一筆，異動查詢 (row_version > ?) 為範圍搜尋。
+--
+-- 限制：rowversion 只會在 INSERT / UPDATE 時遞增，已刪除的列不會出現在增量回應中。
+-- 前端只合併增量時會一直顯示已刪除的列，因此 templates/index.html 每 LOGS_FULL_RELOAD_MS 毫秒改為重新載入整頁；
+-- 若需要即時反映刪除，需另外以 tombstone 表 (或軟刪除欄位) 記錄刪除的 log_id。
+
+IF COL_LENGTH('dbo.log_data', 'row_version') IS NULL
+    ALTER TABLE dbo.log_data ADD row_version ROWVERSION;
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_log_data_row_version' AND object_id = OBJECT_ID('dbo.log_data'))
+    CREATE INDEX IX_log_data_row_version ON dbo.log_data (row_version);
@@ -0,0 +1,241 @@
+# sql_pool.py
+# 提供 SQL Server (pyodbc) 的長連線池，取代每個請求都重新建立加密 ODBC 連線的做法。
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import pyodbc
+
+# 可重試的 SQLSTATE：連線錯誤、逾時、通訊連結失敗
+RETRYABLE_SQLSTATES = ('08001', 'HYT00', '08S01')
+
+
+def connect_with_backoff(connect, retries=5, base_delay=0.5, max_delay=8.0):
+    """
+    以「有上限的指數退避 + jitter」呼叫 connect()，取代固定 sleep(10) 的重試。
+    只有連線類的暫時性錯誤才會重試，其他錯誤直接拋出。
+    回傳 (connection, 重試次數)。
+    """
+    last_exception = None
+    for attempt in range(retries):
+        try:
+            print(f"資料庫連線嘗試: 第 {attempt + 1} 次...")
+            connection = connect()
+            print("✅ 資料庫連線成功！")
+            return connection, attempt
+        except pyodbc.Error as ex:
+            last_exception = ex
+            sqlstate = ex.args[0] if ex.args else None
+            if sqlstate not in RETRYABLE_SQLSTATES:
+                print(f"發生非預期的資料庫錯誤 ({sqlstate})，將不會重試。")
+                raise
+            if attempt == retries - 1:
+                break
+            delay = min(max_delay, base_delay * (2 ** attempt))
+            delay = random.uniform(delay / 2, delay)
+            print(f"資料庫連線錯誤或超時 ({sqlstate})，將在 {delay:.2f} 秒後重試...")
+            time.sleep(delay)
+    print("❌ 所有重試均失敗，無法連線至資料庫。")
+    raise last_exception
+
+
+class PoolTimeoutError(Exception):
+    """在等待時間內無法從連線池取得連線。"""
+
+
+class _PooledConnection:
+    __slots__ = ('raw', 'created_at', 'last_used_at')
+
+    def __init__(self, raw):
+        now = time.monotonic()
+        self.raw = raw
+        self.created_at = now
+        self.last_used_at = now
+
+
+class SQLConnectionPool:
+    """
+    有上限、執行緒安全的 pyodbc 連線池。
+
+    - 取出連線時，若連線閒置超過 health_check_idle 秒會先執行 SELECT 1 檢查，失敗就重新連線。
+    - 連線存活超過 max_lifetime 秒會在歸還時關閉，避免長時間持有被中途切斷的連線。
+    - stats() 提供使用中數量、等待時間、重新連線次數等指標。
+    - on_acquire(seconds) (可選) 在每次取得連線後呼叫，傳入等待與建立連線所花的時間。
+    """
+
+    def __init__(self, connect, max_size=5, timeout=30.0, max_lifetime=1800.0,
+                 health_check_idle=30.0, retries=5, base_delay=0.5, max_delay=8.0, on_acquire=None):
+        self._connect = connect
+        self.on_acquire = on_acquire
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_idle = health_check_idle
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._idle = []  # LIFO：優先重用最近用過的連線
+        self._size = 0   # 已建立 (含使用中與閒置) 的連線數
+        self._in_use = 0
+
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+        self._connects = 0
+        self._reconnects = 0
+        self._connect_retries = 0
+        self._health_check_failures = 0
+        self._discarded = 0
+
+    # --- 內部輔助函式 ---
+    def _open(self):
+        raw, retried = connect_with_backoff(
+            self._connect, self.retries, self.base_delay, self.max_delay
+        )
+        with self._lock:
+            self._connects += 1
+            self._connect_retries += retried
+        return _PooledConnection(raw)
+
+    @staticmethod
+    def _close_quietly(pooled):
+        try:
+            pooled.raw.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, pooled):
+        try:
+            cursor = pooled.raw.cursor()
+            cursor.execute("SELECT 1;")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except Exception as e:
+            print(f"🟡 連線池健康檢查失敗，將重新連線: {e}")
+            return False
+
+    def _release_slot(self):
+        with self._lock:
+            self._size -= 1
+            self._in_use -= 1
+            self._available.notify()
+
+    def _acquire(self):
+        start = time.monotonic()
+        waited = False
+        with self._lock:
+            while not self._idle and self._size >= self.max_size:
+                waited = True
+                remaining = self.timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(
+                        f"等待 {self.timeout} 秒後仍無法從連線池取得連線 (上限 {self.max_size})。"
+                    )
+                self._available.wait(remaining)
+            pooled = self._idle.pop() if self._idle else None
+            if pooled is None:
+                self._size += 1  # 先佔位，實際連線在鎖外建立
+            self._in_use += 1
+            self._checkouts += 1
+            if waited:
+                wait_time = time.monotonic() - start
+                self._waits += 1
+                self._wait_time_total += wait_time
+                self._wait_time_max = max(self._wait_time_max, wait_time)
+
+        if pooled is None:
+            try:
+                return self._open()
+            except Exception:
+                self._release_slot()
+                raise
+
+        now = time.monotonic()
+        if now - pooled.last_used_at > self.health_check_idle and not self._is_healthy(pooled):
+            self._close_quietly(pooled)
+            with self._lock:
+                self._health_check_failures += 1
+                self._reconnects += 1
+            try:
+                return self._open()
+            except Exception:
+                self._release_slot()
+                raise
+        return pooled
+
+    def _return(self, pooled, discard=False):
+        now = time.monotonic()
+        if not discard and now - pooled.created_at > self.max_lifetime:
+            discard = True
+        if discard:
+            self._close_quietly(pooled)
+            with self._lock:
+                self._discarded += 1
+                self._size -= 1
+                self._in_use -= 1
+                self._available.notify()
+            return
+        pooled.last_used_at = now
+        with self._lock:
+            self._idle.append(pooled)
+            self._in_use -= 1
+            self._available.notify()
+
+    # --- 對外介面 ---
+    @contextmanager
+    def connection(self):
+        """
+        取出一條連線，區塊結束時歸還。
+        不論區塊是否成功都會先 rollback 再放回池中：區塊內未 commit 的交易 (包含在區塊內被攔下的錯誤)
+        不會留給下一個借用者；已 commit 時 rollback 不做任何事。rollback 失敗代表連線已損壞，直接丟棄。
+        串流回應中途被關閉 (GeneratorExit) 時同樣會歸還連線。
+        """
+        started = time.perf_counter()
+        pooled = self._acquire()
+        if self.on_acquire is not None:
+            self.on_acquire(time.perf_counter() - started)
+        try:
+            yield pooled.raw
+        finally:
+            discard = False
+            try:
+                pooled.raw.rollback()
+            except Exception:
+                discard = True
+            self._return(pooled, discard=discard)
+
+    def close_all(self):
+        """關閉所有閒置連線 (使用中的連線會在歸還時照常處理)。"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._available.notify_all()
+        for pooled in idle:
+            self._close_quietly(pooled)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time_total_seconds': round(self._wait_time_total, 6),
+                'wait_time_max_seconds': round(self._wait_time_max, 6),
+                'timeouts': self._timeouts,
+                'connects': self._connects,
+                'reconnects': self._reconnects,
+                'connect_retries': self._connect_retries,
+                'health_check_failures': self._health_check_failures,
+                'discarded': self._discarded,
+            }
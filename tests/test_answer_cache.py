@@ -0,0 +1,148 @@
+# tests/test_answer_cache.py
+# 兩層答案快取：TTL / LRU 淘汰、知識庫版本改變時失效、持久層查詢失敗後的冷卻。
+import os
+import sys
+import time
+
+from pymongo.errors import ServerSelectionTimeoutError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from answer_cache import AnswerCache, normalize_question  # noqa: E402
+
+
+class FakeQueriesCollection:
+    """只實作 find_one；error 不為 None 時丟出該例外。"""
+
+    def __init__(self, docs=(), error=None):
+        self.docs = list(docs)
+        self.error = error
+        self.queries = []
+
+    def find_one(self, query, sort=None):
+        self.queries.append(query)
+        if self.error is not None:
+            raise self.error
+        for doc in self.docs:
+            if all(doc.get(field) == value for field, value in query.items() if field != 'timestamp'):
+                return doc
+        return None
+
+
+class Versions:
+    def __init__(self, version='v1'):
+        self.version = version
+
+    def __call__(self):
+        return self.version
+
+
+def make_cache(**kwargs):
+    versions = kwargs.pop('versions', Versions())
+    cache = AnswerCache(kb_version_provider=versions, **kwargs)
+    cache.invalidate()  # 讀取目前的版本 (正式環境由背景執行緒讀取)
+    return cache, versions
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def test_normalize_question():
+    assert normalize_question("  忘記  密碼？") == normalize_question("忘記 密碼")
+    assert normalize_question("ＶＰＮ 連不上!!") == "vpn 連不上"
+
+
+def test_exact_hit_and_ttl_expiry():
+    cache, _ = make_cache(ttl_seconds=60)
+    cache.put("VPN 連不上？", None, "請重新登入", "內部", True)
+    entry = cache.get_exact("vpn 連不上")
+    assert entry is not None and entry.answer == "請重新登入"
+
+    entry.created_at -= 61
+    assert cache.get_exact("vpn 連不上") is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_lru_evicts_least_recently_used():
+    cache, _ = make_cache(max_entries=2)
+    cache.put("a", None, "A", "內部", True)
+    cache.put("b", None, "B", "內部", True)
+    assert cache.get_exact("a") is not None   # a 變成最近使用
+    cache.put("c", None, "C", "內部", True)
+
+    assert cache.get_exact("b") is None
+    assert cache.get_exact("a") is not None
+    assert cache.get_exact("c") is not None
+
+
+def test_semantic_hit_respects_threshold_and_eviction():
+    cache, _ = make_cache(max_entries=1, similarity_threshold=0.95)
+    cache.put("印表機卡紙", [1.0, 0.0], "打開後蓋", "內部", True)
+
+    entry, score = cache.get_similar([0.99, 0.05])
+    assert entry is not None and entry.answer == "打開後蓋" and score > 0.95
+    entry, score = cache.get_similar([0.0, 1.0])
+    assert entry is None and score < 0.95
+
+    # 被 LRU 淘汰的問題也不會再從向量矩陣命中
+    cache.put("VPN 連不上", [0.0, 1.0], "請重新登入", "內部", True)
+    assert cache.get_similar([1.0, 0.0])[0] is None
+
+
+def test_kb_version_change_invalidates_cache():
+    versions = Versions('v1')
+    cache = AnswerCache(kb_version_provider=versions, version_check_interval=0.01)
+    cache.start_version_refresh()
+    assert wait_until(lambda: cache.kb_version == 'v1')
+    cache.put("VPN 連不上", [1.0, 0.0], "請重新登入", "內部", True)
+    assert cache.get_exact("VPN 連不上") is not None
+
+    versions.version = 'v2'
+    assert wait_until(lambda: cache.kb_version == 'v2')
+    assert cache.get_exact("VPN 連不上") is None
+    assert cache.get_similar([1.0, 0.0])[0] is None
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_persistent_tier_hit():
+    doc = {
+        'normalized_question': normalize_question("VPN 連不上"), 'cacheable': True, 'kb_version': 'v1',
+        '回答': "請重新登入", '來源': "內部 (Qdrant)", 'timestamp': time.time(), 'query_vector': [1.0, 0.0],
+    }
+    collection = FakeQueriesCollection([doc])
+    cache, _ = make_cache(lookup_collection=collection)
+
+    entry = cache.get_exact("VPN 連不上？")
+    assert entry is not None and entry.answer == "請重新登入" and entry.is_internal
+    assert collection.queries[0]['kb_version'] == 'v1'
+    assert cache.stats()['persistent_hits'] == 1
+    # 之後由記憶體命中，不再查詢持久層
+    assert cache.get_exact("VPN 連不上") is not None
+    assert len(collection.queries) == 1
+
+
+def test_persistent_tier_cooldown_after_failure():
+    collection = FakeQueriesCollection(error=ServerSelectionTimeoutError("no servers"))
+    cache, _ = make_cache(lookup_collection=collection, lookup_failure_cooldown=0.2)
+
+    assert cache.get_exact("VPN 連不上") is None
+    assert cache.get_exact("印表機卡紙") is None
+    assert len(collection.queries) == 1   # 冷卻期間不再查詢
+
+    time.sleep(0.25)
+    collection.error = None
+    assert cache.get_exact("印表機卡紙") is None
+    assert len(collection.queries) == 2
+
+
+def test_persistent_tier_skipped_until_version_known():
+    collection = FakeQueriesCollection()
+    cache = AnswerCache(kb_version_provider=Versions(), lookup_collection=collection)
+    assert cache.get_exact("VPN 連不上") is None
+    assert collection.queries == []
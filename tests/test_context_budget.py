@@ -0,0 +1,130 @@
+# tests/test_context_budget.py
+# 檢索結果送進 prompt 前的後處理 (context_budget)。
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from context_budget import ContextBuilder, estimate_tokens, extractive_candidate  # noqa: E402
+from lexical_index import FusedHit  # noqa: E402
+
+
+class Hit:
+    """與 Qdrant ScoredPoint 相同的介面。"""
+
+    def __init__(self, id, score, text=''):
+        self.id = id
+        self.score = score
+        self.payload = {'text': text}
+
+
+def fused(id, dense, lexical, weight=0.3):
+    return FusedHit(id, dense, {'text': str(id)}, lexical, (1 - weight) * dense + weight * lexical)
+
+
+def test_extractive_plain_qdrant_hits_use_score():
+    top = Hit(1, 0.92)
+    assert extractive_candidate([Hit(2, 0.75), top], 0.8, 0.1) is top
+    assert extractive_candidate([top, Hit(2, 0.85)], 0.8, 0.1) is None
+    assert extractive_candidate([Hit(1, 0.79)], 0.8, 0.1) is None
+    assert extractive_candidate([], 0.8, 0.1) is None
+
+
+def test_extractive_fused_hits_use_cosine():
+    # cosine 0.95、沒有字詞重疊：融合分數只有 0.665，但仍應直接擷取
+    top = fused(1, 0.95, 0.0)
+    lexical_heavy = fused(2, 0.6, 1.0)
+    assert extractive_candidate([lexical_heavy, top], 0.8, 0.1) is top
+
+
+def test_extractive_margin_ignores_lexical_boost():
+    # BM25 最高的區塊多加 0.3 不應影響領先幅度的判斷
+    assert extractive_candidate([fused(1, 0.9, 0.0), fused(2, 0.85, 1.0)], 0.8, 0.1) is None
+
+
+def test_score_gap_cut_uses_cosine_and_keeps_fused_order():
+    builder = ContextBuilder(max_score_gap=0.08, min_relative_score=0.8)
+    # 融合排序第一的區塊 cosine 只有 0.8；cosine 0.5 的區塊即使字詞重疊最多也會被截斷
+    hits = [fused(1, 0.8, 1.0), fused(2, 0.85, 0.0), fused(3, 0.5, 0.9)]
+    assert [hit.id for hit in builder.cut_by_score_gap(hits)] == [1, 2]
+
+
+def test_score_gap_cut_relative_floor():
+    builder = ContextBuilder(max_score_gap=0.08, min_relative_score=0.8)
+    hits = [Hit(3, 0.70), Hit(1, 0.90), Hit(2, 0.86), Hit(4, 0.69)]
+    # 0.70 低於 0.9 × 0.8 = 0.72，之後的結果一律捨棄
+    assert [hit.id for hit in builder.cut_by_score_gap(hits)] == [1, 2]
+
+
+def test_score_gap_cut_adjacent_gap():
+    builder = ContextBuilder(max_score_gap=0.08, min_relative_score=0.5)
+    hits = [Hit(1, 0.60), Hit(2, 0.58), Hit(3, 0.49), Hit(4, 0.48)]
+    # 0.58 → 0.49 落差 0.09 超過 0.08
+    assert [hit.id for hit in builder.cut_by_score_gap(hits)] == [1, 2]
+
+
+def test_mmr_drops_near_duplicates():
+    builder = ContextBuilder(duplicate_threshold=0.85)
+    text = "印表機無法列印時，請先確認電源與網路線，再重新安裝驅動程式。"
+    hits = [
+        Hit(1, 0.9, text),
+        Hit(2, 0.88, text + " "),
+        Hit(3, 0.8, "VPN 無法連線時請確認帳號密碼是否過期。"),
+    ]
+    selected, duplicates = builder.select_mmr(hits)
+    assert [hit.id for hit in selected] == [1, 3]
+    assert duplicates == 1
+
+
+def test_pack_stops_at_budget_boundary():
+    builder = ContextBuilder(max_context_tokens=10)
+    hits = [Hit(i, 0.9, 'a' * 20) for i in range(3)]  # 每個區塊 5 tokens
+    packed, used = builder.pack(hits)
+    # 剛好等於預算時仍放得進去，第三個超過預算
+    assert [hit.id for hit, _ in packed] == [0, 1]
+    assert used == 10
+
+
+def test_pack_truncates_oversized_first_chunk():
+    builder = ContextBuilder(max_context_tokens=10)
+    packed, used = builder.pack([Hit(1, 0.9, '資料' * 20), Hit(2, 0.8, 'b')])
+    assert [hit.id for hit, _ in packed] == [1]
+    assert estimate_tokens(packed[0][1]) == used <= 10
+
+
+def test_pack_respects_max_chunks():
+    builder = ContextBuilder(max_chunks=2)
+    packed, _ = builder.pack([Hit(i, 0.9, 'x') for i in range(5)])
+    assert len(packed) == 2
+
+
+def test_build_empty_input():
+    builder = ContextBuilder()
+    packed, report = builder.build([])
+    assert packed == []
+    assert report == {
+        'candidates': 0,
+        'dropped_score_gap': 0,
+        'dropped_duplicate': 0,
+        'dropped_budget': 0,
+        'retained': 0,
+        'context_tokens': 0,
+    }
+    assert builder.stats()['requests'] == 1
+
+
+def test_build_report_counts_each_stage():
+    builder = ContextBuilder(max_score_gap=0.08, min_relative_score=0.8, max_context_tokens=11)
+    hits = [
+        Hit(1, 0.90, 'a' * 20),
+        Hit(2, 0.89, 'a' * 20),      # 與第一筆重複
+        Hit(3, 0.88, 'b' * 24),      # 5 + 6 = 11 tokens，剛好用完預算
+        Hit(4, 0.87, 'c' * 28),      # 超出預算
+        Hit(5, 0.50, 'd' * 20),      # 分數截斷
+    ]
+    packed, report = builder.build(hits)
+    assert [hit.id for hit, _ in packed] == [1, 3]
+    assert report['dropped_score_gap'] == 1
+    assert report['dropped_duplicate'] == 1
+    assert report['dropped_budget'] == 1
+    assert report['retained'] == 2
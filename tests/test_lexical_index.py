@@ -0,0 +1,110 @@
+# tests/test_lexical_index.py
+# 識別碼直接回傳 (LexicalIndex.match_identifier) 只對真正的單號 / 帳號生效，一般技術詞彙不能略過檢索與生成。
+# 執行：python -m pytest tests
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lexical_index import LexicalIndex, extract_identifiers  # noqa: E402
+
+CHUNKS = [
+    "#apache error code\n10000131\n錯誤 新增課程API失敗",
+    "#alpha\n帳號: alpha_tester05\n密碼: Test@alpha2025",
+    "#工單\nINC0012345 的處理進度請洽值班人員",
+    "#網路\n公司網路只支援 ipv4，win10 需要更新網卡驅動程式",
+    "#郵件\n附件上限 25MB，office365 信箱請改用 OneDrive 分享",
+    "#雜湊\n下載檔案後以 sha256 驗證，x86_64 與 h264 解碼器另外安裝",
+]
+
+
+@pytest.fixture
+def index():
+    lexical = LexicalIndex()
+    lexical.build([(i, {'text': text}, None) for i, text in enumerate(CHUNKS)], version='test')
+    return lexical
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("apache 出現 10000131 怎麼辦", {"10000131"}),
+    ("INC0012345 進度如何", {"inc0012345"}),
+    ("CHG-123456 何時上線", {"chg-123456"}),
+    ("alpha_tester05 的密碼", {"alpha_tester05"}),
+])
+def test_ticket_and_account_shapes_are_identifiers(question, expected):
+    assert extract_identifiers(question) == expected
+
+
+@pytest.mark.parametrize("word", [
+    "ipv4", "win10", "25mb", "office365", "sha256", "x86_64", "h264", "mp3", "utf-8", "win2019", "1234", "2025",
+])
+def test_common_tech_words_are_not_identifiers(word):
+    assert extract_identifiers(f"請問 {word} 的問題") == set()
+
+
+@pytest.mark.parametrize("question", [
+    "win10 連不上網路",
+    "ipv4 設定在哪裡",
+    "office365 附件太大",
+    "25MB 以上的附件怎麼寄",
+    "sha256 要怎麼驗證",
+])
+def test_tech_words_do_not_trigger_direct_answer(index, question):
+    # 這些詞都只出現在一個區塊，舊的規則會直接回傳該區塊而略過檢索與生成
+    assert index.match_identifier(question) is None
+
+
+def test_unique_identifier_returns_its_chunk(index):
+    assert index.match_identifier("10000131 是什麼錯誤")['text'] == CHUNKS[0]
+    assert index.match_identifier("INC0012345 進度")['text'] == CHUNKS[2]
+
+
+class DenseHit:
+    """與 Qdrant ScoredPoint 相同的介面。"""
+
+    def __init__(self, id, score, payload):
+        self.id = id
+        self.score = score
+        self.payload = payload
+
+
+@pytest.fixture
+def vector_index():
+    points = [
+        ('vpn', {'text': "VPN 連線設定"}, [1.0, 0.0]),
+        ('driver', {'text': "印表機驅動程式安裝"}, [0.8, 0.6]),
+        ('toner', {'text': "印表機碳粉更換"}, [0.6, 0.8]),
+        ('jam', {'text': "印表機卡紙"}, [0.0, 1.0]),
+    ]
+    lexical = LexicalIndex(weight=0.3, min_dense_score=0.4)
+    lexical.build(points, version='test')
+    return lexical
+
+
+def test_fuse_orders_by_fused_score_but_keeps_cosine_scores(vector_index):
+    dense_hits = [DenseHit('vpn', 1.0, {'text': "VPN 連線設定"})]
+    fused = vector_index.fuse("印表機驅動程式", [1.0, 0.0], dense_hits)
+
+    assert [hit.id for hit in fused] == ['driver', 'vpn', 'toner']
+    scores = {hit.id: hit.score for hit in fused}
+    # 沒有字詞重疊的向量結果仍保留原本的 cosine 分數，不會降到 0.7 × cosine
+    assert scores['vpn'] == 1.0
+    # 只被 BM25 找到的區塊以 cosine 分數表示
+    assert scores['driver'] == pytest.approx(0.8)
+    assert scores['toner'] == pytest.approx(0.6)
+    # BM25 最高的區塊排序分數 = 0.7 × cosine + 0.3
+    assert fused[0].lexical_score == pytest.approx(1.0)
+    assert fused[0].fused_score == pytest.approx(0.7 * 0.8 + 0.3)
+    assert fused[1].fused_score == pytest.approx(0.7)
+
+
+def test_fuse_drops_lexical_only_hits_below_dense_threshold(vector_index):
+    fused = vector_index.fuse("印表機卡紙", [1.0, 0.0], [])
+    assert 'jam' not in {hit.id for hit in fused}
+
+
+def test_fuse_without_lexical_match_returns_dense_hits(vector_index):
+    dense_hits = [DenseHit('vpn', 0.9, {'text': "VPN 連線設定"})]
+    assert vector_index.fuse("hello", [1.0, 0.0], dense_hits) is dense_hits
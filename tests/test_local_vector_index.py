@@ -0,0 +1,59 @@
+# tests/test_local_vector_index.py
+# 本機向量索引：檔案儲存 / 載入，以及重建時不受其他 worker 替換檔案影響
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from local_vector_index import LocalVectorIndex  # noqa: E402
+
+POINTS = [
+    ('a', {'text': 'alpha'}, [1.0, 0.0]),
+    ('b', {'text': 'beta'}, [0.0, 1.0]),
+    ('c', {'text': 'gamma'}, [1.0, 1.0]),
+]
+
+
+def test_build_without_path_searches_in_memory():
+    index = LocalVectorIndex()
+    assert index.build(POINTS, version='v1') == 3
+    hits = index.search([1.0, 0.0], limit=2)
+    assert [hit.id for hit in hits] == ['a', 'c']
+    assert abs(hits[0].score - 1.0) < 1e-6
+
+
+def test_build_with_path_saves_file_other_workers_can_load(tmp_path):
+    path = str(tmp_path / 'index.npy')
+    LocalVectorIndex(path=path).build(POINTS, version='v1')
+
+    other = LocalVectorIndex(path=path)
+    assert other.load_file('v2') is None
+    assert other.load_file('v1') == 3
+    assert other.stats()['memory_mapped'] is True
+    assert other.search([0.0, 1.0], limit=1)[0].id == 'b'
+
+
+def test_build_keeps_its_own_vectors_when_file_is_replaced(tmp_path, monkeypatch):
+    path = str(tmp_path / 'index.npy')
+    index = LocalVectorIndex(path=path)
+    original_save = index._save
+
+    def save_then_replaced_by_other_worker(ids, payloads, vectors, version):
+        original_save(ids, payloads, vectors, version)
+        # 另一個 worker 在儲存之後立刻寫入較新、筆數不同的版本
+        np.save(path, np.ones((1, 2), dtype=np.float32))
+
+    monkeypatch.setattr(index, '_save', save_then_replaced_by_other_worker)
+    assert index.build(POINTS, version='v1') == 3
+    assert index.stats()['points'] == 3
+    hits = index.search([0.0, 1.0], limit=3)
+    assert [hit.id for hit in hits] == ['b', 'c', 'a']
+
+
+def test_load_file_rejects_vector_count_mismatch(tmp_path):
+    path = str(tmp_path / 'index.npy')
+    LocalVectorIndex(path=path).build(POINTS, version='v1')
+    np.save(path, np.ones((1, 2), dtype=np.float32))
+    assert LocalVectorIndex(path=path).load_file('v1') is None
@@ -0,0 +1,67 @@
+# tests/test_log_cursor.py
+# /api/logs 的 keyset 分頁游標：編碼 / 解碼與下一頁的 SQL 條件。
+import base64
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from log_cursor import decode_log_cursor, encode_log_cursor, keyset_condition  # noqa: E402
+
+
+@pytest.mark.parametrize("log_date", [
+    datetime(2025, 3, 1, 12, 30, 59, 997000),
+    pd.Timestamp('2025-03-01 12:30:59.997'),
+    np.datetime64('2025-03-01T12:30:59.997'),
+])
+def test_round_trip_keeps_milliseconds(log_date):
+    assert decode_log_cursor(encode_log_cursor(log_date, 42)) == (datetime(2025, 3, 1, 12, 30, 59, 997000), 42)
+
+
+@pytest.mark.parametrize("log_date", [None, pd.NaT, np.nan])
+def test_round_trip_null_date(log_date):
+    assert decode_log_cursor(encode_log_cursor(log_date, np.int64(7))) == (None, 7)
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_log_cursor(datetime(2025, 3, 1), 10 ** 12)
+    assert cursor == base64.urlsafe_b64encode(base64.urlsafe_b64decode(cursor)).decode('ascii')
+    assert not set(cursor) - set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_=")
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"not json").decode('ascii'),
+    base64.urlsafe_b64encode(b'{"d": null}').decode('ascii'),
+    base64.urlsafe_b64encode(b'{"d": "yesterday", "i": 1}').decode('ascii'),
+    base64.urlsafe_b64encode(b'{"d": null, "i": "abc"}').decode('ascii'),
+    base64.urlsafe_b64encode(b'[1, 2]').decode('ascii'),
+])
+def test_malformed_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_log_cursor(cursor)
+
+
+def test_condition_casts_cursor_to_column_type():
+    cursor_date = datetime(2025, 3, 1, 12, 30, 59, 997000)
+    condition, params = keyset_condition((cursor_date, 42), 'datetime')
+    assert condition == (
+        "(log_date < CAST(? AS DATETIME) OR (log_date = CAST(? AS DATETIME) AND log_id < ?) OR log_date IS NULL)"
+    )
+    assert params == [cursor_date, cursor_date, 42]
+    assert "CAST(? AS DATETIME2(3))" in keyset_condition((cursor_date, 42), 'DATETIME2(3)')[0]
+
+
+def test_condition_for_null_date():
+    assert keyset_condition((None, 42)) == ("(log_date IS NULL AND log_id < ?)", [42])
+
+
+@pytest.mark.parametrize("sql_type", ["VARCHAR(20)", "DATETIME); DROP TABLE log_data; --", "DATETIME2(9)", ""])
+def test_condition_rejects_unknown_column_type(sql_type):
+    with pytest.raises(ValueError):
+        keyset_condition((datetime(2025, 3, 1), 1), sql_type)
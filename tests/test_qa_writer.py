@@ -0,0 +1,167 @@
+# tests/test_qa_writer.py
+# 問答記錄背景寫入器的 spool：寫入失敗改寫 spool、接手已結束行程的 spool 檔、以 _id 去除重複的補寫。
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+from pymongo.errors import BulkWriteError, ServerSelectionTimeoutError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qa_writer import BackgroundQAWriter, fcntl  # noqa: E402
+
+
+class FakeQACollection:
+    """insert_many(ordered=False) 的行為與 MongoDB 相同：寫入其餘記錄後，以 BulkWriteError 回報重複的 _id。"""
+
+    def __init__(self, docs=None, fail=False):
+        self.docs = dict(docs or {})
+        self.fail = fail
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def insert_many(self, records, ordered=True):
+        with self._lock:
+            self.calls += 1
+            if self.fail:
+                raise ServerSelectionTimeoutError("no servers")
+            errors = []
+            inserted = 0
+            for index, record in enumerate(records):
+                if record['_id'] in self.docs:
+                    errors.append({'index': index, 'code': 11000, 'errmsg': 'duplicate key'})
+                    continue
+                self.docs[record['_id']] = dict(record)
+                inserted += 1
+            if errors:
+                raise BulkWriteError({'writeErrors': errors, 'nInserted': inserted})
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def spool_lines(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_spool(path, records):
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def record(id):
+    return {'id': id, '_id': id, 'question': f"問題 {id}"}
+
+
+@pytest.fixture
+def make_writer(tmp_path):
+    writers = []
+
+    def make(collection, **kwargs):
+        kwargs.setdefault('flush_interval', 0.02)
+        kwargs.setdefault('retry_interval', 60)
+        writer = BackgroundQAWriter(collection, spool_dir=str(tmp_path), **kwargs)
+        writers.append(writer)
+        return writer
+
+    yield make
+    for writer in writers:
+        writer.close(timeout=2)
+
+
+def test_failed_insert_many_goes_to_spool(make_writer):
+    collection = FakeQACollection(fail=True)
+    writer = make_writer(collection)
+    writer.submit({'id': 'a', 'question': "VPN 連不上"})
+    writer.submit({'id': 'b', 'question': "印表機卡紙"})
+
+    assert wait_until(lambda: writer.stats()['spooled'] == 2)
+    assert [r['_id'] for r in spool_lines(writer.spool_path)] == ['a', 'b']
+    stats = writer.stats()
+    assert stats['failures'] >= 1 and not stats['mongodb_healthy'] and stats['spool_pending']
+    assert collection.docs == {}
+
+
+def test_spool_without_collection_then_replayed(make_writer):
+    writer = make_writer(None)
+    writer.submit({'id': 'a', 'question': "VPN 連不上"})
+    assert wait_until(lambda: writer.stats()['spooled'] == 1)
+
+    collection = FakeQACollection()
+    writer.collection = collection
+    assert wait_until(lambda: writer.stats()['replayed'] == 1)
+    assert set(collection.docs) == {'a'}
+    assert not writer.stats()['spool_pending']
+
+
+@pytest.mark.skipif(fcntl is None, reason="需要 fcntl.flock 判斷其他行程是否存活")
+def test_orphan_spool_with_free_lock_is_adopted_and_replayed(tmp_path, make_writer):
+    orphan = tmp_path / 'qa_spool_deadhost_1'
+    write_spool(f"{orphan}.jsonl.replaying", [record('a')])
+    write_spool(f"{orphan}.jsonl", [record('b'), record('c')])
+    (tmp_path / 'qa_spool_deadhost_1.lock').touch()
+
+    collection = FakeQACollection()
+    writer = make_writer(collection)
+
+    assert wait_until(lambda: writer.stats()['replayed'] == 3)
+    assert set(collection.docs) == {'a', 'b', 'c'}
+    assert writer.stats()['adopted'] == 3
+    assert not any(path.name.startswith('qa_spool_deadhost_1') for path in tmp_path.iterdir())
+
+
+@pytest.mark.skipif(fcntl is None, reason="需要 fcntl.flock 判斷其他行程是否存活")
+def test_spool_of_live_process_is_left_alone(tmp_path, make_writer):
+    live = tmp_path / 'qa_spool_livehost_2'
+    write_spool(f"{live}.jsonl", [record('a')])
+    with open(f"{live}.lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        collection = FakeQACollection()
+        writer = make_writer(collection)
+        writer.submit({'id': 'own', 'question': "VPN 連不上"})
+        assert wait_until(lambda: writer.stats()['written'] == 1)
+        time.sleep(0.1)
+        assert set(collection.docs) == {'own'}
+        assert os.path.exists(f"{live}.jsonl")
+        assert writer.stats()['adopted'] == 0
+
+
+def test_replay_with_same_id_does_not_duplicate(tmp_path, make_writer):
+    collection = FakeQACollection(docs={'a': record('a')})
+    own = tmp_path / f"qa_spool_{socket.gethostname()}_{os.getpid()}.jsonl"
+    # 同一筆記錄在 spool 中出現兩次 (例如補寫到一半結束後再次寫回)，其中一筆已寫入 MongoDB
+    write_spool(own, [record('a'), record('b'), record('b')])
+
+    writer = make_writer(collection)
+    assert writer.spool_path == str(own)
+    assert wait_until(lambda: not writer.stats()['spool_pending'])
+
+    assert set(collection.docs) == {'a', 'b'}
+    stats = writer.stats()
+    assert stats['replayed'] == 1
+    assert stats['failures'] == 0 and stats['mongodb_healthy']
+
+
+def test_failed_replay_keeps_records_in_spool(tmp_path, make_writer):
+    collection = FakeQACollection(fail=True)
+    writer = make_writer(None)
+    writer.submit({'id': 'a', 'question': "VPN 連不上"})
+    assert wait_until(lambda: writer.stats()['spooled'] == 1)
+
+    writer.collection = collection
+    assert wait_until(lambda: collection.calls >= 1 and writer.stats()['failures'] >= 1)
+    # .replaying 在剩餘記錄寫回 spool 之後才刪除，記錄不會遺失
+    assert wait_until(lambda: not os.path.exists(f"{writer.spool_path}.replaying"))
+    assert [r['_id'] for r in spool_lines(writer.spool_path)] == ['a']
@@ -0,0 +1,323 @@
+# tests/test_single_flight.py
+# single-flight 的併發行為：只有一個 leader 執行、其他請求共用結果 (或例外)、等待逾時改為自行執行。
+import asyncio
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from pymongo.errors import DuplicateKeyError, ServerSelectionTimeoutError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from single_flight import AsyncSingleFlight, MongoFlightLease, SingleFlight  # noqa: E402
+
+# follower 進入等待所需的時間 (執行緒啟動 / 輪詢)
+SETTLE_SECONDS = 0.2
+
+
+class Blocker:
+    """leader 執行的 fn：記錄呼叫次數，並停住直到 release() (例外時改為丟出 error)。"""
+
+    def __init__(self, result='answer', error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self._release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        assert self._release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def release(self):
+        self._release.set()
+
+
+def run_in_threads(count, target):
+    outcomes = [None] * count
+
+    def worker(i):
+        try:
+            outcomes[i] = ('ok', target())
+        except Exception as e:
+            outcomes[i] = ('error', e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+
+def join_all(threads):
+    for thread in threads:
+        thread.join(5)
+        assert not thread.is_alive()
+
+
+# --- SingleFlight (執行緒) ---
+def test_followers_share_leader_result():
+    flight = SingleFlight(timeout=5)
+    leader_fn = Blocker()
+    leader, leader_outcome = run_in_threads(1, lambda: flight.do('q', leader_fn))
+    assert leader_fn.started.wait(5)
+    follower_fn = Blocker(result='own')
+    followers, outcomes = run_in_threads(4, lambda: flight.do('q', follower_fn))
+    time.sleep(SETTLE_SECONDS)
+    leader_fn.release()
+    join_all(leader + followers)
+
+    assert leader_outcome == [('ok', ('answer', False))]
+    assert outcomes == [('ok', ('answer', True))] * 4
+    assert leader_fn.calls == 1 and follower_fn.calls == 0
+    assert flight.stats() == {'leaders': 1, 'shared': 4, 'timeouts': 0}
+
+
+def test_leader_exception_reaches_followers():
+    flight = SingleFlight(timeout=5)
+    error = RuntimeError("generation failed")
+    leader_fn = Blocker(error=error)
+    leader, leader_outcome = run_in_threads(1, lambda: flight.do('q', leader_fn))
+    assert leader_fn.started.wait(5)
+    followers, outcomes = run_in_threads(3, lambda: flight.do('q', Blocker()))
+    time.sleep(SETTLE_SECONDS)
+    leader_fn.release()
+    join_all(leader + followers)
+
+    assert leader_outcome == [('error', error)]
+    assert outcomes == [('error', error)] * 3
+    # 失敗的呼叫不會留下來，下一個請求重新執行
+    assert flight.do('q', lambda: 'retry') == ('retry', False)
+
+
+def test_follower_runs_itself_after_timeout():
+    flight = SingleFlight(timeout=0.05)
+    leader_fn = Blocker()
+    leader, _ = run_in_threads(1, lambda: flight.do('q', leader_fn))
+    assert leader_fn.started.wait(5)
+    try:
+        assert flight.do('q', lambda: 'own') == ('own', False)
+    finally:
+        leader_fn.release()
+        join_all(leader)
+    assert flight.stats()['timeouts'] == 1
+
+
+def test_different_keys_do_not_wait():
+    flight = SingleFlight(timeout=5)
+    leader_fn = Blocker()
+    leader, _ = run_in_threads(1, lambda: flight.do('a', leader_fn))
+    assert leader_fn.started.wait(5)
+    try:
+        assert flight.do('b', lambda: 'b') == ('b', False)
+    finally:
+        leader_fn.release()
+        join_all(leader)
+
+
+# --- AsyncSingleFlight ---
+def test_async_followers_share_leader_result():
+    async def scenario():
+        flight = AsyncSingleFlight(timeout=5)
+        release = asyncio.Event()
+        calls = []
+
+        async def generate():
+            calls.append(1)
+            await release.wait()
+            return 'answer'
+
+        tasks = [asyncio.create_task(flight.do('q', generate)) for _ in range(5)]
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(*tasks), calls, flight.stats()
+
+    results, calls, stats = asyncio.run(scenario())
+    assert results == [('answer', False)] + [('answer', True)] * 4
+    assert len(calls) == 1
+    assert stats == {'leaders': 1, 'shared': 4, 'timeouts': 0}
+
+
+def test_async_leader_exception_reaches_followers():
+    async def scenario():
+        flight = AsyncSingleFlight(timeout=5)
+        release = asyncio.Event()
+
+        async def generate():
+            await release.wait()
+            raise RuntimeError("generation failed")
+
+        tasks = [asyncio.create_task(flight.do('q', generate)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len({id(result) for result in results}) == 1
+
+
+def test_async_follower_runs_itself_after_timeout():
+    async def scenario():
+        flight = AsyncSingleFlight(timeout=0.05)
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            return 'leader'
+
+        async def own():
+            return 'own'
+
+        leader = asyncio.create_task(flight.do('q', slow))
+        await asyncio.sleep(0)
+        follower = await flight.do('q', own)
+        release.set()
+        return follower, await leader, flight.stats()
+
+    follower, leader, stats = asyncio.run(scenario())
+    assert follower == ('own', False)
+    assert leader == ('leader', False)
+    assert stats['timeouts'] == 1
+
+
+# --- MongoFlightLease (以記憶體中的假 collection 模擬 MongoDB) ---
+class FakeLeaseCollection:
+    """只實作 MongoFlightLease 用到的操作與查詢條件；以鎖模擬 MongoDB 單一文件操作的原子性。"""
+
+    def __init__(self):
+        self.docs = {}
+        self._lock = threading.Lock()
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def insert_one(self, doc):
+        with self._lock:
+            if doc['_id'] in self.docs:
+                raise DuplicateKeyError("duplicate key")
+            self.docs[doc['_id']] = dict(doc)
+
+    def find_one(self, query):
+        with self._lock:
+            doc = self.docs.get(query['_id'])
+            return dict(doc) if doc is not None else None
+
+    def find_one_and_update(self, query, update):
+        with self._lock:
+            doc = self.docs.get(query['_id'])
+            if doc is None or not doc['expires_at'] < query['expires_at']['$lt']:
+                return None
+            before = dict(doc)
+            doc.update(update['$set'])
+            for field in update.get('$unset', {}):
+                doc.pop(field, None)
+            return before
+
+    def update_one(self, query, update):
+        with self._lock:
+            doc = self.docs.get(query['_id'])
+            if doc is not None and doc['owner'] == query['owner']:
+                doc.update(update['$set'])
+
+    def delete_one(self, query):
+        with self._lock:
+            doc = self.docs.get(query['_id'])
+            if doc is not None and doc['owner'] == query['owner']:
+                del self.docs[query['_id']]
+
+
+class BrokenCollection:
+    def __init__(self):
+        self.calls = 0
+
+    def insert_one(self, doc):
+        self.calls += 1
+        raise ServerSelectionTimeoutError("no servers")
+
+
+def lease(collection, **kwargs):
+    kwargs.setdefault('poll_interval', 0.01)
+    kwargs.setdefault('timeout', 5)
+    return MongoFlightLease(collection, **kwargs)
+
+
+def test_lease_follower_worker_gets_leader_result():
+    collection = FakeLeaseCollection()
+    worker_a, worker_b = lease(collection), lease(collection)
+    leader_fn = Blocker()
+    leader, leader_outcome = run_in_threads(1, lambda: worker_a.run('q', leader_fn))
+    assert leader_fn.started.wait(5)
+    follower_fn = Blocker(result='own')
+    followers, outcomes = run_in_threads(2, lambda: worker_b.run('q', follower_fn))
+    time.sleep(SETTLE_SECONDS)
+    leader_fn.release()
+    join_all(leader + followers)
+
+    assert leader_outcome == [('ok', ('answer', False))]
+    assert outcomes == [('ok', ('answer', True))] * 2
+    assert follower_fn.calls == 0
+    assert worker_a.stats()['leaders'] == 1
+    assert worker_b.stats()['shared'] == 2
+
+
+def test_lease_released_when_leader_fails():
+    collection = FakeLeaseCollection()
+    worker_a, worker_b = lease(collection), lease(collection)
+    leader_fn = Blocker(error=RuntimeError("generation failed"))
+    leader, leader_outcome = run_in_threads(1, lambda: worker_a.run('q', leader_fn))
+    assert leader_fn.started.wait(5)
+    followers, outcomes = run_in_threads(1, lambda: worker_b.run('q', lambda: 'own'))
+    time.sleep(SETTLE_SECONDS)
+    leader_fn.release()
+    join_all(leader + followers)
+
+    assert leader_outcome[0][0] == 'error'
+    # 租約立即釋放，等待中的 worker 接手自行處理，而不是等到逾時
+    assert outcomes == [('ok', ('own', False))]
+    assert worker_b.stats()['timeouts'] == 0
+
+
+def test_lease_follower_runs_itself_after_timeout():
+    collection = FakeLeaseCollection()
+    worker_a, worker_b = lease(collection), lease(collection, timeout=0.05)
+    leader_fn = Blocker()
+    leader, _ = run_in_threads(1, lambda: worker_a.run('q', leader_fn))
+    assert leader_fn.started.wait(5)
+    try:
+        assert worker_b.run('q', lambda: 'own') == ('own', False)
+    finally:
+        leader_fn.release()
+        join_all(leader)
+    assert worker_b.stats()['timeouts'] == 1
+
+
+def test_expired_lease_is_taken_over():
+    collection = FakeLeaseCollection()
+    worker = lease(collection)
+    collection.docs[worker._lease_id('q')] = {
+        '_id': worker._lease_id('q'), 'owner': 'dead-worker', 'state': 'running',
+        'expires_at': datetime(2000, 1, 1, tzinfo=timezone.utc),
+    }
+    assert worker.run('q', lambda: 'answer') == ('answer', False)
+    assert collection.docs[worker._lease_id('q')]['owner'] == worker.owner
+
+
+def test_lease_failure_opens_circuit():
+    collection = BrokenCollection()
+    worker = lease(collection, failure_cooldown=60)
+    assert worker.run('q', lambda: 'answer') == ('answer', False)
+    assert worker.run('q', lambda: 'answer') == ('answer', False)
+    # 第一次失敗後冷卻期間不再呼叫 MongoDB
+    assert collection.calls == 1
+    assert worker.stats()['bypassed'] == 1
+
+
+def test_lease_without_collection_runs_directly():
+    assert lease(None).run('q', lambda: 'answer') == ('answer', False)
+
@@ -0,0 +1,78 @@
+# tests/test_sql_pool.py
+# 連線歸還前一定會 rollback；rollback 失敗的連線不會再被借出。
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sql_pool import SQLConnectionPool  # noqa: E402
+
+
+class FakeConnection:
+    def __init__(self, fail_rollback=False):
+        self.fail_rollback = fail_rollback
+        self.rollbacks = 0
+        self.closed = False
+
+    def rollback(self):
+        self.rollbacks += 1
+        if self.fail_rollback:
+            raise RuntimeError("connection is broken")
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(connections):
+    opened = iter(connections)
+    return SQLConnectionPool(lambda: next(opened), max_size=1, timeout=0.1, retries=1)
+
+
+def test_successful_block_rolls_back_before_reuse():
+    conn = FakeConnection()
+    pool = make_pool([conn])
+    with pool.connection() as raw:
+        assert raw is conn
+    assert conn.rollbacks == 1
+    with pool.connection() as raw:
+        assert raw is conn
+    assert pool.stats()['connects'] == 1
+
+
+def test_exception_rolls_back_and_propagates():
+    conn = FakeConnection()
+    pool = make_pool([conn])
+    with pytest.raises(ValueError):
+        with pool.connection():
+            raise ValueError("query failed")
+    assert conn.rollbacks == 1
+    assert pool.stats()['idle'] == 1
+
+
+def test_failed_rollback_discards_connection():
+    broken, fresh = FakeConnection(fail_rollback=True), FakeConnection()
+    pool = make_pool([broken, fresh])
+    with pool.connection():
+        pass
+    assert broken.closed
+    assert pool.stats()['discarded'] == 1
+    with pool.connection() as raw:
+        assert raw is fresh
+
+
+def test_closed_generator_returns_connection():
+    conn = FakeConnection()
+    pool = make_pool([conn])
+
+    def stream():
+        with pool.connection():
+            yield 1
+            yield 2
+
+    rows = stream()
+    next(rows)
+    rows.close()
+    assert conn.rollbacks == 1
+    assert pool.stats()['in_use'] == 0
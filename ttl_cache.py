@@ -0,0 +1,72 @@
+# ttl_cache.py
+# 行程內的小型 TTL 快取，用於計算成本高、但可以接受短暫過期的彙總結果 (例如 /api/logs/summary)。
+# 資料異動時由呼叫端 invalidate()；同一個 key 過期時只有一個執行緒重新計算，其他執行緒等待結果。
+import threading
+import time
+
+
+class TTLCache:
+    """
+    執行緒安全；get_or_load(key, loader) 回傳 (值, 是否來自快取)。
+    loader 丟出例外時不快取，例外照常傳給呼叫端。
+    """
+
+    def __init__(self, ttl_seconds=15, max_entries=64):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._entries = {}   # key -> (到期時間, 值, generation)
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def _get_fresh(self, key):
+        # 呼叫端需持有 self._lock
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic() or entry[2] != self._generation:
+            return None
+        return entry
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            entry = self._get_fresh(key)
+            if entry is not None:
+                self._hits += 1
+                return entry[1], True
+        with self._load_lock:
+            with self._lock:
+                # 等待期間可能已由其他執行緒算好
+                entry = self._get_fresh(key)
+                if entry is not None:
+                    self._hits += 1
+                    return entry[1], True
+                self._misses += 1
+                generation = self._generation
+            value = loader()
+            with self._lock:
+                # 計算期間若已被 invalidate()，結果可能不含最新的異動，不放入快取
+                if generation == self._generation:
+                    if len(self._entries) >= self.max_entries:
+                        self._entries.clear()
+                    self._entries[key] = (time.monotonic() + self.ttl_seconds, value, generation)
+            return value, False
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self._invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+                'invalidations': self._invalidations,
+            }